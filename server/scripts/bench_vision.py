@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+"""
+Replay benchmark for the MLX Vision OCR sidecar.
+
+Replays a directory of receipt images against POST /extract and reports
+latency percentiles, throughput, cache hit ratio and tokens/s. The mix of
+repeat uploads is configurable. Some requests resend an earlier image
+byte-for-byte (exact-cache hits). Others resend it re-encoded at the same
+size, with a JPEG quality and a slight brightness change, like a receipt
+that went through another app's compression. These can only hit the
+near-duplicate tier when the sidecar runs with MLX_PHASH_THRESHOLD set
+(e.g. 6); it is off by default and then every near-duplicate is a miss.
+The report counts near-duplicate outcomes, so a run shows which it was.
+Rescaled copies are not generated: the detail-print check refuses them
+by design (see vision_cache.py).
+
+Load models:
+    closed loop  — --concurrency N clients, each sending its next request
+                   as soon as the previous one answers
+    open loop    — --rate R requests/s with Poisson (exponential) gaps,
+                   independent of how fast the sidecar answers. Latency
+                   is measured from the scheduled send time, so requests
+                   stuck behind a slow one still count their wait.
+
+A run can be saved as a baseline and later runs compared against it.
+The exit status is 1 when a metric regresses by more than --tolerance.
+
+Usage:
+    python server/scripts/bench_vision.py ~/receipts --requests 200 --concurrency 4
+    python server/scripts/bench_vision.py ~/receipts --rate 2 --duplicates 0.3 --near-duplicates 0.1
+    python server/scripts/bench_vision.py ~/receipts --save-baseline bench.json
+    python server/scripts/bench_vision.py ~/receipts --baseline bench.json --tolerance 0.15
+
+Start the sidecar with an empty cache (MLX_DISK_CACHE_PATH= and a fresh
+process) for numbers that reflect only this run's duplicate mix.
+
+Stdlib only; Pillow is needed for --near-duplicates.
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import http.client
+import io
+import json
+import math
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urlsplit
+
+IMAGE_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".bmp": "image/bmp",
+    ".tiff": "image/tiff",
+    ".pdf": "application/pdf",
+}
+
+# (metric, direction): +1 → higher is worse, -1 → lower is worse.
+REGRESSION_CHECKS = (
+    ("latency_s.p50", +1),
+    ("latency_s.p95", +1),
+    ("latency_s.p99", +1),
+    ("throughput_rps", -1),
+    ("tokens_per_second", -1),
+    ("error_ratio", +1),
+)
+
+
+# ── Workload ───────────────────────────────────────────────────────
+
+@dataclass
+class Item:
+    kind: str        # fresh | duplicate | near-duplicate
+    source: str      # file name the payload came from
+    mime_type: str
+    payload: str | None   # base64, one shared string per distinct image; None for near-duplicates
+    original: bytes = b""  # near-duplicates: the file's bytes, perturbed at send time
+    seed: int = 0          # near-duplicates: perturbation seed, fixed by --seed
+    repeated: bool = False  # payload is sent more than once, so its request body is worth keeping
+
+
+def _perturb(data: bytes, rng: random.Random) -> bytes:
+    """Same receipt, different bytes: same size, ±3% brightness, JPEG re-encode."""
+    from PIL import Image, ImageEnhance
+
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    img = ImageEnhance.Brightness(img).enhance(rng.uniform(0.97, 1.03))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=rng.randint(70, 92))
+    return buf.getvalue()
+
+
+def build_workload(
+    files: list[Path], requests: int, dup_ratio: float, near_ratio: float, rng: random.Random
+) -> list[Item]:
+    """Request sequence: each slot repeats an earlier image, perturbs one, or takes a new file.
+
+    Each file is read and base64-encoded once; duplicates share its string.
+    Near-duplicates only record a seed and are rendered when sent, so
+    memory grows with distinct images, not with --requests.
+    """
+    fresh = list(files)
+    rng.shuffle(fresh)
+    sent: list[tuple[Path, bytes, str]] = []
+    items: list[Item] = []
+    wrapped = False
+    for _ in range(requests):
+        roll = rng.random()
+        if sent and roll < dup_ratio:
+            path, _, payload = rng.choice(sent)
+            items.append(Item("duplicate", path.name, IMAGE_TYPES[path.suffix.lower()], payload))
+            continue
+        images = [(p, d) for p, d, _ in sent if p.suffix.lower() != ".pdf"]
+        if images and roll < dup_ratio + near_ratio:
+            path, data = rng.choice(images)
+            items.append(Item("near-duplicate", path.name, "image/jpeg", None, data, rng.getrandbits(32)))
+            continue
+        if len(sent) >= len(fresh):
+            wrapped = True
+        path = fresh[len(sent) % len(fresh)]
+        if len(sent) < len(fresh):
+            data = path.read_bytes()
+            payload = _b64(data)
+        else:
+            _, data, payload = sent[len(sent) % len(fresh)]
+        sent.append((path, data, payload))
+        items.append(Item("fresh", path.name, IMAGE_TYPES[path.suffix.lower()], payload))
+    uses = Counter(id(item.payload) for item in items if item.payload is not None)
+    for item in items:
+        item.repeated = item.payload is not None and uses[id(item.payload)] > 1
+    if wrapped:
+        print(
+            f"⚠️  Only {len(files)} distinct files — some 'fresh' requests repeat an image "
+            f"and will hit the cache. Add images or lower --requests.",
+            file=sys.stderr,
+        )
+    return items
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+# ── Client ─────────────────────────────────────────────────────────
+
+class Client:
+    """One keep-alive HTTP connection per worker thread."""
+
+    def __init__(self, url: str, timeout: float, max_tokens: int | None):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.base = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.max_tokens = max_tokens
+        self._local = threading.local()
+        # Serialised /extract bodies of repeated payloads, built on first
+        # send: duplicates don't pay json.dumps of a multi-MB string again.
+        self._bodies: dict[int, bytes] = {}
+        self._bodies_lock = threading.Lock()
+
+    def _conn(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def request(self, method: str, path: str, body: dict | bytes | None = None) -> tuple[int, dict]:
+        data = json.dumps(body).encode("utf-8") if isinstance(body, dict) else body
+        headers = {"Content-Type": "application/json"} if data else {}
+        for attempt in (1, 2):
+            conn = self._conn()
+            try:
+                conn.request(method, self.base + path, body=data, headers=headers)
+                response = conn.getresponse()
+                raw = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # Server closed an idle keep-alive connection; reconnect once.
+                conn.close()
+                self._local.conn = None
+                if attempt == 2:
+                    raise
+        try:
+            payload = json.loads(raw) if raw else {}
+        except json.JSONDecodeError:
+            payload = {"detail": raw[:200].decode("utf-8", "replace")}
+        return response.status, payload
+
+    def body(self, item: Item) -> bytes:
+        """The /extract request body; callers build it before starting the clock."""
+        if item.repeated:
+            with self._bodies_lock:
+                data = self._bodies.get(id(item.payload))
+            if data is not None:
+                return data
+        payload = item.payload
+        if payload is None:
+            payload = _b64(_perturb(item.original, random.Random(item.seed)))
+        body = {"image": payload, "mime_type": item.mime_type}
+        if self.max_tokens:
+            body["max_tokens"] = self.max_tokens
+        data = json.dumps(body).encode("utf-8")
+        if item.repeated:
+            with self._bodies_lock:
+                self._bodies[id(item.payload)] = data
+        return data
+
+    def extract(self, data: bytes) -> tuple[int, dict]:
+        return self.request("POST", "/extract", data)
+
+
+@dataclass
+class Sample:
+    kind: str
+    status: int
+    latency_s: float
+    cache: str | None = None
+    tokens: int = 0
+    error: str | None = None
+
+
+def _send(client: Client, kind: str, body: bytes, scheduled: float) -> Sample:
+    try:
+        status, payload = client.extract(body)
+    except (OSError, http.client.HTTPException) as e:
+        return Sample(kind, 0, time.perf_counter() - scheduled, error=str(e))
+    latency = time.perf_counter() - scheduled
+    if status != 200:
+        return Sample(kind, status, latency, error=str(payload.get("detail"))[:200])
+    tokens = 0
+    if payload.get("cache") == "miss":
+        # Hits carry the stats of the generation that filled the cache.
+        tokens = (payload.get("stats") or {}).get("generation_tokens") or 0
+    return Sample(kind, status, latency, payload.get("cache"), tokens)
+
+
+def run_closed(client: Client, items: list[Item], concurrency: int) -> tuple[list[Sample], float]:
+    it = iter(items)
+    lock = threading.Lock()
+    samples: list[Sample] = []
+
+    def worker() -> None:
+        while True:
+            with lock:
+                item = next(it, None)
+            if item is None:
+                return
+            body = client.body(item)
+            sample = _send(client, item.kind, body, time.perf_counter())
+            with lock:
+                samples.append(sample)
+            _progress(len(samples), len(items))
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - t0
+
+
+def run_open(
+    client: Client, items: list[Item], rate: float, max_in_flight: int, rng: random.Random
+) -> tuple[list[Sample], float]:
+    samples: list[Sample] = []
+    lock = threading.Lock()
+
+    def task(kind: str, body: bytes, scheduled: float) -> None:
+        sample = _send(client, kind, body, scheduled)
+        with lock:
+            samples.append(sample)
+        _progress(len(samples), len(items))
+
+    t0 = time.perf_counter()
+    due = t0
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        for item in items:
+            due += rng.expovariate(rate)
+            body = client.body(item)  # Near-duplicates are rendered here, ahead of their slot.
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(task, item.kind, body, due)
+    return samples, time.perf_counter() - t0
+
+
+def _progress(done: int, total: int) -> None:
+    if sys.stderr.isatty() and (done == total or done % 10 == 0):
+        print(f"\r  {done}/{total}", end="\n" if done == total else "", file=sys.stderr, flush=True)
+
+
+# ── Report ─────────────────────────────────────────────────────────
+
+def percentile(sorted_values: list[float], p: float) -> float | None:
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    lo, hi = math.floor(k), math.ceil(k)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarise(samples: list[Sample], wall_s: float, config: dict) -> dict:
+    ok = [s for s in samples if s.status == 200]
+    latencies = sorted(s.latency_s for s in ok)
+    cache_counts: dict[str, int] = {}
+    for s in ok:
+        cache_counts[s.cache or "unknown"] = cache_counts.get(s.cache or "unknown", 0) + 1
+    served_from_cache = sum(n for c, n in cache_counts.items() if c != "miss")
+    by_kind: dict[str, dict] = {}
+    for kind in ("fresh", "duplicate", "near-duplicate"):
+        kl = sorted(s.latency_s for s in ok if s.kind == kind)
+        if kl:
+            by_kind[kind] = {
+                "requests": len(kl),
+                "p50": _round(percentile(kl, 50)),
+                "p95": _round(percentile(kl, 95)),
+            }
+    near_outcomes: dict[str, int] = {}
+    for s in samples:
+        if s.kind == "near-duplicate":
+            outcome = (s.cache or "unknown") if s.status == 200 else "error"
+            near_outcomes[outcome] = near_outcomes.get(outcome, 0) + 1
+    errors: dict[str, int] = {}
+    for s in samples:
+        if s.status != 200:
+            key = "rejected (429)" if s.status == 429 else f"HTTP {s.status}" if s.status else "connection"
+            errors[key] = errors.get(key, 0) + 1
+    return {
+        "config": config,
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": errors,
+        "error_ratio": round((len(samples) - len(ok)) / max(1, len(samples)), 4),
+        "wall_s": round(wall_s, 3),
+        "throughput_rps": round(len(ok) / wall_s, 3) if wall_s else 0.0,
+        "latency_s": {
+            "mean": _round(statistics.fmean(latencies)) if latencies else None,
+            "p50": _round(percentile(latencies, 50)),
+            "p95": _round(percentile(latencies, 95)),
+            "p99": _round(percentile(latencies, 99)),
+            "max": _round(latencies[-1]) if latencies else None,
+        },
+        "latency_by_kind_s": by_kind,
+        "cache": cache_counts,
+        "cache_hit_ratio": round(served_from_cache / max(1, len(ok)), 4),
+        "near_duplicates": {
+            "sent": sum(near_outcomes.values()),
+            "near_hits": near_outcomes.get("near-hit", 0),
+            "outcomes": near_outcomes,
+        },
+        "generated_tokens": sum(s.tokens for s in ok),
+        "tokens_per_second": round(sum(s.tokens for s in ok) / wall_s, 2) if wall_s else 0.0,
+    }
+
+
+def _round(value: float | None) -> float | None:
+    return round(value, 4) if value is not None else None
+
+
+def _lookup(report: dict, dotted: str) -> float | None:
+    value: object = report
+    for part in dotted.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value if isinstance(value, (int, float)) else None
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[dict]:
+    """One row per metric; `regressed` when worse than baseline by more than tolerance."""
+    rows = []
+    for metric, direction in REGRESSION_CHECKS:
+        now, before = _lookup(report, metric), _lookup(baseline, metric)
+        if now is None or before is None:
+            continue
+        if before == 0:
+            change = 0.0 if now == 0 else math.inf
+        else:
+            change = (now - before) / before
+        rows.append({
+            "metric": metric,
+            "baseline": before,
+            "current": now,
+            "change": round(change, 4) if math.isfinite(change) else None,
+            "regressed": change * direction > tolerance,
+        })
+    return rows
+
+
+def print_report(report: dict) -> None:
+    cfg = report["config"]
+    mode = (
+        f"closed loop, concurrency {cfg['concurrency']}"
+        if cfg["mode"] == "closed"
+        else f"open loop, Poisson {cfg['rate']}/s"
+    )
+    lat = report["latency_s"]
+
+    def fmt(v: float | None) -> str:
+        return f"{v * 1000:.0f}ms" if v is not None else "—"
+
+    print("═" * 60)
+    print(f"  {report['requests']} requests — {mode}")
+    print(f"  dup {cfg['duplicates']:.0%}  near-dup {cfg['near_duplicates']:.0%}  seed {cfg['seed']}")
+    print("═" * 60)
+    print(f"  ok {report['ok']}  errors {report['errors'] or 0}  wall {report['wall_s']:.1f}s")
+    print(f"  latency  p50 {fmt(lat['p50'])}  p95 {fmt(lat['p95'])}  p99 {fmt(lat['p99'])}  max {fmt(lat['max'])}")
+    for kind, kl in report["latency_by_kind_s"].items():
+        print(f"    {kind:<15} n={kl['requests']:<5} p50 {fmt(kl['p50'])}  p95 {fmt(kl['p95'])}")
+    print(f"  throughput {report['throughput_rps']:.2f} req/s   {report['tokens_per_second']:.1f} tok/s")
+    print(f"  cache hit ratio {report['cache_hit_ratio']:.1%}  {report['cache']}")
+    near = report["near_duplicates"]
+    if near["sent"]:
+        print(f"  near-duplicates {near['near_hits']}/{near['sent']} near-hit  {near['outcomes']}")
+
+
+def print_comparison(rows: list[dict], tolerance: float) -> None:
+    print("─" * 60)
+    print(f"  vs baseline (tolerance {tolerance:.0%})")
+    for row in rows:
+        change = f"{row['change']:+.1%}" if row["change"] is not None else "new"
+        flag = "  ❌ REGRESSION" if row["regressed"] else ""
+        print(f"    {row['metric']:<20} {row['baseline']:>10} → {row['current']:<10} {change:>8}{flag}")
+
+
+# ── CLI ────────────────────────────────────────────────────────────
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Replay receipt images against the MLX vision sidecar")
+    parser.add_argument("directory", type=Path, help="Directory of receipt images (searched recursively)")
+    parser.add_argument("--url", default="http://localhost:8787", help="Sidecar base URL (default: %(default)s)")
+    parser.add_argument("--requests", type=int, default=100, help="Requests to send (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Closed-loop clients (default: %(default)s)")
+    parser.add_argument("--rate", type=float, default=None, help="Open loop: mean arrivals per second (Poisson)")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Open-loop client thread cap (default: %(default)s)")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="Share of exact repeat uploads (0–1)")
+    parser.add_argument(
+        "--near-duplicates",
+        type=float,
+        default=0.0,
+        help="Share of same-size re-encoded repeats (0–1); they only hit if the sidecar sets MLX_PHASH_THRESHOLD",
+    )
+    parser.add_argument("--max-tokens", type=int, default=None, help="max_tokens per request (server default if unset)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout in seconds (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="Workload and arrival seed (default: %(default)s)")
+    parser.add_argument("--json", type=Path, default=None, help="Write the report as JSON here")
+    parser.add_argument("--save-baseline", type=Path, default=None, help="Save this run as the baseline")
+    parser.add_argument("--baseline", type=Path, default=None, help="Compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression (default: %(default)s)")
+    args = parser.parse_args()
+
+    if not 0 <= args.duplicates + args.near_duplicates <= 1:
+        parser.error("--duplicates + --near-duplicates must be between 0 and 1")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+    files = sorted(p for p in args.directory.expanduser().rglob("*") if p.suffix.lower() in IMAGE_TYPES)
+    if not files:
+        parser.error(f"No images ({', '.join(IMAGE_TYPES)}) under {args.directory}")
+    if args.near_duplicates:
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            parser.error("--near-duplicates needs Pillow (pip install pillow)")
+
+    rng = random.Random(args.seed)
+    items = build_workload(files, args.requests, args.duplicates, args.near_duplicates, rng)
+    client = Client(args.url, args.timeout, args.max_tokens)
+    try:
+        status, health = client.request("GET", "/health")
+    except OSError as e:
+        print(f"❌ Sidecar unreachable at {args.url}: {e}", file=sys.stderr)
+        return 2
+    if status != 200 or not health.get("ready"):
+        print(f"⚠️  Sidecar not ready (HTTP {status}) — results include warmup", file=sys.stderr)
+    near_threshold = ((health.get("cache") or {}).get("near") or {}).get("threshold")
+    if args.near_duplicates and not near_threshold:
+        print(
+            "⚠️  Near-duplicate tier is off on the sidecar (MLX_PHASH_THRESHOLD=0) — "
+            "near-duplicates will all be misses",
+            file=sys.stderr,
+        )
+
+    config = {
+        "mode": "open" if args.rate else "closed",
+        "concurrency": None if args.rate else args.concurrency,
+        "rate": args.rate,
+        "requests": args.requests,
+        "duplicates": args.duplicates,
+        "near_duplicates": args.near_duplicates,
+        "max_tokens": args.max_tokens,
+        "seed": args.seed,
+        "files": len(files),
+        "phash_threshold": near_threshold,
+        "backend": health.get("backend"),
+        "model": health.get("model"),
+    }
+    if args.rate:
+        samples, wall = run_open(client, items, args.rate, args.max_in_flight, rng)
+    else:
+        samples, wall = run_closed(client, items, args.concurrency)
+    report = summarise(samples, wall, config)
+    print_report(report)
+
+    regressed = False
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        differing = [
+            k for k in ("mode", "concurrency", "rate", "duplicates", "near_duplicates", "backend", "model")
+            if baseline.get("config", {}).get(k) != config[k]
+        ]
+        if differing:
+            print(f"⚠️  Baseline was run with different {', '.join(differing)}", file=sys.stderr)
+        rows = compare(report, baseline, args.tolerance)
+        print_comparison(rows, args.tolerance)
+        report["comparison"] = {"baseline": str(args.baseline), "tolerance": args.tolerance, "metrics": rows}
+        regressed = any(row["regressed"] for row in rows)
+
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(report, indent=2))
+        print(f"  💾 Baseline saved to {args.save_baseline}")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
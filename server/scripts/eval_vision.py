@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Accuracy-vs-latency evaluation for the MLX Vision OCR sidecar.
+
+Runs a labelled receipt corpus through the sidecar's own pipeline
+(preprocess → InferenceBackend → JSON salvage, in-process, no HTTP) under
+several configurations and scores each one:
+
+    accuracy  — per field: merchant, total, date, items (see score_*)
+    latency   — preprocess + generation per image, p50/p95
+    memory    — backend peak while the configuration ran
+
+The configurations are the cartesian product of --models, --max-tokens
+and --preprocess. Each model is loaded once and runs all of its
+configurations. Quantisation is part of the MLX model id
+(…-4bit / …-8bit), so compare it by listing both ids.
+
+The output is a table marking the Pareto-optimal configurations: no
+other run is at least as accurate, as fast and as small, and strictly
+better in one of the three. It also names the recommended one, the
+fastest configuration within --accuracy-tolerance of the best accuracy.
+
+Corpus: a directory of images plus labels, either a labels.jsonl with
+one {"file": "r1.jpg", "merchant": …, "total": …, "date": …, "items": […]}
+per line, or an r1.json next to each r1.jpg. Only the fields a label
+defines are scored; a field labelled null expects null.
+
+Usage:
+    python server/scripts/eval_vision.py ~/receipts-labelled \\
+        --models mlx-community/Qwen3-VL-8B-Instruct-4bit,mlx-community/Qwen3-VL-4B-Instruct-4bit \\
+        --max-tokens 256,512,1024 --preprocess on,off --out eval.md
+
+    MLX_BACKEND=stub python server/scripts/eval_vision.py corpus/ --backend stub   # dry run
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import itertools
+import json
+import math
+import re
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any
+
+# Sibling modules live next to this file.
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from mlx_vision_server import (  # noqa: E402
+    BACKEND_NAME,
+    EXTRACT_SYSTEM_PROMPT,
+    MAX_PIXELS,
+    MODEL_ID,
+    _decode_image,
+    parse_model_text,
+)
+from vision_backends import BACKENDS, GenerationRequest, InferenceBackend, create_backend  # noqa: E402
+from vision_merchants import normalize  # noqa: E402
+from vision_preprocess import STAGES, parse_stages, preprocess  # noqa: E402
+
+FIELDS = ("merchant", "total", "date", "items")
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tiff"}
+AMOUNT_TOLERANCE = 0.01
+
+
+# ── Corpus ─────────────────────────────────────────────────────────
+
+@dataclass
+class Sample:
+    path: Path
+    label: dict
+
+
+def load_corpus(directory: Path, labels_file: Path | None) -> list[Sample]:
+    labels: dict[str, dict] = {}
+    labels_file = labels_file or (directory / "labels.jsonl")
+    if labels_file.is_file():
+        for n, line in enumerate(labels_file.read_text(encoding="utf-8").splitlines(), start=1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                    labels[row.pop("file")] = row
+                except (json.JSONDecodeError, KeyError) as e:
+                    raise SystemExit(f"{labels_file}:{n}: bad label line ({e})")
+    samples = []
+    for path in sorted(p for p in directory.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES):
+        label = labels.get(str(path.relative_to(directory))) or labels.get(path.name)
+        sidecar = path.with_suffix(".json")
+        if label is None and sidecar.is_file():
+            label = json.loads(sidecar.read_text(encoding="utf-8"))
+        if label is not None:
+            samples.append(Sample(path, label))
+    return samples
+
+
+# ── Scoring ────────────────────────────────────────────────────────
+# Each scorer returns 0..1 for one field of one receipt.
+
+def _amount(value: Any) -> float | None:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        text = re.sub(r"[^\d,.\-]", "", value)
+        if "," in text and "." not in text:
+            text = text.replace(",", ".")  # European decimal comma.
+        try:
+            return float(text.replace(",", ""))
+        except ValueError:
+            return None
+    return None
+
+
+def _date(value: Any) -> date | None:
+    if not isinstance(value, str):
+        return None
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y/%m/%d"):
+        try:
+            return datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def score_merchant(pred: Any, gold: Any) -> float:
+    if gold is None:
+        return float(pred in (None, ""))
+    p, g = normalize(str(pred or "")), normalize(str(gold))
+    if not p:
+        return 0.0
+    # "pingo doce" vs "pingo doce lisboa": the receipt header often adds a branch.
+    return float(p == g or f" {g} " in f" {p} " or f" {p} " in f" {g} ")
+
+
+def score_total(pred: Any, gold: Any) -> float:
+    if gold is None:
+        return float(pred is None)
+    p, g = _amount(pred), _amount(gold)
+    return float(p is not None and g is not None and abs(p - g) <= AMOUNT_TOLERANCE)
+
+
+def score_date(pred: Any, gold: Any) -> float:
+    if gold is None:
+        return float(pred is None)
+    p, g = _date(pred), _date(gold)
+    return float(p is not None and p == g)
+
+
+def score_items(pred: Any, gold: Any) -> float:
+    """F1 over line items; an item matches on normalised name and price."""
+    gold_items = gold if isinstance(gold, list) else []
+    pred_items = [i for i in pred if isinstance(i, dict)] if isinstance(pred, list) else []
+    if not gold_items:
+        return float(not pred_items)
+    unmatched = list(pred_items)
+    hits = 0
+    for g in gold_items:
+        g_name, g_price = normalize(str(g.get("name", ""))), _amount(g.get("price"))
+        for i, p in enumerate(unmatched):
+            p_price = _amount(p.get("price"))
+            name_ok = normalize(str(p.get("name", ""))) == g_name
+            price_ok = g_price is None or (p_price is not None and abs(p_price - g_price) <= AMOUNT_TOLERANCE)
+            if name_ok and price_ok:
+                hits += 1
+                del unmatched[i]
+                break
+    if hits == 0:
+        return 0.0
+    precision, recall = hits / len(pred_items), hits / len(gold_items)
+    return 2 * precision * recall / (precision + recall)
+
+
+SCORERS = {
+    "merchant": score_merchant,
+    "total": score_total,
+    "date": score_date,
+    "items": score_items,
+}
+
+
+def score(extraction: Any, label: dict) -> dict[str, float]:
+    pred = extraction if isinstance(extraction, dict) else {}
+    return {f: SCORERS[f](pred.get(f), label[f]) for f in FIELDS if f in label}
+
+
+# ── Runs ───────────────────────────────────────────────────────────
+
+@dataclass
+class Config:
+    model: str
+    max_tokens: int
+    preprocess: str            # "on", "off" or a stage list
+
+    @property
+    def stages(self) -> tuple[str, ...]:
+        return parse_stages({"on": ",".join(STAGES)}.get(self.preprocess, self.preprocess))
+
+    @property
+    def quant(self) -> str:
+        m = re.search(r"(\d+)[-_]?bit", self.model, re.IGNORECASE)
+        return f"{m.group(1)}bit" if m else "—"
+
+    def name(self) -> str:
+        return f"{self.model.rsplit('/', 1)[-1]} · {self.max_tokens} tok · preprocess {self.preprocess}"
+
+
+@dataclass
+class Result:
+    config: Config
+    field_scores: dict[str, list[float]] = field(default_factory=dict)
+    latencies: list[float] = field(default_factory=list)
+    tokens: list[int] = field(default_factory=list)
+    parsed: int = 0
+    errors: int = 0
+    peak_gb: float | None = None
+
+    @property
+    def accuracy(self) -> float:
+        means = [statistics.fmean(v) for v in self.field_scores.values() if v]
+        return statistics.fmean(means) if means else 0.0
+
+    def field_accuracy(self, name: str) -> float | None:
+        values = self.field_scores.get(name)
+        return statistics.fmean(values) if values else None
+
+    def latency(self, p: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    def summary(self) -> dict:
+        return {
+            "model": self.config.model,
+            "quant": self.config.quant,
+            "max_tokens": self.config.max_tokens,
+            "preprocess": self.config.preprocess,
+            "accuracy": round(self.accuracy, 4),
+            "fields": {f: _r(self.field_accuracy(f)) for f in FIELDS},
+            "parse_rate": round(self.parsed / max(1, len(self.latencies) + self.errors), 4),
+            "errors": self.errors,
+            "latency_p50_s": _r(self.latency(50)),
+            "latency_p95_s": _r(self.latency(95)),
+            "mean_tokens": _r(statistics.fmean(self.tokens)) if self.tokens else None,
+            "peak_memory_gb": self.peak_gb,
+        }
+
+
+def _r(value: float | None) -> float | None:
+    return round(value, 4) if value is not None else None
+
+
+def _run_one(backend: InferenceBackend, image, config: Config) -> tuple[dict, float]:
+    t0 = time.perf_counter()
+    prepared, _ = preprocess(image, config.stages, MAX_PIXELS)
+    if prepared.mode != "RGB":
+        prepared = prepared.convert("RGB")
+    raw = backend.generate(GenerationRequest(prepared, EXTRACT_SYSTEM_PROMPT, config.max_tokens))
+    return raw, time.perf_counter() - t0
+
+
+def _load(sample: Sample):
+    # Decoded per run, never held for the whole corpus: a few hundred 12 MP
+    # photos would be ~10 GB next to the model, and would inflate peak memory.
+    return _decode_image(sample.path.read_bytes())
+
+
+def evaluate(backend: InferenceBackend, config: Config, samples: list[Sample], warmup: int) -> Result:
+    result = Result(config)
+    for sample in samples[:warmup]:
+        _run_one(backend, _load(sample), config)  # Kernel compilation, not measured.
+    backend.reset_peak_memory()
+    for n, sample in enumerate(samples, start=1):
+        try:
+            raw, elapsed = _run_one(backend, _load(sample), config)
+        except Exception as e:  # Keep going: one bad receipt shouldn't void a config.
+            result.errors += 1
+            print(f"    ❌ {sample.path.name}: {type(e).__name__}: {e}", file=sys.stderr)
+            continue
+        extraction = parse_model_text(raw["text"])
+        result.parsed += isinstance(extraction, dict)
+        result.latencies.append(elapsed)
+        result.tokens.append(raw.get("generation_tokens") or 0)
+        for name, value in score(extraction, sample.label).items():
+            result.field_scores.setdefault(name, []).append(value)
+        if sys.stderr.isatty():
+            print(f"\r    {n}/{len(samples)}", end="", file=sys.stderr, flush=True)
+    if sys.stderr.isatty():
+        print(file=sys.stderr)
+    result.peak_gb = backend.memory_stats().get("peak_gb")
+    return result
+
+
+# ── Pareto table ───────────────────────────────────────────────────
+
+def _costs(r: Result) -> tuple[float, float, float]:
+    """Lower is better on every axis."""
+    return (-r.accuracy, r.latency(50) or math.inf, r.peak_gb if r.peak_gb is not None else 0.0)
+
+
+def pareto_front(results: list[Result]) -> set[int]:
+    front = set()
+    for i, a in enumerate(results):
+        ca = _costs(a)
+        dominated = any(
+            all(x <= y for x, y in zip(_costs(b), ca)) and _costs(b) != ca
+            for j, b in enumerate(results)
+            if j != i
+        )
+        if not dominated:
+            front.add(i)
+    return front
+
+
+def recommend(results: list[Result], tolerance: float) -> int | None:
+    if not results:
+        return None
+    best = max(r.accuracy for r in results)
+    eligible = [i for i, r in enumerate(results) if r.accuracy >= best - tolerance]
+    return min(eligible, key=lambda i: (results[i].latency(50) or math.inf, results[i].peak_gb or 0.0))
+
+
+def render_table(results: list[Result], front: set[int], pick: int | None, corpus: int) -> str:
+    def pct(v: float | None) -> str:
+        return f"{v:.1%}" if v is not None else "—"
+
+    def secs(v: float | None) -> str:
+        return f"{v:.2f}s" if v is not None else "—"
+
+    lines = [
+        f"# Vision eval — {corpus} labelled receipts",
+        "",
+        "| | model | quant | max_tokens | preprocess | accuracy | merchant | total | date | items "
+        "| parsed | p50 | p95 | tokens | peak GB |",
+        "|---|---|---|---|---|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    order = sorted(range(len(results)), key=lambda i: (-results[i].accuracy, results[i].latency(50) or math.inf))
+    for i in order:
+        r, s = results[i], results[i].summary()
+        mark = ("★" if i == pick else "") + ("◆" if i in front else "")
+        lines.append(
+            f"| {mark} | {r.config.model} | {r.config.quant} | {r.config.max_tokens} | {r.config.preprocess} "
+            f"| **{pct(r.accuracy)}** | " + " | ".join(pct(r.field_accuracy(f)) for f in FIELDS)
+            + f" | {pct(s['parse_rate'])} | {secs(s['latency_p50_s'])} | {secs(s['latency_p95_s'])} "
+            f"| {s['mean_tokens'] or 0:.0f} | {s['peak_memory_gb'] if s['peak_memory_gb'] is not None else '—'} |"
+        )
+    lines += ["", "◆ Pareto-optimal (accuracy, p50 latency, peak memory)"]
+    if pick is not None:
+        lines.append(f"★ Recommended: `{results[pick].config.name()}`")
+    return "\n".join(lines) + "\n"
+
+
+# ── CLI ────────────────────────────────────────────────────────────
+
+def _csv(value: str) -> list[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Accuracy vs latency across sidecar configurations")
+    parser.add_argument("corpus", type=Path, help="Directory of labelled receipt images")
+    parser.add_argument("--labels", type=Path, default=None, help="labels.jsonl (default: <corpus>/labels.jsonl, then per-image .json)")
+    parser.add_argument("--models", type=_csv, default=[MODEL_ID], help="Comma-separated model ids")
+    parser.add_argument("--max-tokens", type=lambda v: [int(x) for x in _csv(v)], default=[512, 1024], help="Comma-separated budgets (default: 512,1024)")
+    parser.add_argument("--preprocess", type=_csv, default=["on", "off"], help='Comma-separated: on, off or "+"-joined stages (default: on,off)')
+    parser.add_argument("--backend", default=None, choices=sorted(BACKENDS), help="Inference backend (default: MLX_BACKEND or mlx)")
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N receipts")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured images per configuration (default: 1)")
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.01, help="Accuracy loss allowed for the recommendation (default: 0.01)")
+    parser.add_argument("--out", type=Path, default=Path("vision_eval.md"), help="Pareto table, Markdown (default: vision_eval.md)")
+    parser.add_argument("--json", type=Path, default=None, help="Also write every run as JSON")
+    args = parser.parse_args()
+
+    for spec in args.preprocess:
+        try:
+            Config("", 0, spec.replace("+", ",")).stages
+        except ValueError as e:
+            parser.error(str(e))
+    samples = load_corpus(args.corpus.expanduser(), args.labels)[: args.limit]
+    if not samples:
+        parser.error(f"No labelled images under {args.corpus}")
+    backend_name = args.backend or BACKEND_NAME
+
+    print(f"  📂 {len(samples)} labelled receipts")
+
+    results: list[Result] = []
+    for model in args.models:
+        print(f"  ⏳ Loading {model} ({backend_name})")
+        backend = create_backend(backend_name, model)
+        backend.load()
+        for max_tokens, spec in itertools.product(args.max_tokens, args.preprocess):
+            config = Config(model, max_tokens, spec.replace("+", ","))
+            print(f"  🧪 {config.name()}")
+            result = evaluate(backend, config, samples, args.warmup)
+            s = result.summary()
+            print(
+                f"     accuracy {result.accuracy:.1%}  p50 {s['latency_p50_s']}s  "
+                f"peak {s['peak_memory_gb']}GB  parsed {s['parse_rate']:.0%}"
+            )
+            results.append(result)
+        # Free this model before the next one loads.
+        backend.clear_cache()
+        del backend
+        gc.collect()
+
+    front = pareto_front(results)
+    pick = recommend(results, args.accuracy_tolerance)
+    table = render_table(results, front, pick, len(samples))
+    args.out.write_text(table, encoding="utf-8")
+    print()
+    print(table)
+    print(f"  💾 {args.out}")
+    if args.json:
+        args.json.write_text(json.dumps({
+            "corpus": str(args.corpus),
+            "receipts": len(samples),
+            "runs": [dict(r.summary(), pareto=i in front, recommended=i == pick) for i, r in enumerate(results)],
+        }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
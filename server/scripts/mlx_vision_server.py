@@ -11,84 +11,438 @@ zero reasoning, zero state. All intelligence lives in OpenAI (cloud).
 
 Start:
     source ~/mlx-env/bin/activate
+    pip install -r server/scripts/requirements.txt
     python server/scripts/mlx_vision_server.py
 
+Load-test the serving path without Apple Silicon:
+    MLX_BACKEND=stub python server/scripts/mlx_vision_server.py
+
+Where does boot time go? Loads everything, prints a phase breakdown and
+an import-time profile, then exits without serving:
+    python server/scripts/mlx_vision_server.py --report-startup
+
 Env:
     MLX_PORT          — default 8787
     MLX_MODEL         — default mlx-community/Qwen3-VL-8B-Instruct-4bit
-    MLX_MAX_TOKENS    — default 1024
+    MLX_BACKEND       — default mlx (mlx | stub, see vision_backends.py)
+    MLX_MAX_TOKENS    — default 1024 (a ceiling when MLX_ADAPTIVE_TOKENS is on)
+    MLX_ADAPTIVE_TOKENS — default 0 (1 predicts a per-request token budget
+                        from image shape and merchant history for batched
+                        decodes, retrying once at the ceiling on truncation;
+                        adds a dHash per upload for layout matching even
+                        with MLX_PHASH_THRESHOLD off; see vision_budget.py)
+    MLX_MIN_TOKENS    — default 128 (smallest predicted budget)
+    MLX_CACHE_SIZE    — default 256 (cached extractions in memory)
+    MLX_DISK_CACHE_PATH     — default ~/.cache/mlx-sidecar/extractions.sqlite3
+                              (empty disables the persistent tier)
+    MLX_DISK_CACHE_MB       — default 256 (disk tier byte budget, LRU eviction)
+    MLX_DISK_CACHE_TTL_DAYS — default 30
+    MLX_CACHE_WARM_COUNT    — default 64 (hottest disk entries preloaded)
+    MLX_MERCHANTS_PATH — default "" (built-in table); CSV, JSON or SQLite
+                        merchant catalogue, hot-reloaded on change or SIGHUP
+    MLX_MERCHANTS_POLL_S  — default 5 (catalogue file change check)
+    MLX_PROCESSOR_SNAPSHOT_DIR — default ~/.cache/mlx-sidecar (pickled
+                        tokenizer + image processor reused across boots;
+                        empty disables, see vision_startup.py)
+    MLX_PREFIX_CACHE  — default 1 (0 templates every request; compare the
+                        prefix_cached/prefix_built split in /health)
+    MLX_PREFIX_CACHE_SIZE — default 8 custom-prompt chat templates (LRU)
+    MLX_WARMUP_SIZES  — default 3024x4032,1080x2400,2480x3508 (synthetic
+                        receipts generated before /readyz flips; "off"
+                        disables, see vision_warmup.py)
+    MLX_WARMUP_MAX_TOKENS — default 64 (decode length per warmup image)
+    MLX_PREPROCESS    — default exif,crop,grayscale,contrast,resize ("off"
+                        disables; see vision_preprocess.py)
+    MLX_MAX_PIXELS    — default 1254400 (~1600 vision tokens after resize)
+    MLX_PDF_MAX_PAGES — default 10 (pages read before giving up on a total)
+    MLX_PDF_PAGE_CACHE_MB — default 128 (rendered PDF pages kept in memory)
+    MLX_PHASH_THRESHOLD     — default 0, off (max dHash bit distance for a
+                              near-duplicate candidate; each candidate must
+                              also pass a detail-print check, see
+                              vision_cache.py)
+    MLX_QUEUE_DEPTH   — default 8 (pending interactive generations before 429)
+    MLX_BULK_QUEUE_DEPTH  — default 64 (pending bulk-lane generations)
+    MLX_MAX_UPLOAD_MB — default 20 (/extract/raw upload limit, enforced while
+                        reading; multipart needs python-multipart)
+    MLX_RAM_TMPDIR    — default /dev/shm when present (only for backends
+                        that need image files; see vision_backends.py)
+    MLX_BATCH_MAX_SIZE    — default 4 (requests per batched forward pass)
+    MLX_BATCH_MAX_WAIT_MS — default 15 (batch collection window)
+    MLX_BULK_MAX_IMAGES   — default 64 (images per /extract/batch call)
+    MLX_JOBS_MAX_PENDING  — default 1000 (queued /jobs before 429)
+    MLX_JOBS_RETAIN       — default 1000 finished jobs kept for polling
+    MLX_JOBS_TTL_S        — default 3600 (finished job retention)
+    MLX_MEMORY_HIGH_GB     — default 75% of physical RAM (memory governor:
+                             smaller caches and batches; see vision_memory.py)
+    MLX_MEMORY_CRITICAL_GB — default 90% of physical RAM (batch size 1,
+                             bulk lane held, new bulk work gets 429)
+    MLX_MEMORY_POLL_S      — default 1 (governor sample interval; 0 disables)
+
+Probes:
+    GET /livez  — 200 while the process serves HTTP
+    GET /readyz — 200 once the model is loaded and warmed up, else 503
+
+Metrics:
+    GET /metrics — Prometheus text format (see vision_metrics.py)
 """
 
 from __future__ import annotations
 
+import asyncio
 import base64
+import contextvars
 import hashlib
 import io
 import json
 import logging
 import os
 import signal
+import sqlite3
 import sys
-import tempfile
 import time
 from collections import OrderedDict
 from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Any, AsyncIterator, Literal
 
-# ── Ensure patch_transformers is loaded BEFORE anything else ──
+_IMPORT_T0 = time.perf_counter()
+
+# Sibling modules (backends, scheduler, patch_transformers) live next to this file.
 sys.path.insert(0, str(Path(__file__).resolve().parent))
-import patch_transformers  # noqa: F401, E402
 
-import mlx.core as mx  # noqa: E402
-from fastapi import FastAPI, HTTPException  # noqa: E402
+from fastapi import FastAPI, HTTPException, Query, Request  # noqa: E402
 from fastapi.middleware.cors import CORSMiddleware  # noqa: E402
+from fastapi.responses import JSONResponse, Response, StreamingResponse  # noqa: E402
 from pydantic import BaseModel, Field  # noqa: E402
 
+from vision_cache import DETAIL_TOLERANCE, DiskCache, HammingIndex, detail_distance, detail_print, dhash  # noqa: E402
+from vision_backends import GenerationRequest, InferenceBackend, create_backend  # noqa: E402
+from vision_budget import Budget, TokenBudgetPredictor  # noqa: E402
+from vision_jobs import JobStore, deliver_callback  # noqa: E402
+from vision_json import STREAMED_ARRAY, FieldEvent, IncrementalFieldParser  # noqa: E402
+from vision_memory import LEVELS as MEMORY_LEVELS, MemoryGovernor, physical_memory_gb, read_memory  # noqa: E402
+from vision_merchants import CatalogueReloader  # noqa: E402
+from vision_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry  # noqa: E402
+from vision_pdf import PageCache, PdfDocument, PdfUnavailableError, choose_dpi, is_pdf  # noqa: E402
+from vision_preprocess import STAGES, parse_stages, preprocess  # noqa: E402
+from vision_scheduler import LANES, BatchScheduler, QueueFullError  # noqa: E402
+from vision_startup import ProcessorSnapshot, StartupReport, format_importtime, importtime_profile  # noqa: E402
+from vision_warmup import DEFAULT_SIZES as DEFAULT_WARMUP_SIZES, parse_sizes, synthetic_receipt  # noqa: E402
+
+_startup = StartupReport()
+_startup.add("imports", time.perf_counter() - _IMPORT_T0)
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger("mlx-sidecar")
 
 # ── Config ──────────────────────────────────────────────────────────
 MODEL_ID = os.getenv("MLX_MODEL", "mlx-community/Qwen3-VL-8B-Instruct-4bit")
+BACKEND_NAME = os.getenv("MLX_BACKEND", "mlx")
 PORT = int(os.getenv("MLX_PORT", "8787"))
 MAX_TOKENS = int(os.getenv("MLX_MAX_TOKENS", "1024"))
+ADAPTIVE_TOKENS = os.getenv("MLX_ADAPTIVE_TOKENS", "0") != "0"
+MIN_TOKENS = int(os.getenv("MLX_MIN_TOKENS", "128"))
+QUEUE_DEPTH = int(os.getenv("MLX_QUEUE_DEPTH", "8"))
+BULK_QUEUE_DEPTH = int(os.getenv("MLX_BULK_QUEUE_DEPTH", "64"))
+MAX_UPLOAD_BYTES = int(float(os.getenv("MLX_MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+MERCHANTS_PATH = os.getenv("MLX_MERCHANTS_PATH", "")
+MERCHANTS_POLL_S = float(os.getenv("MLX_MERCHANTS_POLL_S", "5"))
+PREFIX_CACHE = os.getenv("MLX_PREFIX_CACHE", "1") != "0"
+PREFIX_CACHE_SIZE = int(os.getenv("MLX_PREFIX_CACHE_SIZE", "8"))
+PREPROCESS_STAGES = parse_stages(os.getenv("MLX_PREPROCESS", ",".join(STAGES)))
+MAX_PIXELS = int(os.getenv("MLX_MAX_PIXELS", "1254400"))
+WARMUP_SIZES = parse_sizes(os.getenv("MLX_WARMUP_SIZES", DEFAULT_WARMUP_SIZES))
+WARMUP_MAX_TOKENS = int(os.getenv("MLX_WARMUP_MAX_TOKENS", "64"))
+PDF_MAX_PAGES = int(os.getenv("MLX_PDF_MAX_PAGES", "10"))
+PDF_PAGE_CACHE_BYTES = int(float(os.getenv("MLX_PDF_PAGE_CACHE_MB", "128")) * 1024 * 1024)
+RAM_TMPDIR = os.getenv("MLX_RAM_TMPDIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
+BATCH_MAX_SIZE = int(os.getenv("MLX_BATCH_MAX_SIZE", "4"))
+BATCH_MAX_WAIT_MS = float(os.getenv("MLX_BATCH_MAX_WAIT_MS", "15"))
+BULK_MAX_IMAGES = int(os.getenv("MLX_BULK_MAX_IMAGES", "64"))
+JOBS_MAX_PENDING = int(os.getenv("MLX_JOBS_MAX_PENDING", "1000"))
+JOBS_RETAIN = int(os.getenv("MLX_JOBS_RETAIN", "1000"))
+JOBS_TTL_S = float(os.getenv("MLX_JOBS_TTL_S", "3600"))
+PROCESSOR_SNAPSHOT_DIR = os.getenv(
+    "MLX_PROCESSOR_SNAPSHOT_DIR", str(Path.home() / ".cache" / "mlx-sidecar")
+)
+_RAM_GB = physical_memory_gb()
+MEMORY_HIGH_GB = float(os.getenv("MLX_MEMORY_HIGH_GB") or (_RAM_GB * 0.75 if _RAM_GB else 0))
+MEMORY_CRITICAL_GB = float(os.getenv("MLX_MEMORY_CRITICAL_GB") or (_RAM_GB * 0.9 if _RAM_GB else 0))
+MEMORY_POLL_S = float(os.getenv("MLX_MEMORY_POLL_S", "1"))
 
 # ── Globals (loaded once at startup) ────────────────────────────────
-_model = None
-_processor = None
 _load_time: float = 0.0
+_backend: InferenceBackend | None = None
+_scheduler: BatchScheduler | None = None
+_page_cache = PageCache(PDF_PAGE_CACHE_BYTES)
+_jobs = JobStore(max_pending=JOBS_MAX_PENDING, retain=JOBS_RETAIN, ttl_s=JOBS_TTL_S)
+_budgets = TokenBudgetPredictor(floor=MIN_TOKENS)
+_governor: MemoryGovernor | None = (
+    MemoryGovernor(high_gb=MEMORY_HIGH_GB, critical_gb=MEMORY_CRITICAL_GB)
+    if MEMORY_POLL_S > 0 and MEMORY_HIGH_GB > 0
+    else None
+)
 
 # ── Content Cache (SHA-256 → result) ────────────────────────────────
+# Tier 1: in-process LRU capped by entry count.
+# Tier 2: SQLite on disk (vision_cache.py) — byte budget, TTL, survives
+# restarts; its hottest entries are warm-loaded into tier 1 at startup.
 MAX_CACHE_SIZE = int(os.getenv("MLX_CACHE_SIZE", "256"))
+DISK_CACHE_PATH = os.getenv(
+    "MLX_DISK_CACHE_PATH", str(Path.home() / ".cache" / "mlx-sidecar" / "extractions.sqlite3")
+)
+DISK_CACHE_MAX_BYTES = int(float(os.getenv("MLX_DISK_CACHE_MB", "256")) * 1024 * 1024)
+DISK_CACHE_TTL_S = float(os.getenv("MLX_DISK_CACHE_TTL_DAYS", "30")) * 86400
+CACHE_WARM_COUNT = int(os.getenv("MLX_CACHE_WARM_COUNT", "64"))
+PHASH_THRESHOLD = int(os.getenv("MLX_PHASH_THRESHOLD", "0"))
+
 _content_cache: OrderedDict[str, dict] = OrderedDict()
+_cache_limit = MAX_CACHE_SIZE  # Lowered by the memory governor under pressure.
+_content_sizes: dict[str, int] = {}
+# Detail prints of memory-tier entries; the disk tier keeps its own.
+_detail_prints: dict[str, bytes] = {}
+_disk_cache: DiskCache | None = None
+# dHash of every cached entry (either tier) → near-duplicate lookups.
+_phash_index: HammingIndex | None = HammingIndex(PHASH_THRESHOLD) if PHASH_THRESHOLD > 0 else None
 _cache_hits = 0
 _cache_misses = 0
+_memory_hits = 0
+_memory_misses = 0
+_near_hits = 0
+_near_rejected = 0
+_inflight: dict[str, asyncio.Future] = {}
+_inflight_lanes: dict[str, str] = {}  # Lane each in-flight generation is (now) scheduled in.
+# Content hash of the generation the current task leads; its scheduler jobs
+# carry it as their key so a higher-priority follower can promote them.
+_flight: contextvars.ContextVar[str | None] = contextvars.ContextVar("flight", default=None)
+_coalesced_hits = 0
+_near_lookup_s = 0.0
+_near_lookups = 0
 _fast_path_hits = 0
 
 
+# ── Metrics (/metrics, Prometheus text format) ─────────────────────
+_metrics = Registry()
+_stage_seconds = _metrics.histogram(
+    "mlx_stage_duration_seconds",
+    "Time spent per pipeline stage (base64_decode, hash, image_decode, phash, "
+    "preprocess, queue_wait, generation, json_salvage, upload_read, pdf_render)",
+)
+_request_seconds = _metrics.histogram(
+    "mlx_request_duration_seconds", "Total request time, until the last body byte is sent"
+)
+_m_queue_depth = _metrics.gauge("mlx_queue_depth", "Generations waiting, per scheduler lane")
+_m_queue_max_depth = _metrics.gauge("mlx_queue_max_depth", "Lane capacity before 429 (bulk waits instead)")
+_m_queue_busy = _metrics.gauge("mlx_queue_busy", "1 while the inference thread is running a batch")
+_m_cache_entries = _metrics.gauge("mlx_cache_entries", "Cached extractions per tier")
+_m_cache_bytes = _metrics.gauge("mlx_cache_bytes", "Cached extraction bytes per tier")
+_m_peak_memory = _metrics.gauge("mlx_peak_memory_gb", "Peak accelerator memory (last generation / backend)")
+_m_active_memory = _metrics.gauge("mlx_active_memory_gb", "Active accelerator memory reported by the backend")
+_m_cache_results = _metrics.counter("mlx_cache_results_total", "Extraction lookups by outcome")
+_m_queue_results = _metrics.counter("mlx_queue_results_total", "Scheduled generations by outcome")
+_m_lane_results = _metrics.counter("mlx_lane_results_total", "Scheduled generations by lane and outcome")
+_m_preemptions = _metrics.counter("mlx_preemptions_total", "Queued bulk jobs pushed back for interactive work")
+_m_promotions = _metrics.counter("mlx_promotions_total", "Queued jobs moved up a lane for a waiting follower")
+_m_tokens = _metrics.counter("mlx_generation_tokens_total", "Tokens decoded")
+_m_budget_predictions = _metrics.counter(
+    "mlx_token_budget_predictions_total", "Predicted max_tokens budgets by source"
+)
+_m_budget_truncations = _metrics.counter(
+    "mlx_token_budget_truncations_total", "Generations whose JSON was cut off by the predicted budget"
+)
+_m_warmup_seconds = _metrics.gauge("mlx_warmup_seconds", "Duration of the startup warmup pass")
+_m_ready = _metrics.gauge("mlx_ready", "1 once the model is loaded and warmed up")
+_m_tokens_unreserved = _metrics.counter(
+    "mlx_generation_tokens_unreserved_total",
+    "max_tokens left unused when the JSON stop fired (upper bound on decode steps saved)",
+)
+_m_memory_level = _metrics.gauge("mlx_memory_pressure_level", "Memory governor level: 0 normal, 1 high, 2 critical")
+_m_memory_gb = _metrics.gauge("mlx_memory_gb", "Last governor sample: pressure, process RSS, backend")
+_m_memory_watermark = _metrics.gauge("mlx_memory_watermark_gb", "Memory governor watermarks")
+_m_memory_actions = _metrics.counter("mlx_memory_governor_actions_total", "Memory governor actions by level")
+_m_batch_max_size = _metrics.gauge("mlx_batch_max_size", "Current batch size cap (lowered under memory pressure)")
+_m_lane_held = _metrics.gauge("mlx_lane_held", "1 while a scheduler lane is held under memory pressure")
+_last_peak_memory_gb: float | None = None
+
+
 def _sha256(data: bytes) -> str:
-    return hashlib.sha256(data).hexdigest()
+    with _stage_seconds.time(stage="hash"):
+        return hashlib.sha256(data).hexdigest()
+
+
+def _b64decode(data: str) -> bytes:
+    with _stage_seconds.time(stage="base64_decode"):
+        return base64.b64decode(data)
 
 
 def _cache_get(key: str) -> dict | None:
-    global _cache_hits
+    global _memory_hits, _memory_misses
     if key in _content_cache:
         _content_cache.move_to_end(key)
-        _cache_hits += 1
+        _memory_hits += 1
         return _content_cache[key]
+    _memory_misses += 1
     return None
 
 
 def _cache_put(key: str, value: dict) -> None:
-    global _cache_misses
-    _cache_misses += 1
     _content_cache[key] = value
     _content_cache.move_to_end(key)
-    while len(_content_cache) > MAX_CACHE_SIZE:
-        _content_cache.popitem(last=False)
+    _content_sizes[key] = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+    _trim_cache()
+
+
+def _trim_cache() -> int:
+    """Evict LRU entries down to the current limit; returns how many went."""
+    evicted = 0
+    while len(_content_cache) > _cache_limit:
+        key, _ = _content_cache.popitem(last=False)
+        _content_sizes.pop(key, None)
+        _detail_prints.pop(key, None)
+        if _disk_cache is None and _phash_index is not None:
+            _phash_index.remove(key)
+        evicted += 1
+    return evicted
+
+
+async def _cache_lookup(key: str) -> tuple[dict | None, str | None]:
+    """Memory tier, then disk tier (promoting disk hits). Returns (value, tier)."""
+    global _cache_hits, _cache_misses
+    value = _cache_get(key)
+    if value is not None:
+        _cache_hits += 1
+        return value, "memory"
+    if _disk_cache is not None:
+        value = await asyncio.to_thread(_disk_cache.get, key)
+        if value is not None:
+            _cache_put(key, value)
+            _cache_hits += 1
+            return value, "disk"
+    _cache_misses += 1
+    return None, None
+
+
+async def _cache_store(
+    key: str, value: dict, phash: int | None = None, detail: bytes | None = None
+) -> None:
+    _cache_put(key, value)
+    # Only entries with a detail print can be verified, so only they become candidates.
+    if _phash_index is not None and phash is not None and detail is not None:
+        _detail_prints[key] = detail
+        _phash_index.add(key, phash)
+    if _disk_cache is not None:
+        await asyncio.to_thread(_disk_cache.put, key, value, phash, detail)
+
+
+# Candidates verified per lookup. Receipts from one till share a layout,
+# so a busy merchant can put many entries within the threshold.
+_NEAR_MAX_CANDIDATES = 16
+
+
+async def _near_lookup(phash: int, detail: bytes | None) -> tuple[dict, str, int] | None:
+    """Closest verified near-duplicate within PHASH_THRESHOLD → (value, key, distance)."""
+    global _near_hits, _near_rejected, _near_lookup_s, _near_lookups
+    if _phash_index is None or detail is None:
+        return None
+    t0 = time.perf_counter()
+    candidates = _phash_index.candidates(phash)
+    _near_lookup_s += time.perf_counter() - t0
+    _near_lookups += 1
+    # Closest first: a candidate that fails verification hands over to the next.
+    for key, distance in candidates[:_NEAR_MAX_CANDIDATES]:
+        value = _content_cache.get(key)
+        if value is None and _disk_cache is not None:
+            value = await asyncio.to_thread(_disk_cache.get, key)
+        if value is None:
+            # Evicted or expired from every tier since it was indexed.
+            _phash_index.remove(key)
+            continue
+        # The dHash only matched the layout; the detail print must match the text.
+        candidate = _detail_prints.get(key)
+        if candidate is None and _disk_cache is not None:
+            candidate = await asyncio.to_thread(_disk_cache.detail, key)
+        difference = await asyncio.to_thread(detail_distance, detail, candidate) if candidate else None
+        if difference is None or difference > DETAIL_TOLERANCE:
+            _near_rejected += 1
+            logger.info(f"NEAR REJECTED [{key[:12]}] — distance {distance}, detail {difference}")
+            continue
+        _near_hits += 1
+        return value, key, distance
+    return None
+
+
+def _open_disk_cache() -> None:
+    global _disk_cache
+    if not DISK_CACHE_PATH:
+        logger.info("Disk cache disabled (MLX_DISK_CACHE_PATH is empty)")
+        return
+    try:
+        _disk_cache = DiskCache(
+            DISK_CACHE_PATH,
+            namespace=MODEL_ID,
+            max_bytes=DISK_CACHE_MAX_BYTES,
+            ttl_s=DISK_CACHE_TTL_S,
+        )
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Disk cache unavailable at {DISK_CACHE_PATH}: {e}")
+        return
+    purged = _disk_cache.purge_expired()
+    if _phash_index is not None:
+        for key, phash in _disk_cache.phashes():
+            _phash_index.add(key, phash)
+    # hottest() is ordered hottest-first; insert in reverse so it ends up most-recent.
+    warm = _disk_cache.hottest(min(CACHE_WARM_COUNT, MAX_CACHE_SIZE))
+    for key, value in reversed(warm):
+        _cache_put(key, value)
+    logger.info(f"Disk cache {DISK_CACHE_PATH}: warmed {len(warm)} entries, purged {purged} expired")
+
+
+# ── Image Decoding (in memory — no temp file per request) ──────────
+
+def _decode_image(image_bytes: bytes):
+    """Decode once into a PIL image that the backend consumes directly."""
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(image_bytes))
+    img.load()
+    return img if img.mode in ("RGB", "L") else img.convert("RGB")
+
+
+def _decode_and_hash(image_bytes: bytes) -> tuple[Any, int | None, bytes | None]:
+    """(image, dHash, detail print).
+
+    The dHash also matches receipt layouts for token budgets, so it is
+    computed when either near-duplicates or adaptive tokens are on. The
+    detail print only serves near-duplicate verification.
+    """
+    with _stage_seconds.time(stage="image_decode"):
+        image = _decode_image(image_bytes)
+    if _phash_index is None and not ADAPTIVE_TOKENS:
+        return image, None, None
+    with _stage_seconds.time(stage="phash"):
+        return image, dhash(image), detail_print(image) if _phash_index is not None else None
+
+
+def _preprocess(image) -> tuple[Any, dict]:
+    """Cut background pixels / resolution before generation (vision_preprocess.py)."""
+    with _stage_seconds.time(stage="preprocess"):
+        return preprocess(image, PREPROCESS_STAGES, MAX_PIXELS)
+
+
+def _write_ram_file(image) -> str:
+    """Fallback for backends that insist on a filename: tmpfs, not the disk."""
+    import tempfile  # Only these backends need it; keep it off the boot path.
+
+    with tempfile.NamedTemporaryFile(suffix=".png", dir=RAM_TMPDIR, delete=False) as f:
+        # PNG of the preprocessed image — lossless, no second JPEG generation.
+        image.save(f, format="PNG", compress_level=1)
+        return f.name
 
 
 # ── Fast-Path Merchant Recognition ──────────────────────────────────
 # Known merchants whose visual grammar can be recognized without LLM.
+# Built-in default; MLX_MERCHANTS_PATH replaces it with an external,
+# hot-reloadable catalogue (see vision_merchants.py).
 FAST_PATH_MERCHANTS: dict[str, dict] = {
     "pingo doce": {
         "merchant": "Pingo Doce",
@@ -187,16 +541,19 @@ FAST_PATH_MERCHANTS: dict[str, dict] = {
     },
 }
 
+# One automaton over every key: whole-word, accent-insensitive, longest match.
+_merchants: CatalogueReloader | None = None
+
 
 def _try_fast_path(raw_text: str) -> dict | None:
     """If the model output contains a known merchant name, use the fast-path."""
     global _fast_path_hits
-    text_lower = raw_text.lower()
-    for key, meta in FAST_PATH_MERCHANTS.items():
-        if key in text_lower:
-            _fast_path_hits += 1
-            return meta
-    return None
+    if _merchants is None:
+        return None
+    meta = _merchants.current.match(raw_text)
+    if meta is not None:
+        _fast_path_hits += 1
+    return meta
 
 
 EXTRACT_SYSTEM_PROMPT = """You are a receipt and invoice data extractor for a personal finance system.
@@ -223,46 +580,30 @@ Rules:
 
 
 def _load_model():
-    global _model, _processor, _load_time
-    from mlx_vlm import load
-
-    logger.info(f"Loading {MODEL_ID}...")
+    global _load_time, _backend
+    logger.info(f"Loading {MODEL_ID} ({BACKEND_NAME} backend)...")
     t0 = time.perf_counter()
-    _model, _processor = load(MODEL_ID)
+    backend = create_backend(BACKEND_NAME, MODEL_ID)
+    backend.prefix_cache_enabled = PREFIX_CACHE
+    backend.prefix_cache_size = PREFIX_CACHE_SIZE
+    if PROCESSOR_SNAPSHOT_DIR:
+        backend.processor_snapshot = ProcessorSnapshot(PROCESSOR_SNAPSHOT_DIR)
+    with _startup.phase("load"):
+        backend.load()
+    for name, seconds in backend.load_report.phases:
+        _startup.add(f"load.{name}", seconds)
+    # Template the default prompt once, before the first request.
+    if PREFIX_CACHE:
+        with _startup.phase("prefix_pin"):
+            backend.pin_prompt(EXTRACT_SYSTEM_PROMPT)
+    _backend = backend
     _load_time = time.perf_counter() - t0
     logger.info(f"✅ Model loaded in {_load_time:.1f}s")
 
 
-def _generate_from_image(image_path: str, prompt: str, max_tokens: int = MAX_TOKENS) -> dict:
-    from mlx_vlm import generate
-    from mlx_vlm.prompt_utils import apply_chat_template
-
-    formatted = apply_chat_template(_processor, prompt, num_images=1)
-
-    t0 = time.perf_counter()
-    result = generate(
-        _model,
-        _processor,
-        formatted,
-        [image_path],
-        max_tokens=max_tokens,
-        verbose=False,
-    )
-    gen_time = time.perf_counter() - t0
-
-    text = result.text if hasattr(result, "text") else str(result)
-    tps = getattr(result, "generation_tps", 0)
-    peak = getattr(result, "peak_memory", 0)
-
-    return {
-        "text": text,
-        "generation_time_s": round(gen_time, 2),
-        "tokens_per_second": round(tps, 1) if tps else None,
-        "peak_memory_gb": round(peak, 2) if peak else None,
-    }
-
-
 # _generate_text() removed — Qwen is OCR-only (Dual-LLM Architecture)
+# Generation itself lives behind vision_backends.InferenceBackend and is
+# driven by vision_scheduler.BatchScheduler (see lifespan below).
 
 
 # ── Pydantic Models ────────────────────────────────────────────────
@@ -272,19 +613,260 @@ class ExtractRequest(BaseModel):
     mime_type: str = Field(default="image/png", description="Image MIME type")
     prompt: str | None = Field(default=None, description="Override extraction prompt")
     max_tokens: int = Field(default=MAX_TOKENS, ge=64, le=4096)
+    merchant_hint: str | None = Field(
+        default=None, max_length=200, description="Expected merchant, if known — sharpens the token budget"
+    )
+
+
+class BatchImage(BaseModel):
+    image: str = Field(..., description="Base64-encoded image data")
+    mime_type: str = Field(default="image/png", description="Image MIME type")
+    id: str | None = Field(default=None, description="Caller reference, echoed back")
+
+
+class BatchExtractRequest(BaseModel):
+    images: list[BatchImage] = Field(..., min_length=1)
+    prompt: str | None = Field(default=None, description="Override extraction prompt")
+    max_tokens: int = Field(default=MAX_TOKENS, ge=64, le=4096)
+    stream: bool = Field(default=False, description="NDJSON, one line per image as it finishes")
+
+
+class JobRequest(ExtractRequest):
+    lane: Literal["interactive", "bulk"] = Field(default="bulk", description="Scheduler priority lane")
+    callback_url: str | None = Field(
+        default=None, pattern=r"^https?://", description="POSTed the finished job as JSON"
+    )
 
 
 # ReasonRequest removed — Qwen is OCR-only (Dual-LLM Architecture)
 
 
+# ── Warmup (vision_warmup.py) ───────────────────────────────────────
+# Synthetic receipts go through decode → preprocess → scheduler before
+# /readyz flips: one at a time, then all at once when batching is on, so
+# both the single and the batched kernels are compiled. Results are
+# discarded and never reach the caches, but the generations do show in
+# the scheduler and stage metrics.
+
+_warmup: dict[str, Any] = {"state": "pending", "duration_s": None, "images": 0, "error": None}
+
+
+def _ready() -> bool:
+    # A failed warmup only costs the first request its speed — serve anyway.
+    return _backend is not None and _warmup["state"] in ("done", "failed", "disabled")
+
+
+async def _warm_one(data: bytes) -> None:
+    image, _, _ = await asyncio.to_thread(_decode_and_hash, data)
+    image, _ = await asyncio.to_thread(_preprocess, image)
+    gen_req = GenerationRequest(image, EXTRACT_SYSTEM_PROMPT, WARMUP_MAX_TOKENS)
+    if _backend.requires_image_path:
+        gen_req.image_path = await asyncio.to_thread(_write_ram_file, image)
+    try:
+        await _scheduler.submit(gen_req, wait=True)
+    finally:
+        if gen_req.image_path:
+            os.unlink(gen_req.image_path)
+    _warmup["images"] += 1
+
+
+async def _run_warmup() -> None:
+    if not WARMUP_SIZES:
+        _warmup["state"] = "disabled"
+        return
+    _warmup["state"] = "running"
+    sizes = ", ".join(f"{w}x{h}" for w, h in WARMUP_SIZES)
+    logger.info(f"Warming up with {len(WARMUP_SIZES)} synthetic receipts ({sizes})")
+    t0 = time.perf_counter()
+    try:
+        images = [
+            await asyncio.to_thread(synthetic_receipt, w, h, seed)
+            for seed, (w, h) in enumerate(WARMUP_SIZES)
+        ]
+        for data in images:
+            await _warm_one(data)
+        if BATCH_MAX_SIZE > 1 and len(images) > 1:
+            await asyncio.gather(*(_warm_one(data) for data in images))
+        _warmup["state"] = "done"
+    except asyncio.CancelledError:
+        _warmup["state"] = "cancelled"
+        raise
+    except Exception as e:
+        _warmup["state"] = "failed"
+        _warmup["error"] = f"{type(e).__name__}: {e}"
+        logger.warning(f"Warmup failed, serving cold: {_warmup['error']}")
+    finally:
+        duration = time.perf_counter() - t0
+        _warmup["duration_s"] = round(duration, 3)
+        _startup.add("warmup", duration)
+    logger.info(f"✅ Warm in {duration:.1f}s — ready")
+
+
+# ── Memory governor (vision_memory.py) ──────────────────────────────
+# Sampled every MLX_MEMORY_POLL_S. Each level maps to fixed settings, and
+# falling back to normal restores the configured ones:
+#   high     — memory cache tier to 1/2, PDF pages dropped, MLX buffer
+#              cache cleared, batch size halved
+#   critical — memory cache tier to 1/8, batch size 1, bulk lane held
+#              (queued bulk work waits, new bulk work gets 429)
+# Page and buffer caches are dropped again on every sample above normal.
+# Samples are read straight from the event loop, like /health, so they
+# keep coming while a long batch runs. Only clear_cache() goes through the
+# inference thread (between batches), and the governor doesn't wait on it.
+
+SHED_RETRY_AFTER_S = 30
+_CACHE_DIVISOR = {"normal": 1, "high": 2, "critical": 8}
+_BATCH_SIZE = {"normal": BATCH_MAX_SIZE, "high": max(1, BATCH_MAX_SIZE // 2), "critical": 1}
+
+
+_clear_pending: asyncio.Future | None = None
+
+
+def _sample_backend_memory() -> dict:
+    """Read the backend figures and restart the peak window, so each peak covers one interval."""
+    stats = _backend.memory_stats()
+    _backend.reset_peak_memory()
+    return stats
+
+
+def _log_clear_failure(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Backend clear_cache failed: {future.exception()}")
+
+
+async def _govern_memory() -> None:
+    global _cache_limit, _clear_pending
+    reading = read_memory(_sample_backend_memory())
+    previous, level = _governor.assess(reading)
+    if level != previous:
+        log = logger.info if level == "normal" else logger.warning
+        log(
+            f"MEMORY {previous} → {level} — {reading.pressure_gb:.1f} GB "
+            f"(rss {reading.rss_gb or 0:.1f}, backend {reading.backend_gb or 0:.1f}; "
+            f"watermarks {MEMORY_HIGH_GB:.1f}/{MEMORY_CRITICAL_GB:.1f})"
+        )
+
+    limit = max(1, MAX_CACHE_SIZE // _CACHE_DIVISOR[level])
+    if limit != _cache_limit:
+        action = "shrink_cache" if limit < _cache_limit else "restore_cache"
+        _cache_limit = limit
+        evicted = _trim_cache()
+        _governor.record(action)
+        logger.info(f"MEMORY {action} — limit {limit}, evicted {evicted}")
+
+    if level != "normal":
+        if _page_cache.clear():
+            _governor.record("drop_pdf_pages")
+        cache_held = reading.cache_gb is None or reading.cache_gb > 0
+        if cache_held and (_clear_pending is None or _clear_pending.done()):
+            # Runs after the current batch; one queued clear at a time.
+            _clear_pending = _scheduler.call(_backend.clear_cache)
+            _clear_pending.add_done_callback(_log_clear_failure)
+            _governor.record("clear_backend_cache")
+
+    batch_size = _BATCH_SIZE[level]
+    if batch_size != _scheduler.max_batch_size:
+        action = "reduce_batch" if batch_size < _scheduler.max_batch_size else "restore_batch"
+        _scheduler.max_batch_size = batch_size
+        _governor.record(action)
+        logger.info(f"MEMORY {action} — max batch size {batch_size}")
+
+    hold = level == "critical"
+    if hold != ("bulk" in _scheduler.held):
+        if hold:
+            _scheduler.hold("bulk")
+        else:
+            _scheduler.release("bulk")
+        _governor.record("hold_bulk" if hold else "release_bulk")
+        logger.info(f"MEMORY bulk lane {'held' if hold else 'released'} ({_scheduler.depth('bulk')} queued)")
+
+
+async def _memory_loop() -> None:
+    while True:
+        await asyncio.sleep(MEMORY_POLL_S)
+        try:
+            await _govern_memory()
+        except Exception as e:  # A bad sample must not stop the governor.
+            logger.warning(f"Memory governor sample failed: {type(e).__name__}: {e}")
+
+
+def _admit_bulk() -> None:
+    """Refuse new bulk work while the governor holds the bulk lane."""
+    if _scheduler is not None and "bulk" in _scheduler.held:
+        if _governor is not None:
+            _governor.record("reject_bulk")
+        raise HTTPException(
+            429, "Bulk lane paused under memory pressure", headers={"Retry-After": str(SHED_RETRY_AFTER_S)}
+        )
+
+
 # ── App Lifecycle ──────────────────────────────────────────────────
 
+def _open_merchants() -> asyncio.Task | None:
+    global _merchants
+    _merchants = CatalogueReloader(MERCHANTS_PATH, FAST_PATH_MERCHANTS, MERCHANTS_POLL_S)
+    if not MERCHANTS_PATH:
+        return None
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(
+            signal.SIGHUP, lambda: loop.create_task(_merchants.reload("SIGHUP"))
+        )
+    except (NotImplementedError, RuntimeError, ValueError, AttributeError):
+        # Windows, or an event loop outside the main thread.
+        logger.warning("SIGHUP reload unavailable here — relying on file polling")
+    return loop.create_task(_merchants.watch(), name="merchant-catalogue-watch")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global _scheduler
     _load_model()
+    with _startup.phase("disk_cache"):
+        _open_disk_cache()
+    with _startup.phase("merchants"):
+        watcher = _open_merchants()
+    with _startup.phase("scheduler"):
+        _scheduler = BatchScheduler(
+            _backend,
+            max_batch_size=BATCH_MAX_SIZE,
+            max_wait_ms=BATCH_MAX_WAIT_MS,
+            queue_depth=QUEUE_DEPTH,
+            bulk_queue_depth=BULK_QUEUE_DEPTH,
+        )
+        _scheduler.start()
+    logger.info(f"Startup took {_startup.total():.2f}s")
+    # In the background, so /livez answers while the kernels compile.
+    app.state.warmup = asyncio.create_task(_run_warmup(), name="warmup")
+    app.state.memory = None
+    if _governor is not None:
+        rss_source = read_memory().rss_source
+        logger.info(
+            f"Memory governor: high {MEMORY_HIGH_GB:.1f} GB, critical {MEMORY_CRITICAL_GB:.1f} GB, "
+            f"every {MEMORY_POLL_S:g}s (RSS via {rss_source})"
+        )
+        if rss_source == "maxrss":
+            logger.warning("No current RSS without psutil here — governing on backend memory only")
+        app.state.memory = asyncio.create_task(_memory_loop(), name="memory-governor")
     yield
     logger.info("Shutting down MLX sidecar")
-    mx.metal.clear_cache()
+    app.state.warmup.cancel()
+    if app.state.memory is not None:
+        app.state.memory.cancel()
+    for job in _jobs.pending():
+        if job.task is not None:
+            job.task.cancel()
+    if watcher is not None:
+        watcher.cancel()
+        try:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+        except (NotImplementedError, RuntimeError, ValueError, AttributeError):
+            pass
+    await _scheduler.stop()
+    _scheduler = None
+    if _disk_cache is not None:
+        _disk_cache.close()
+    _backend.clear_cache()
 
 
 app = FastAPI(
@@ -294,6 +876,35 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+class _RequestTimer:
+    """ASGI middleware: observes total time until the final body chunk (SSE included)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        status = "500"
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                route = scope.get("route")
+                _request_seconds.observe(
+                    time.perf_counter() - t0,
+                    path=getattr(route, "path", "other"),
+                    status=status,
+                )
+
+        await self.app(scope, receive, timed_send)
+
+
+app.add_middleware(_RequestTimer)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3001", "http://localhost:5173", "http://127.0.0.1:3001"],
@@ -303,112 +914,1162 @@ app.add_middleware(
 
 
 # ── Endpoints ──────────────────────────────────────────────────────
-# DUAL-LLM ARCHITECTURE: Only /health and /extract are exposed.
+# DUAL-LLM ARCHITECTURE: Only /health, /metrics, /extract(/raw, /stream, /batch)
+# and /jobs are exposed, plus the /livez and /readyz probes.
 # No /reason endpoint — all reasoning is delegated to OpenAI (cloud).
 
+@app.get("/livez")
+async def livez():
+    return {"status": "alive"}
+
+
+@app.get("/readyz")
+async def readyz():
+    body = {"ready": _ready(), "warmup": _warmup["state"]}
+    if not body["ready"]:
+        return JSONResponse(body, status_code=503)
+    return body
+
+
 @app.get("/health")
 async def health():
     return {
         "status": "ok",
         "role": "ocr-only",
         "model": MODEL_ID,
+        "backend": BACKEND_NAME,
         "load_time_s": round(_load_time, 2),
-        "ready": _model is not None,
+        "ready": _ready(),
+        "warmup": {**_warmup, "sizes": [f"{w}x{h}" for w, h in WARMUP_SIZES]},
+        "startup": {
+            **_startup.as_dict(),
+            "processor_snapshot": (
+                _backend.processor_snapshot.stats() if _backend and _backend.processor_snapshot else None
+            ),
+        },
         "cache": {
             "size": len(_content_cache),
-            "max_size": MAX_CACHE_SIZE,
+            "max_size": _cache_limit,
             "hits": _cache_hits,
             "misses": _cache_misses,
             "fast_path_hits": _fast_path_hits,
             "hit_rate": round(_cache_hits / max(1, _cache_hits + _cache_misses), 3),
+            "coalesced": _coalesced_hits,
+            "in_flight": len(_inflight),
+            "near": {
+                "hits": _near_hits,
+                "rejected": _near_rejected,
+                "detail_tolerance": DETAIL_TOLERANCE,
+                "threshold": PHASH_THRESHOLD,
+                "indexed": len(_phash_index) if _phash_index is not None else 0,
+                "avg_lookup_us": round(_near_lookup_s / max(1, _near_lookups) * 1e6, 1),
+            },
+            "tiers": {
+                "memory": {
+                    "entries": len(_content_cache),
+                    "max_entries": _cache_limit,
+                    "bytes": sum(_content_sizes.values()),
+                    "hits": _memory_hits,
+                    "misses": _memory_misses,
+                    "hit_rate": round(_memory_hits / max(1, _memory_hits + _memory_misses), 3),
+                },
+                "disk": _disk_cache.stats() if _disk_cache else None,
+            },
+        },
+        "merchants": _merchants.stats() if _merchants else None,
+        "jobs": _jobs.stats(),
+        "pdf": {"available": _pdf_available(), "page_cache": _page_cache.stats()},
+        "queue": _scheduler.stats() if _scheduler else None,
+        "prefix_cache": _backend.prefix_stats() if _backend else None,
+        "time_to_first_token_ms": _backend.ttft_stats() if _backend else None,
+        "token_budget": {"adaptive": ADAPTIVE_TOKENS, "ceiling": MAX_TOKENS, **_budgets.stats()},
+        "memory": {
+            **(_backend.memory_stats() if _backend else {}),
+            "governor": _governor.stats() if _governor else None,
+        },
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    _m_cache_entries.set(len(_content_cache), tier="memory")
+    _m_cache_entries.set(_page_cache.stats()["pages"], tier="pdf_pages")
+    _m_cache_bytes.set(_page_cache.stats()["bytes"], tier="pdf_pages")
+    _m_cache_bytes.set(sum(_content_sizes.values()), tier="memory")
+    if _disk_cache is not None:
+        disk = await asyncio.to_thread(_disk_cache.stats)
+        _m_cache_entries.set(disk["entries"], tier="disk")
+        _m_cache_bytes.set(disk["bytes"], tier="disk")
+    _m_cache_results.set(_memory_hits, result="memory_hit")
+    _m_cache_results.set(_cache_hits - _memory_hits, result="disk_hit")
+    _m_cache_results.set(_near_hits, result="near_hit")
+    _m_cache_results.set(_near_rejected, result="near_rejected")
+    _m_cache_results.set(_coalesced_hits, result="coalesced")
+    _m_cache_results.set(_cache_misses, result="miss")
+    _m_cache_results.set(_fast_path_hits, result="fast_path")
+    if _scheduler is not None:
+        queue = _scheduler.stats()
+        for lane, lane_stats in queue["lanes"].items():
+            _m_queue_depth.set(lane_stats["depth"], lane=lane)
+            _m_queue_max_depth.set(lane_stats["max_depth"], lane=lane)
+            _m_lane_results.set(lane_stats["completed"], lane=lane, result="completed")
+            _m_lane_results.set(lane_stats["rejected"], lane=lane, result="rejected")
+        _m_preemptions.set(queue["preemptions"])
+        _m_promotions.set(queue["promotions"])
+        _m_queue_busy.set(1 if queue["busy"] else 0)
+        _m_queue_results.set(_scheduler.completed, result="completed")
+        _m_queue_results.set(_scheduler.failed, result="failed")
+        _m_queue_results.set(_scheduler.rejected, result="rejected")
+    memory = _backend.memory_stats() if _backend else {}
+    _m_peak_memory.set(_last_peak_memory_gb, source="generation")
+    _m_peak_memory.set(memory.get("peak_gb"), source="backend")
+    _m_active_memory.set(memory.get("active_gb"))
+    _m_ready.set(1 if _ready() else 0)
+    budgets = _budgets.stats()
+    for source, count in budgets["predictions"].items():
+        _m_budget_predictions.set(count, source=source)
+    _m_budget_truncations.set(budgets["truncations"])
+    _m_warmup_seconds.set(_warmup["duration_s"])
+    if _scheduler is not None:
+        _m_batch_max_size.set(_scheduler.max_batch_size)
+        for lane in queue["lanes"]:
+            _m_lane_held.set(1 if lane in _scheduler.held else 0, lane=lane)
+    if _governor is not None:
+        governor = _governor.stats()
+        _m_memory_level.set(MEMORY_LEVELS.index(governor["level"]))
+        for level, gb in governor["watermarks_gb"].items():
+            _m_memory_watermark.set(gb, level=level)
+        for kind in ("pressure", "rss", "backend"):
+            _m_memory_gb.set((governor["last"] or {}).get(f"{kind}_gb"), kind=kind)
+        for action, levels in governor["actions"].items():
+            for level, count in levels.items():
+                _m_memory_actions.set(count, action=action, level=level)
+    return Response(_metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+def _cache_hit_response(cached: dict, tier: str, content_hash: str) -> dict:
+    logger.info(f"CACHE HIT [{content_hash[:12]}] ({tier}) — LLM bypass")
+    return {
+        **cached,
+        "cache": "hit",
+        "cache_tier": tier,
+        "content_hash": content_hash[:16],
+    }
+
+
+def _near_hit_response(near: tuple[dict, str, int], content_hash: str) -> dict:
+    cached, near_key, distance = near
+    logger.info(f"NEAR HIT [{content_hash[:12]} ≈ {near_key[:12]}] — distance {distance}")
+    return {
+        **cached,
+        "cache": "near-hit",
+        "near_distance": distance,
+        "near_match": near_key[:16],
+        "content_hash": content_hash[:16],
+    }
+
+
+def parse_model_text(text: str) -> Any:
+    """Model output → parsed JSON (markdown fences stripped), or None."""
+    if "```json" in text:
+        text = text.split("```json")[-1].split("```")[0].strip()
+    elif "```" in text:
+        text = text.split("```")[1].split("```")[0].strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
+
+
+async def _finish_extraction(
+    raw: dict,
+    sched: dict,
+    prep: dict,
+    content_hash: str,
+    phash: int | None,
+    budget: Budget | None = None,
+    detail: bytes | None = None,
+) -> dict:
+    """Parse the model text, enrich from the fast-path, cache, and build the response."""
+    global _last_peak_memory_gb
+    _stage_seconds.observe(sched["queue_wait_s"], stage="queue_wait")
+    _stage_seconds.observe(raw["generation_time_s"], stage="generation")
+    _m_tokens.inc(raw["generation_tokens"] or 0)
+    _m_tokens_unreserved.inc(raw.get("tokens_unreserved", 0))
+    if raw["peak_memory_gb"] is not None:
+        _last_peak_memory_gb = raw["peak_memory_gb"]
+
+    with _stage_seconds.time(stage="json_salvage"):
+        extracted = parse_model_text(raw["text"])
+
+    # ── Fast-Path enrichment for known merchants ────────────
+    if extracted and isinstance(extracted, dict):
+        merchant_str = extracted.get("merchant", "") or ""
+        fast_meta = _try_fast_path(merchant_str)
+        if fast_meta:
+            extracted["merchant"] = fast_meta["merchant"]
+            if not extracted.get("category"):
+                extracted["category"] = fast_meta["category"]
+            if not extracted.get("currency"):
+                extracted["currency"] = fast_meta["currency"]
+            logger.info(f"FAST-PATH [{fast_meta['merchant']}] — enriched from known entity")
+
+    result = {
+        "status": "ok",
+        "extraction": extracted,
+        "raw_text": raw["text"],
+        "stats": {
+            "queue_wait_s": sched["queue_wait_s"],
+            "batch_size": sched["batch_size"],
+            "lane": sched.get("lane"),
+            "generation_time_s": raw["generation_time_s"],
+            "generation_tokens": raw["generation_tokens"],
+            "tokens_unreserved": raw.get("tokens_unreserved", 0),
+            "time_to_first_token_s": raw.get("ttft_s"),
+            "prefix_cached": raw.get("prefix_cached"),
+            "tokens_per_second": raw["tokens_per_second"],
+            "peak_memory_gb": raw["peak_memory_gb"],
+            "preprocess": prep,
+        },
+    }
+    if budget is not None:
+        out_w, out_h = prep["output_size"]
+        _budgets.observe(
+            budget,
+            aspect=out_h / max(1, out_w),
+            tokens=raw["generation_tokens"],
+            complete=isinstance(extracted, dict),
+            merchant=extracted.get("merchant") if isinstance(extracted, dict) else None,
+            content_hash=content_hash,
+            phash=phash,
+        )
+        result["stats"]["token_budget"] = budget.report(raw["generation_tokens"])
+
+    # Cache the successful extraction
+    if extracted is not None:
+        await _cache_store(content_hash, result, phash, detail)
+        logger.info(f"CACHE STORE [{content_hash[:12]}] — {len(_content_cache)}/{_cache_limit}")
+
+    return {
+        **result,
+        "cache": "miss",
+        "content_hash": content_hash[:16],
+    }
+
+
+# ── Token budgets (vision_budget.py) ────────────────────────────────
+# The request's max_tokens is the ceiling; with MLX_ADAPTIVE_TOKENS on,
+# the default extraction prompt gets a predicted budget below it. Only
+# batched decodes benefit: a single decode already stops when the JSON
+# closes, so with batching off (or cut to 1 by the memory governor) the
+# ceiling stays. Custom prompts have unknown output shapes and keep the
+# ceiling. /extract/stream also keeps it: streamed text can't be taken
+# back for a retry.
+
+def _token_budget(
+    image, phash: int | None, prompt: str | None, ceiling: int, merchant_hint: str | None
+) -> Budget | None:
+    if not ADAPTIVE_TOKENS or prompt is not None:
+        return None
+    if _scheduler is None or _scheduler.max_batch_size <= 1:
+        return None
+    width, height = image.size
+    return _budgets.predict(
+        aspect=height / max(1, width), ceiling=ceiling, merchant_hint=merchant_hint, phash=phash
+    )
+
+
+def _truncated(raw: dict, limit: int) -> bool:
+    """Decoding hit the limit before the JSON closed.
+
+    Without an exact token count (batched decodes), no stop and no parse
+    counts as a cut-off: a wasted retry beats returning partial JSON.
+    """
+    if raw.get("stopped_early") or isinstance(parse_model_text(raw["text"]), dict):
+        return False
+    tokens = raw.get("generation_tokens")
+    return tokens is None or raw.get("generation_tokens_estimated", False) or tokens >= limit
+
+
+async def _submit(
+    gen_req: GenerationRequest, content_hash: str, lane: str, wait_for_slot: bool
+) -> tuple[dict, dict]:
+    key = _flight.get()
+    if key is not None:
+        lane = _inflight_lanes.get(key, lane)  # Promoted by a follower (see _promote).
+    try:
+        return await _scheduler.submit(gen_req, wait=wait_for_slot, lane=lane, key=key)
+    except QueueFullError as e:
+        logger.warning(f"QUEUE FULL [{content_hash[:12]}] — retry in {e.retry_after}s")
+        raise HTTPException(
+            429, "Inference queue full", headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+async def _extract_image(
+    image_bytes: bytes,
+    content_hash: str,
+    mime_type: str,
+    prompt: str | None,
+    max_tokens: int,
+    lane: str = "interactive",
+    wait_for_slot: bool = False,
+    merchant_hint: str | None = None,
+) -> dict:
+    """Shared pipeline for every upload format: cache → generate → parse → enrich."""
+    if _backend is None or _scheduler is None:
+        raise HTTPException(503, "Model not loaded")
+
+    # ── SHA-256 Content Hash — bypass LLM if cached ─────────────
+    cached, tier = await _cache_lookup(content_hash)
+    if cached is not None:
+        return _cache_hit_response(cached, tier, content_hash)
+
+    return await _extract_coalesced(
+        image_bytes, content_hash, mime_type, prompt, max_tokens, lane, wait_for_slot, merchant_hint
+    )
+
+
+async def _extract_coalesced(
+    image_bytes: bytes,
+    content_hash: str,
+    mime_type: str,
+    prompt: str | None,
+    max_tokens: int,
+    lane: str = "interactive",
+    wait_for_slot: bool = False,
+    merchant_hint: str | None = None,
+) -> dict:
+    """Cache miss: join an identical in-flight generation, or lead a new one."""
+    global _coalesced_hits
+
+    # ── Single-flight — identical uploads already generating share one run ──
+    while (inflight := _inflight.get(content_hash)) is not None:
+        _promote(content_hash, lane)
+        # wait() never cancels the leader's future and only raises
+        # CancelledError when this caller is cancelled, so the two cases stay
+        # apart without Task.cancelling() (Python 3.11+).
+        await asyncio.wait((inflight,))
+        if inflight.cancelled():
+            continue  # Leader's client went away — take over (or join the next leader).
+        shared = inflight.result()  # Re-raises the leader's failure.
+        _coalesced_hits += 1
+        logger.info(f"COALESCED [{content_hash[:12]}] — joined in-flight generation")
+        return {**shared, "cache": "coalesced", "content_hash": content_hash[:16]}
+
+    leader = asyncio.get_running_loop().create_future()
+    _inflight[content_hash] = leader
+    _inflight_lanes[content_hash] = lane
+    token = _flight.set(content_hash)
+    try:
+        response = await _extract_uncached(
+            image_bytes, content_hash, mime_type, prompt, max_tokens, lane, wait_for_slot, merchant_hint
+        )
+    except asyncio.CancelledError:
+        leader.cancel()
+        raise
+    except BaseException as e:
+        leader.set_exception(e)
+        leader.exception()  # Mark retrieved — there may be no followers.
+        raise
+    else:
+        leader.set_result(response)
+        return response
+    finally:
+        _flight.reset(token)
+        _end_flight(content_hash)
+
+
+def _end_flight(content_hash: str) -> None:
+    _inflight.pop(content_hash, None)
+    _inflight_lanes.pop(content_hash, None)
+
+
+def _promote(content_hash: str, lane: str) -> None:
+    """A follower in a higher lane than the leader pulls the leader's work up to it."""
+    current = _inflight_lanes.get(content_hash)
+    if current is None or LANES.index(lane) >= LANES.index(current):
+        return
+    # Later submissions of this generation (retries, PDF pages) use the new lane too.
+    _inflight_lanes[content_hash] = lane
+    moved = _scheduler.promote(content_hash, lane)
+    logger.info(f"PROMOTED [{content_hash[:12]}] {current} → {lane} ({moved} queued)")
+
+
+async def _extract_uncached(
+    image_bytes: bytes,
+    content_hash: str,
+    mime_type: str,
+    prompt: str | None,
+    max_tokens: int,
+    lane: str = "interactive",
+    wait_for_slot: bool = False,
+    merchant_hint: str | None = None,
+) -> dict:
+    if is_pdf(image_bytes):
+        return await _extract_pdf(
+            image_bytes, content_hash, prompt, max_tokens, lane, wait_for_slot, merchant_hint
+        )
+    try:
+        image, phash, detail = await asyncio.to_thread(_decode_and_hash, image_bytes)
+    except Exception:
+        raise HTTPException(400, "Unreadable image data")
+    return await _extract_decoded(
+        image, phash, content_hash, prompt, max_tokens, lane, wait_for_slot, merchant_hint, detail
+    )
+
+
+async def _extract_decoded(
+    image,
+    phash: int | None,
+    content_hash: str,
+    prompt: str | None,
+    max_tokens: int,
+    lane: str = "interactive",
+    wait_for_slot: bool = False,
+    merchant_hint: str | None = None,
+    detail: bytes | None = None,
+) -> dict:
+    """Decoded image → near-duplicate check → preprocess → generate → parse."""
+    # ── Perceptual hash — re-encoded copy of a cached receipt ──
+    if phash is not None:
+        near = await _near_lookup(phash, detail)
+        if near is not None:
+            return _near_hit_response(near, content_hash)
+
+    image, prep = await asyncio.to_thread(_preprocess, image)
+    budget = _token_budget(image, phash, prompt, max_tokens, merchant_hint)
+    gen_req = GenerationRequest(
+        image, prompt or EXTRACT_SYSTEM_PROMPT, budget.tokens if budget else max_tokens
+    )
+    if _backend.requires_image_path:
+        gen_req.image_path = await asyncio.to_thread(_write_ram_file, image)
+
+    try:
+        raw, sched = await _submit(gen_req, content_hash, lane, wait_for_slot)
+        if budget is not None and budget.tokens < max_tokens and _truncated(raw, gen_req.max_tokens):
+            # The prediction was too tight: one retry at the caller's ceiling.
+            logger.info(
+                f"TRUNCATED [{content_hash[:12]}] at {gen_req.max_tokens} tokens "
+                f"({budget.source}) — retrying with {max_tokens}"
+            )
+            _budgets.truncated()
+            budget.retried = True
+            gen_req.max_tokens = max_tokens
+            raw, sched = await _submit(gen_req, content_hash, lane, wait_for_slot=True)
+
+        return await _finish_extraction(raw, sched, prep, content_hash, phash, budget, detail)
+    finally:
+        if gen_req.image_path:
+            os.unlink(gen_req.image_path)
+
+
+# ── PDF invoices (vision_pdf.py) ────────────────────────────────────
+# Pages are rendered one at a time and each goes through the image
+# pipeline under its own cache key; reading stops at the first page
+# whose extraction has a total. The merged result is cached under the
+# document hash like any image.
+#
+# Pages skip the dHash near-duplicate tier and are never indexed in it:
+# monthly bills from one biller share a layout down to the last bit, so
+# only an exact page hash may reuse an earlier page's extraction. Each
+# page's cache outcome is listed in the merged result.
+
+def _pdf_available() -> bool:
+    import importlib.util
+
+    return importlib.util.find_spec("pypdfium2") is not None
+
+
+def _render_page(doc: PdfDocument, doc_hash: str, index: int) -> tuple[Any, int, bool]:
+    """(image, dpi, rendered_now) for one page, via the page cache."""
+    width_pt, height_pt = doc.page_size(index)
+    dpi = choose_dpi(width_pt, height_pt, MAX_PIXELS)
+    key = (doc_hash, index, dpi)
+    image = _page_cache.get(key)
+    rendered = image is None
+    if rendered:
+        with _stage_seconds.time(stage="pdf_render"):
+            image = doc.render(index, dpi)
+        _page_cache.put(key, image)
+    return image, dpi, rendered
+
+
+def _merge_pages(merged: dict | None, extraction: Any) -> dict | None:
+    """First non-null value per field wins; items accumulate across pages."""
+    if not isinstance(extraction, dict):
+        return merged
+    if merged is None:
+        merged = {**extraction, STREAMED_ARRAY: []}
+    for key, value in extraction.items():
+        if key == STREAMED_ARRAY:
+            if isinstance(value, list):
+                merged[STREAMED_ARRAY].extend(value)
+        elif merged.get(key) is None and value is not None:
+            merged[key] = value
+    return merged
+
+
+async def _extract_pdf(
+    pdf_bytes: bytes,
+    content_hash: str,
+    prompt: str | None,
+    max_tokens: int,
+    lane: str = "interactive",
+    wait_for_slot: bool = False,
+    merchant_hint: str | None = None,
+) -> dict:
+    t0 = time.perf_counter()
+    try:
+        doc = await asyncio.to_thread(PdfDocument, pdf_bytes)
+    except PdfUnavailableError as e:
+        raise HTTPException(415, str(e))
+    except Exception:
+        raise HTTPException(400, "Unreadable PDF")
+
+    merged: dict | None = None
+    pages: list[dict] = []
+    raw_texts: list[str] = []
+    try:
+        for index in range(min(doc.page_count, PDF_MAX_PAGES)):
+            image, dpi, rendered = await asyncio.to_thread(_render_page, doc, content_hash, index)
+            page_hash = _sha256(f"{content_hash}:{index}:{dpi}".encode())
+            cached, tier = await _cache_lookup(page_hash)
+            if cached is not None:
+                result = _cache_hit_response(cached, tier, page_hash)
+            else:
+                # phash=None: exact page hash only, no near-duplicate lookup.
+                result = await _extract_decoded(
+                    image, None, page_hash, prompt, max_tokens, lane, wait_for_slot, merchant_hint
+                )
+            extraction = result.get("extraction")
+            merged = _merge_pages(merged, extraction)
+            raw_texts.append(result.get("raw_text") or "")
+            has_total = isinstance(extraction, dict) and extraction.get("total") is not None
+            pages.append({
+                "page": index + 1,
+                "dpi": dpi,
+                "size": list(image.size),
+                "rendered": rendered,
+                "cache": result["cache"],
+                "cache_tier": result.get("cache_tier"),
+                "has_total": has_total,
+                "stats": result.get("stats"),
+            })
+            if has_total:
+                break
+    finally:
+        await asyncio.to_thread(doc.close)
+
+    stopped_early = len(pages) < doc.page_count
+    logger.info(
+        f"PDF [{content_hash[:12]}] — {len(pages)}/{doc.page_count} pages read"
+        f"{' (total found)' if pages and pages[-1]['has_total'] else ''}"
+    )
+    page_stats = [p["stats"] or {} for p in pages]
+    result = {
+        "status": "ok",
+        "extraction": merged,
+        "raw_text": "\n\n".join(raw_texts),
+        "pages": pages,
+        "stats": {
+            "page_count": doc.page_count,
+            "pages_processed": len(pages),
+            "stopped_early": stopped_early,
+            "pages_rendered": sum(1 for p in pages if p["rendered"]),
+            "pages_cached": sum(1 for p in pages if p["cache"] == "hit"),
+            "generation_time_s": round(sum(s.get("generation_time_s") or 0 for s in page_stats), 2),
+            "generation_tokens": sum(s.get("generation_tokens") or 0 for s in page_stats),
+            "total_time_s": round(time.perf_counter() - t0, 3),
         },
     }
+    if merged is not None:
+        await _cache_store(content_hash, result)
+    return {**result, "cache": "miss", "content_hash": content_hash[:16]}
 
 
 @app.post("/extract")
 async def extract(req: ExtractRequest):
-    if _model is None:
+    if _backend is None or _scheduler is None:
         raise HTTPException(503, "Model not loaded")
 
     try:
-        image_bytes = base64.b64decode(req.image)
+        image_bytes = _b64decode(req.image)
+    except Exception:
+        raise HTTPException(400, "Invalid base64 image data")
+
+    return await _extract_image(
+        image_bytes, _sha256(image_bytes), req.mime_type, req.prompt, req.max_tokens,
+        merchant_hint=req.merchant_hint,
+    )
+
+
+def _check_content_length(request: Request, limit: int) -> None:
+    """Refuse a declared-oversize body before reading any of it."""
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > limit:
+        raise HTTPException(413, f"Image larger than {MAX_UPLOAD_BYTES} bytes")
+
+
+async def _read_hashed(chunks: AsyncIterator[bytes]) -> tuple[bytes, str]:
+    """Buffer an upload while hashing it chunk by chunk (no base64, no JSON)."""
+    t0 = time.perf_counter()
+    digest = hashlib.sha256()
+    buf = bytearray()
+    async for chunk in chunks:
+        if len(buf) + len(chunk) > MAX_UPLOAD_BYTES:
+            raise HTTPException(413, f"Image larger than {MAX_UPLOAD_BYTES} bytes")
+        digest.update(chunk)
+        buf += chunk
+    if not buf:
+        raise HTTPException(400, "Empty image upload")
+    # Hashing is interleaved with the socket reads, so it is timed as one stage.
+    _stage_seconds.observe(time.perf_counter() - t0, stage="upload_read")
+    return bytes(buf), digest.hexdigest()
+
+
+# Form fields, part headers and boundaries allowed on top of the image itself.
+_MULTIPART_OVERHEAD = 64 * 1024
+_MULTIPART_FIELDS = (b"image", b"file")
+
+
+class _MultipartImage:
+    """
+    Push parser for a multipart/form-data body that keeps only the image.
+
+    The first file part named `image` or `file` is hashed and buffered as
+    its bytes arrive; every other part is parsed and dropped. Nothing is
+    spooled, so an oversized image is refused mid-read, not after the
+    whole body has landed on disk.
+    """
+
+    def __init__(self, multipart, boundary: bytes):
+        self._parse_options = multipart.multipart.parse_options_header
+        self.digest = hashlib.sha256()
+        self.data = bytearray()
+        self.mime_type: str | None = None
+        self.found = False
+        self.too_large = False
+        self._capturing = False
+        self._headers: dict[bytes, bytes] = {}
+        self._field = bytearray()
+        self._value = bytearray()
+        self.parser = multipart.MultipartParser(boundary, {
+            "on_part_begin": self._part_begin,
+            "on_header_field": lambda data, start, end: self._field.extend(data[start:end]),
+            "on_header_value": lambda data, start, end: self._value.extend(data[start:end]),
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        })
+
+    def _part_begin(self) -> None:
+        self._headers = {}
+
+    def _header_end(self) -> None:
+        self._headers[bytes(self._field).lower()] = bytes(self._value)
+        self._field.clear()
+        self._value.clear()
+
+    def _headers_finished(self) -> None:
+        _, options = self._parse_options(self._headers.get(b"content-disposition"))
+        if not self.found and options.get(b"name") in _MULTIPART_FIELDS and b"filename" in options:
+            self._capturing = True
+            content_type = self._headers.get(b"content-type")
+            self.mime_type = content_type.decode("latin-1") if content_type else None
+
+    def _part_data(self, data: bytes, start: int, end: int) -> None:
+        if not self._capturing or self.too_large:
+            return
+        if len(self.data) + end - start > MAX_UPLOAD_BYTES:
+            self.too_large = True
+            return
+        chunk = data[start:end]
+        self.digest.update(chunk)
+        self.data += chunk
+
+    def _part_end(self) -> None:
+        if self._capturing:
+            self._capturing = False
+            self.found = True
+
+
+def _multipart_module():
+    try:
+        import python_multipart as multipart
+    except ModuleNotFoundError:
+        try:
+            import multipart  # python-multipart < 0.0.13
+        except ModuleNotFoundError:
+            raise HTTPException(
+                415, "multipart uploads need python-multipart (pip install python-multipart)"
+            ) from None
+    return multipart
+
+
+async def _read_multipart_hashed(request: Request) -> tuple[bytes, str, str | None]:
+    """(image bytes, SHA-256, part content type) straight off the socket."""
+    multipart = _multipart_module()
+    _, params = multipart.multipart.parse_options_header(request.headers.get("content-type"))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise HTTPException(400, "multipart upload without a boundary")
+
+    t0 = time.perf_counter()
+    reader = _MultipartImage(multipart, boundary)
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_UPLOAD_BYTES + _MULTIPART_OVERHEAD:
+                raise HTTPException(413, f"Image larger than {MAX_UPLOAD_BYTES} bytes")
+            reader.parser.write(chunk)
+            if reader.too_large:
+                raise HTTPException(413, f"Image larger than {MAX_UPLOAD_BYTES} bytes")
+        reader.parser.finalize()
+    except multipart.exceptions.FormParserError:
+        raise HTTPException(400, "Malformed multipart upload")
+    if not reader.found:
+        raise HTTPException(400, "multipart upload needs an 'image' file part")
+    if not reader.data:
+        raise HTTPException(400, "Empty image upload")
+    _stage_seconds.observe(time.perf_counter() - t0, stage="upload_read")
+    return bytes(reader.data), reader.digest.hexdigest(), reader.mime_type
+
+
+@app.post("/extract/raw")
+async def extract_raw(
+    request: Request,
+    prompt: str | None = Query(default=None, description="Override extraction prompt"),
+    max_tokens: int = Query(default=MAX_TOKENS, ge=64, le=4096),
+    merchant_hint: str | None = Query(default=None, max_length=200, description="Expected merchant, if known"),
+):
+    """
+    Binary upload — skips the ~33% base64 inflation and the JSON parse.
+
+    Accepts either the raw bytes (application/octet-stream, image/* or
+    application/pdf) or multipart/form-data with the image in an `image`
+    (or `file`) part. Both are hashed while they are read, and refused
+    with 413 as soon as they pass MLX_MAX_UPLOAD_MB (or up front, from
+    Content-Length).
+    """
+    if _backend is None or _scheduler is None:
+        raise HTTPException(503, "Model not loaded")
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "multipart/form-data":
+        _check_content_length(request, MAX_UPLOAD_BYTES + _MULTIPART_OVERHEAD)
+        image_bytes, content_hash, part_type = await _read_multipart_hashed(request)
+        mime_type = part_type or "image/png"
+    elif content_type in ("application/octet-stream", "application/pdf") or content_type.startswith("image/"):
+        _check_content_length(request, MAX_UPLOAD_BYTES)
+        mime_type = content_type if content_type != "application/octet-stream" else "image/png"
+        image_bytes, content_hash = await _read_hashed(request.stream())
+    else:
+        raise HTTPException(
+            415, "Use application/octet-stream, image/*, application/pdf or multipart/form-data"
+        )
+
+    return await _extract_image(
+        image_bytes, content_hash, mime_type, prompt, max_tokens, merchant_hint=merchant_hint
+    )
+
+
+# ── Streaming (SSE) ────────────────────────────────────────────────
+# /extract/stream sends `token` events as text is decoded, `field` events
+# as soon as each top-level value (merchant, total, currency, date, …) or
+# each element of `items` is complete, then one `done` event carrying the
+# same body /extract would have returned. Failures arrive as `error`.
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _field_payload(event: FieldEvent) -> dict:
+    payload = {"field": event.field, "value": event.value}
+    if event.index is not None:
+        payload["index"] = event.index
+    return payload
+
+
+async def _replay_events(response: dict) -> AsyncIterator[str]:
+    """Cache hits: emit the stored extraction as field events, then done."""
+    extraction = response.get("extraction")
+    if isinstance(extraction, dict):
+        for key, value in extraction.items():
+            if key == STREAMED_ARRAY and isinstance(value, list):
+                for index, item in enumerate(value):
+                    yield _sse("field", _field_payload(FieldEvent(key, item, index)))
+            else:
+                yield _sse("field", _field_payload(FieldEvent(key, value)))
+    yield _sse("done", response)
+
+
+async def _finish_stream(
+    future: asyncio.Future, prep: dict, content_hash: str, phash: int | None, detail: bytes | None
+) -> dict:
+    raw, sched = await future
+    return await _finish_extraction(raw, sched, prep, content_hash, phash, detail=detail)
+
+
+async def _generation_events(
+    finished: asyncio.Future, segments: asyncio.Queue[str | None], content_hash: str
+) -> AsyncIterator[str]:
+    parser = IncrementalFieldParser()
+    try:
+        while (segment := await segments.get()) is not None:
+            yield _sse("token", {"text": segment})
+            for event in parser.feed(segment):
+                yield _sse("field", _field_payload(event))
+        # Shielded: a client that goes away must not cancel caching the result,
+        # nor the /extract calls that joined this generation.
+        yield _sse("done", await asyncio.shield(finished))
+    except Exception as e:
+        logger.warning(f"STREAM FAILED [{content_hash[:12]}] — {e}")
+        yield _sse("error", {"detail": str(e) or type(e).__name__})
+
+
+def _settle(leader: asyncio.Future, outcome: asyncio.Future) -> None:
+    """Hand a finished generation's outcome to the callers that joined it."""
+    if outcome.cancelled():
+        leader.cancel()
+    elif (error := outcome.exception()) is not None:
+        leader.set_exception(error)
+        leader.exception()  # Mark retrieved — there may be no followers.
+    else:
+        leader.set_result(outcome.result())
+
+
+def _sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/extract/stream")
+async def extract_stream(req: ExtractRequest):
+    if _backend is None or _scheduler is None:
+        raise HTTPException(503, "Model not loaded")
+
+    try:
+        image_bytes = _b64decode(req.image)
     except Exception:
         raise HTTPException(400, "Invalid base64 image data")
 
-    # ── SHA-256 Content Hash — bypass LLM if cached ─────────────
     content_hash = _sha256(image_bytes)
-    cached = _cache_get(content_hash)
+    cached, tier = await _cache_lookup(content_hash)
     if cached is not None:
-        logger.info(f"CACHE HIT [{content_hash[:12]}] — LLM bypass, <5ms")
-        return {
-            **cached,
-            "cache": "hit",
-            "content_hash": content_hash[:16],
-        }
+        return _sse_response(_replay_events(_cache_hit_response(cached, tier, content_hash)))
+    if is_pdf(image_bytes) or content_hash in _inflight:
+        # PDFs go page by page with early exit, streamed as the merged result.
+        # An image already generating (for /extract or another stream) is
+        # joined rather than run twice, and replayed once it finishes.
+        response = await _extract_coalesced(
+            image_bytes, content_hash, req.mime_type, req.prompt, req.max_tokens
+        )
+        return _sse_response(_replay_events(response))
+
+    # Lead this generation: /extract calls and streams for the same image join it.
+    leader = asyncio.get_running_loop().create_future()
+    _inflight[content_hash] = leader
+    _inflight_lanes[content_hash] = "interactive"
+    try:
+        started = await _start_stream(req, image_bytes, content_hash)
+    except asyncio.CancelledError:
+        _end_flight(content_hash)
+        leader.cancel()
+        raise
+    except BaseException as e:
+        _end_flight(content_hash)
+        leader.set_exception(e)
+        leader.exception()  # Mark retrieved — there may be no followers.
+        raise
+
+    if isinstance(started, dict):  # Near-duplicate hit.
+        _end_flight(content_hash)
+        leader.set_result(started)
+        return _sse_response(_replay_events(started))
+
+    # The flight ends with the generation, not with this client's connection.
+    finished, segments = started
+    def settle(outcome: asyncio.Future) -> None:
+        _end_flight(content_hash)
+        _settle(leader, outcome)
+
+    finished.add_done_callback(settle)
+    return _sse_response(_generation_events(finished, segments, content_hash))
+
+
+async def _start_stream(
+    req: ExtractRequest, image_bytes: bytes, content_hash: str
+) -> dict | tuple[asyncio.Future, asyncio.Queue[str | None]]:
+    """Near-duplicate response, or (finished extraction, decoded text segments)."""
+    try:
+        image, phash, detail = await asyncio.to_thread(_decode_and_hash, image_bytes)
+    except Exception:
+        raise HTTPException(400, "Unreadable image data")
+    if phash is not None and (near := await _near_lookup(phash, detail)) is not None:
+        return _near_hit_response(near, content_hash)
 
-    ext = req.mime_type.split("/")[-1].replace("jpeg", "jpg")
-    with tempfile.NamedTemporaryFile(suffix=f".{ext}", delete=False) as f:
-        f.write(image_bytes)
-        tmp_path = f.name
+    image, prep = await asyncio.to_thread(_preprocess, image)
+    gen_req = GenerationRequest(image, req.prompt or EXTRACT_SYSTEM_PROMPT, req.max_tokens)
+    if _backend.requires_image_path:
+        gen_req.image_path = await asyncio.to_thread(_write_ram_file, image)
 
+    loop = asyncio.get_running_loop()
+    segments: asyncio.Queue[str | None] = asyncio.Queue()
+    try:
+        future = _scheduler.enqueue(
+            gen_req,
+            on_text=lambda text: loop.call_soon_threadsafe(segments.put_nowait, text),
+            key=content_hash,
+        )
+    except QueueFullError as e:
+        if gen_req.image_path:
+            os.unlink(gen_req.image_path)
+        logger.warning(f"QUEUE FULL [{content_hash[:12]}] — retry in {e.retry_after}s")
+        raise HTTPException(
+            429, "Inference queue full", headers={"Retry-After": str(e.retry_after)}
+        )
+    # Segments are scheduled before the result is set, so None always arrives last.
+    future.add_done_callback(lambda _: segments.put_nowait(None))
+    if gen_req.image_path:
+        # A client that disconnects closes the event stream, not the generation:
+        # the inference thread may still be reading the file until the future resolves.
+        future.add_done_callback(lambda _, path=gen_req.image_path: os.unlink(path))
+    finished = asyncio.ensure_future(_finish_stream(future, prep, content_hash, phash, detail))
+    return finished, segments
+
+
+# ── Bulk (/extract/batch) ───────────────────────────────────────────
+# One call for a month of receipts or every page of an invoice. Images are
+# hashed and de-duplicated up front, cache hits are answered at once, and
+# the misses are scheduled together so the micro-batcher can pack them.
+# Bulk submissions wait for queue space instead of failing with 429.
+
+async def _batch_item(
+    image_bytes: bytes,
+    content_hash: str,
+    mime_type: str,
+    prompt: str | None,
+    max_tokens: int,
+) -> tuple[str, dict]:
+    """One unique image of a batch; failures become an error result, not a failed batch."""
     try:
-        prompt = req.prompt or EXTRACT_SYSTEM_PROMPT
-        raw = _generate_from_image(tmp_path, prompt, req.max_tokens)
-
-        # Try to parse the text as JSON
-        extracted = None
-        text = raw["text"]
-        # Strip markdown fences if present
-        if "```json" in text:
-            text = text.split("```json")[-1].split("```")[0].strip()
-        elif "```" in text:
-            text = text.split("```")[1].split("```")[0].strip()
+        return content_hash, await _extract_coalesced(
+            image_bytes, content_hash, mime_type, prompt, max_tokens, "bulk", wait_for_slot=True
+        )
+    except HTTPException as e:
+        return content_hash, {"status": "error", "detail": e.detail, "status_code": e.status_code}
+    except Exception as e:
+        logger.warning(f"BATCH ITEM FAILED [{content_hash[:12]}] — {e}")
+        error = {"status": "error", "detail": str(e) or type(e).__name__, "status_code": 500}
+        return content_hash, error
+
+
+def _batch_summary(results: list[dict], unique: int, elapsed_s: float) -> dict:
+    outcomes: dict[str, int] = {}
+    generated = 0
+    tokens = 0
+    queue_wait_max = 0.0
+    for result in results:
+        outcome = result.get("cache") or result.get("status", "error")
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        if result.get("cache") == "miss" and "duplicate_of" not in result:
+            stats = result.get("stats") or {}
+            generated += 1
+            tokens += stats.get("generation_tokens") or 0
+            queue_wait_max = max(queue_wait_max, stats.get("queue_wait_s") or 0.0)
+    return {
+        "images": len(results),
+        "unique": unique,
+        "duplicates": len(results) - unique,
+        "generated": generated,
+        "outcomes": outcomes,
+        "errors": sum(1 for r in results if r.get("status") == "error"),
+        "generation_tokens": tokens,
+        "max_queue_wait_s": round(queue_wait_max, 3),
+        "total_time_s": round(elapsed_s, 3),
+        "images_per_second": round(len(results) / max(elapsed_s, 1e-6), 2),
+    }
+
 
+@app.post("/extract/batch")
+async def extract_batch(req: BatchExtractRequest):
+    if _backend is None or _scheduler is None:
+        raise HTTPException(503, "Model not loaded")
+    if len(req.images) > BULK_MAX_IMAGES:
+        raise HTTPException(413, f"At most {BULK_MAX_IMAGES} images per batch")
+    _admit_bulk()
+
+    t0 = time.perf_counter()
+    # ── Decode + hash everything first; a malformed entry fails the call early ──
+    decoded: list[tuple[bytes, str]] = []
+    for index, item in enumerate(req.images):
         try:
-            extracted = json.loads(text)
-        except json.JSONDecodeError:
-            extracted = None
-
-        # ── Fast-Path enrichment for known merchants ────────────
-        if extracted and isinstance(extracted, dict):
-            merchant_str = extracted.get("merchant", "") or ""
-            fast_meta = _try_fast_path(merchant_str)
-            if fast_meta:
-                extracted["merchant"] = fast_meta["merchant"]
-                if not extracted.get("category"):
-                    extracted["category"] = fast_meta["category"]
-                if not extracted.get("currency"):
-                    extracted["currency"] = fast_meta["currency"]
-                logger.info(f"FAST-PATH [{fast_meta['merchant']}] — enriched from known entity")
-
-        result = {
+            image_bytes = _b64decode(item.image)
+        except Exception:
+            raise HTTPException(400, f"Invalid base64 image data at index {index}")
+        decoded.append((image_bytes, _sha256(image_bytes)))
+
+    # ── De-duplicate by content hash — each unique image is extracted once ──
+    positions: dict[str, list[int]] = {}
+    for index, (_, content_hash) in enumerate(decoded):
+        positions.setdefault(content_hash, []).append(index)
+
+    results: list[dict | None] = [None] * len(decoded)
+    pending: list[asyncio.Task[tuple[str, dict]]] = []
+    for content_hash, indices in positions.items():
+        cached, tier = await _cache_lookup(content_hash)
+        if cached is not None:
+            results[indices[0]] = _cache_hit_response(cached, tier, content_hash)
+            continue
+        image_bytes = decoded[indices[0]][0]
+        pending.append(asyncio.create_task(_batch_item(
+            image_bytes, content_hash, req.images[indices[0]].mime_type, req.prompt, req.max_tokens
+        )))
+    logger.info(
+        f"BATCH — {len(decoded)} images, {len(positions)} unique, "
+        f"{len(positions) - len(pending)} cached, {len(pending)} scheduled"
+    )
+
+    def expand(content_hash: str) -> list[dict]:
+        """Fill every position of a finished hash; duplicates point at the first."""
+        indices = positions[content_hash]
+        first = results[indices[0]]
+        out = []
+        for n, index in enumerate(indices):
+            result = first if n == 0 else {**first, "duplicate_of": indices[0]}
+            results[index] = result
+            out.append({"index": index, "id": req.images[index].id, **result})
+        return out
+
+    if not req.stream:
+        try:
+            for content_hash, result in await asyncio.gather(*pending):
+                results[positions[content_hash][0]] = result
+        finally:
+            for task in pending:
+                task.cancel()
+        items = []
+        for content_hash in positions:
+            items.extend(expand(content_hash))
+        items.sort(key=lambda item: item["index"])
+        return {
             "status": "ok",
-            "extraction": extracted,
-            "raw_text": raw["text"],
-            "stats": {
-                "generation_time_s": raw["generation_time_s"],
-                "tokens_per_second": raw["tokens_per_second"],
-                "peak_memory_gb": raw["peak_memory_gb"],
-            },
+            "results": items,
+            "stats": _batch_summary(results, len(positions), time.perf_counter() - t0),
         }
 
-        # Cache the successful extraction
-        if extracted is not None:
-            _cache_put(content_hash, result)
-            logger.info(f"CACHE STORE [{content_hash[:12]}] — {len(_content_cache)}/{MAX_CACHE_SIZE}")
+    async def ndjson() -> AsyncIterator[str]:
+        try:
+            for content_hash in positions:
+                if results[positions[content_hash][0]] is not None:
+                    for item in expand(content_hash):
+                        yield json.dumps(item, ensure_ascii=False) + "\n"
+            for done in asyncio.as_completed(pending):
+                content_hash, result = await done
+                results[positions[content_hash][0]] = result
+                for item in expand(content_hash):
+                    yield json.dumps(item, ensure_ascii=False) + "\n"
+            summary = _batch_summary(results, len(positions), time.perf_counter() - t0)
+            yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+        finally:
+            for task in pending:
+                task.cancel()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+# ── Async jobs (/jobs) ──────────────────────────────────────────────
+# Fire-and-poll for callers that can't hold a connection open: the TS
+# night-shift worker submits in the bulk lane, so a backfill never sits
+# in front of a user waiting on a receipt in the interactive lane.
+
+async def _run_job(job, image_bytes: bytes, req: JobRequest) -> None:
+    try:
+        result = await _extract_image(
+            image_bytes, job.content_hash, req.mime_type, req.prompt, req.max_tokens,
+            lane=job.lane, wait_for_slot=True, merchant_hint=req.merchant_hint,
+        )
+    except HTTPException as e:
+        _jobs.fail(job, e.status_code, e.detail)
+    except asyncio.CancelledError:
+        _jobs.fail(job, 503, "Sidecar shutting down")
+        raise
+    except Exception as e:
+        logger.warning(f"JOB FAILED [{job.id}] — {e}")
+        _jobs.fail(job, 500, str(e) or type(e).__name__)
+    else:
+        _jobs.finish(job, result)
+    logger.info(f"JOB {job.status.upper()} [{job.id}] ({job.lane}) in {job.finished_at - job.created_at:.2f}s")
+    if job.callback_url:
+        job.callback = {"pending": True}
+        job.callback = await asyncio.to_thread(deliver_callback, job.callback_url, job.view())
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(req: JobRequest):
+    if _backend is None or _scheduler is None:
+        raise HTTPException(503, "Model not loaded")
 
-        return {
-            **result,
-            "cache": "miss",
-            "content_hash": content_hash[:16],
-        }
-    finally:
-        os.unlink(tmp_path)
+    try:
+        image_bytes = _b64decode(req.image)
+    except Exception:
+        raise HTTPException(400, "Invalid base64 image data")
+    if req.lane == "bulk":
+        _admit_bulk()
+
+    job = _jobs.create(req.lane, _sha256(image_bytes), req.callback_url)
+    if job is None:
+        raise HTTPException(
+            429, "Too many pending jobs", headers={"Retry-After": str(_scheduler.retry_after("bulk"))}
+        )
+    job.task = asyncio.create_task(_run_job(job, image_bytes, req), name=f"job-{job.id}")
+    return job.view()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown or expired job")
+    return job.view()
 
 
 # ── Entry Point ────────────────────────────────────────────────────
 
+async def _report_startup() -> None:
+    """Boot as the server would, print where the time went, shut down."""
+    async with lifespan(app):
+        await app.state.warmup
+    print("\nStartup phases")
+    print(_startup.format())
+    modules = ["mlx_vision_server", *(_backend.import_modules if _backend else ())]
+    profile = await asyncio.to_thread(
+        importtime_profile, modules, cwd=str(Path(__file__).resolve().parent)
+    )
+    print("\nImport time (fresh interpreter)")
+    print(format_importtime(profile))
+
+
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MLX Vision OCR sidecar")
+    parser.add_argument(
+        "--report-startup",
+        action="store_true",
+        help="load the model, print a phase-by-phase startup breakdown and an import-time profile, then exit",
+    )
+    args = parser.parse_args()
+    if args.report_startup:
+        asyncio.run(_report_startup())
+        sys.exit(0)
+
     import uvicorn
 
     def handle_sigterm(signum, frame):
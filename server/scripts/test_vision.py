@@ -16,17 +16,226 @@ Usage:
     source ~/mlx-env/bin/activate
     python server/scripts/test_vision.py /path/to/receipt.jpg
     python server/scripts/test_vision.py /path/to/receipt.png --prompt "What items are listed?"
+
+Batch mode — load the model once, run a whole folder:
+    python server/scripts/test_vision.py --dir ~/receipts --out results.jsonl
+    python server/scripts/test_vision.py --glob "~/receipts/2025-*.jpg" --prompt "..."
+
+  Images are decoded by a small thread pool ahead of the generation loop,
+  so disk reads and JPEG decoding overlap with the model. Each image
+  becomes one JSONL line (timings, token counts, parsed fields); a summary
+  is printed at the end.
 """
 
 import sys
 import argparse
+import json
+import statistics
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # ── Model Config ───────────────────────────────────────────────
 # 8B 4-bit: ~5GB RAM — comfortable on 24GB M4 Pro
 MODEL_ID = "mlx-community/Qwen3-VL-8B-Instruct-4bit"
 
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tiff"}
+SUMMARY_FIELDS = ("merchant", "total", "currency", "date", "items")
+
+DEFAULT_PROMPT = (
+    "You are a receipt and invoice data extractor for a personal finance app. "
+    "Analyze this image carefully and extract the following fields in strict JSON format:\n"
+    "{\n"
+    '  "merchant": "store or business name",\n'
+    '  "total": 0.00,\n'
+    '  "currency": "EUR",\n'
+    '  "date": "YYYY-MM-DD",\n'
+    '  "items": [{"name": "item", "quantity": 1, "price": 0.00}]\n'
+    "}\n\n"
+    "Rules:\n"
+    "- Return ONLY valid JSON. No markdown, no explanation, no code fences.\n"
+    "- If a field is not visible, use null.\n"
+    "- Amounts must be numbers, not strings.\n"
+    "- Default currency is EUR unless clearly stated otherwise."
+)
+
+
+# ── Model ──────────────────────────────────────────────────────
+
+def load_model(model_id: str):
+    """(model, processor, config, load seconds) — exits with install hints if mlx-vlm is missing."""
+    print("  ⏳ Loading model (first run downloads ~5GB from HuggingFace)...")
+    t0 = time.perf_counter()
+
+    try:
+        # Patch transformers for Qwen3-VL on MLX (no torchvision needed)
+        sys.path.insert(0, str(Path(__file__).resolve().parent))
+        import patch_transformers  # noqa: F401
+
+        from mlx_vlm import load
+        from mlx_vlm.utils import load_config
+    except ImportError:
+        print(
+            "\n  ❌ mlx-vlm not installed. Run:\n"
+            "     python3 -m venv ~/mlx-env\n"
+            "     source ~/mlx-env/bin/activate\n"
+            "     pip install mlx mlx-lm mlx-vlm\n"
+        )
+        sys.exit(1)
+
+    model, processor = load(model_id)
+    config = load_config(model_id)
+
+    load_time = time.perf_counter() - t0
+    print(f"  ✅ Model loaded in {load_time:.1f}s")
+    print()
+    return model, processor, config, load_time
+
+
+def parse_json(text: str):
+    """Model text → dict, tolerating markdown fences (same rules as the sidecar)."""
+    if "```json" in text:
+        text = text.split("```json")[-1].split("```")[0].strip()
+    elif "```" in text:
+        text = text.split("```")[1].split("```")[0].strip()
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+# ── Batch mode ─────────────────────────────────────────────────
+
+def collect_images(directory: str | None, pattern: str | None) -> list[Path]:
+    if directory:
+        root, pattern = Path(directory).expanduser(), pattern or "**/*"
+    else:
+        full = Path(pattern).expanduser()
+        # Path.glob only takes relative patterns: split off the root of absolute ones.
+        root = Path(full.anchor) if full.is_absolute() else Path(".")
+        pattern = str(full.relative_to(root)) if full.is_absolute() else pattern
+    paths = root.glob(pattern)
+    return sorted(p for p in paths if p.is_file() and p.suffix.lower() in IMAGE_SUFFIXES)
+
+
+def decode_image(path: Path):
+    """(RGB PIL image, seconds) — runs on the decode pool."""
+    from PIL import Image, ImageOps
+
+    t0 = time.perf_counter()
+    img = ImageOps.exif_transpose(Image.open(path))
+    img = img.convert("RGB")
+    return img, time.perf_counter() - t0
+
+
+def prefetch(paths: list[Path], workers: int):
+    """Yield (path, future) in order, keeping at most 2 × workers decodes in flight."""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode") as pool:
+        ahead = 2 * workers
+        futures = [pool.submit(decode_image, p) for p in paths[:ahead]]
+        for i, path in enumerate(paths):
+            if i + ahead < len(paths):
+                futures.append(pool.submit(decode_image, paths[i + ahead]))
+            yield path, futures[i]
+            futures[i] = None  # Drop the decoded image once it has been used.
+
+
+def run_batch(args, paths: list[Path], prompt: str) -> None:
+    print(f"  📂 Images: {len(paths)}  →  {args.out}")
+    print()
+    model, processor, config, load_time = load_model(args.model)
+    from mlx_vlm import generate
+    from mlx_vlm.prompt_utils import apply_chat_template
+
+    formatted_prompt = apply_chat_template(processor, config, prompt, num_images=1)
+
+    records = []
+    t_start = time.perf_counter()
+    with open(args.out, "w", encoding="utf-8") as out:
+        for n, (path, future) in enumerate(prefetch(paths, args.workers), start=1):
+            record = {"file": str(path)}
+            t_wait = time.perf_counter()
+            try:
+                image, decode_s = future.result()
+                record["decode_s"] = round(decode_s, 3)
+                # Time the loop actually stalled on decoding (0 when prefetch kept up).
+                record["decode_wait_s"] = round(time.perf_counter() - t_wait, 3)
+                t1 = time.perf_counter()
+                output = generate(
+                    model,
+                    processor,
+                    formatted_prompt,
+                    [image],
+                    max_tokens=args.max_tokens,
+                    verbose=False,
+                )
+                record["generation_s"] = round(time.perf_counter() - t1, 3)
+            except Exception as e:  # One bad file must not end a 300-image run.
+                record["error"] = f"{type(e).__name__}: {e}"
+            else:
+                text = output.text if hasattr(output, "text") else str(output)
+                extraction = parse_json(text)
+                record.update({
+                    "prompt_tokens": getattr(output, "prompt_tokens", None),
+                    "generation_tokens": getattr(output, "generation_tokens", None),
+                    "tokens_per_second": round(getattr(output, "generation_tps", 0) or 0, 1),
+                    "peak_memory_gb": round(getattr(output, "peak_memory", 0) or 0, 2),
+                    "parsed": extraction is not None,
+                    "extraction": extraction,
+                    "raw_text": text,
+                })
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            records.append(record)
+
+            status = "❌ " + record["error"] if "error" in record else (
+                f"{record['generation_s']:.1f}s  {record['generation_tokens']} tok  "
+                + ("✅ json" if record["parsed"] else "⚠️  no json")
+            )
+            print(f"  [{n:>{len(str(len(paths)))}}/{len(paths)}] {path.name}  {status}")
+
+    print_summary(records, time.perf_counter() - t_start, load_time)
+
+
+def _pct(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def print_summary(records: list[dict], wall_s: float, load_time: float) -> None:
+    done = [r for r in records if "error" not in r]
+    parsed = [r for r in done if r["parsed"]]
+    gen = [r["generation_s"] for r in done]
+    tokens = sum(r["generation_tokens"] or 0 for r in done)
+    waits = sum(r["decode_wait_s"] for r in done)
+
+    print()
+    print("═" * 60)
+    print("  BATCH SUMMARY")
+    print("═" * 60)
+    print(f"  Images:   {len(records)}  │  ok {len(done)}  │  failed {len(records) - len(done)}")
+    print(f"  Parsed:   {len(parsed)}/{len(done)} valid JSON")
+    if gen:
+        print(
+            f"  Gen:      mean {statistics.fmean(gen):.1f}s  │  p50 {_pct(gen, 50):.1f}s  │  "
+            f"p95 {_pct(gen, 95):.1f}s  │  max {max(gen):.1f}s"
+        )
+        print(f"  Tokens:   {tokens} generated  │  {tokens / max(1e-9, sum(gen)):.0f} tok/s")
+        print(f"  Decode:   {waits:.1f}s waited on the decode pool")
+        print(f"  Memory:   peak {max(r['peak_memory_gb'] for r in done):.1f}GB")
+    if parsed:
+        fill = "  ".join(
+            f"{f} {sum(1 for r in parsed if r['extraction'].get(f) not in (None, '', [])) / len(parsed):.0%}"
+            for f in SUMMARY_FIELDS
+        )
+        print(f"  Fields:   {fill}")
+    print(
+        f"  📊 Wall: {wall_s:.1f}s ({len(records) / max(1e-9, wall_s):.2f} img/s)  │  "
+        f"Load: {load_time:.1f}s (once)"
+    )
+    print("═" * 60)
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -35,8 +244,33 @@ def main():
     parser.add_argument(
         "image_path",
         type=str,
+        nargs="?",
         help="Path to a local image file (receipt, invoice, etc.)",
     )
+    parser.add_argument(
+        "--dir",
+        type=str,
+        default=None,
+        help="Batch mode: every image in this directory (recursive)",
+    )
+    parser.add_argument(
+        "--glob",
+        type=str,
+        default=None,
+        help='Batch mode: images matching this pattern (relative to --dir if given), e.g. "~/receipts/*.jpg"',
+    )
+    parser.add_argument(
+        "--out",
+        type=str,
+        default="test_vision_results.jsonl",
+        help="Batch mode: per-image JSONL output (default: test_vision_results.jsonl)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Batch mode: image decode threads (default: 4)",
+    )
     parser.add_argument(
         "--prompt",
         type=str,
@@ -57,6 +291,31 @@ def main():
     )
     args = parser.parse_args()
 
+    batch = bool(args.dir or args.glob)
+    if batch == bool(args.image_path):
+        parser.error("give either an image path or --dir/--glob")
+    if args.dir and not Path(args.dir).expanduser().is_dir():
+        parser.error(f"not a directory: {args.dir}")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    prompt = args.prompt or DEFAULT_PROMPT
+
+    print("╔══════════════════════════════════════════════════════════╗")
+    print("║       SOVEREIGN SYMBIOTE — LOCAL VISION ENGINE          ║")
+    print("╚══════════════════════════════════════════════════════════╝")
+    print()
+    print(f"  🔧 Model:  {args.model}")
+
+    if batch:
+        paths = collect_images(args.dir, args.glob)
+        if not paths:
+            print(f"❌ No images ({', '.join(sorted(IMAGE_SUFFIXES))}) found")
+            sys.exit(1)
+        print(f"  💬 Prompt: {prompt[:60]}...")
+        run_batch(args, paths, prompt)
+        return
+
     # ── Validate image ─────────────────────────────────────────
     image_path = Path(args.image_path).resolve()
     if not image_path.is_file():
@@ -64,64 +323,17 @@ def main():
         sys.exit(1)
 
     suffix = image_path.suffix.lower()
-    if suffix not in {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tiff"}:
+    if suffix not in IMAGE_SUFFIXES:
         print(f"⚠️  Unusual image format: {suffix}. Proceeding anyway...")
 
-    # ── Build the prompt ───────────────────────────────────────
-    default_prompt = (
-        "You are a receipt and invoice data extractor for a personal finance app. "
-        "Analyze this image carefully and extract the following fields in strict JSON format:\n"
-        "{\n"
-        '  "merchant": "store or business name",\n'
-        '  "total": 0.00,\n'
-        '  "currency": "EUR",\n'
-        '  "date": "YYYY-MM-DD",\n'
-        '  "items": [{"name": "item", "quantity": 1, "price": 0.00}]\n'
-        "}\n\n"
-        "Rules:\n"
-        "- Return ONLY valid JSON. No markdown, no explanation, no code fences.\n"
-        "- If a field is not visible, use null.\n"
-        "- Amounts must be numbers, not strings.\n"
-        "- Default currency is EUR unless clearly stated otherwise."
-    )
-    prompt = args.prompt or default_prompt
-
-    print("╔══════════════════════════════════════════════════════════╗")
-    print("║       SOVEREIGN SYMBIOTE — LOCAL VISION ENGINE          ║")
-    print("╚══════════════════════════════════════════════════════════╝")
-    print()
-    print(f"  🔧 Model:  {args.model}")
     print(f"  📷 Image:  {image_path.name}")
     print(f"  💬 Prompt: {prompt[:60]}...")
     print()
 
     # ── Load model ─────────────────────────────────────────────
-    print("  ⏳ Loading model (first run downloads ~5GB from HuggingFace)...")
-    t0 = time.perf_counter()
-
-    try:
-        # Patch transformers for Qwen3-VL on MLX (no torchvision needed)
-        sys.path.insert(0, str(Path(__file__).resolve().parent))
-        import patch_transformers  # noqa: F401
-
-        from mlx_vlm import load, generate
-        from mlx_vlm.prompt_utils import apply_chat_template
-        from mlx_vlm.utils import load_config
-    except ImportError:
-        print(
-            "\n  ❌ mlx-vlm not installed. Run:\n"
-            "     python3 -m venv ~/mlx-env\n"
-            "     source ~/mlx-env/bin/activate\n"
-            "     pip install mlx mlx-lm mlx-vlm\n"
-        )
-        sys.exit(1)
-
-    model, processor = load(args.model)
-    config = load_config(args.model)
-
-    load_time = time.perf_counter() - t0
-    print(f"  ✅ Model loaded in {load_time:.1f}s")
-    print()
+    model, processor, config, load_time = load_model(args.model)
+    from mlx_vlm import generate
+    from mlx_vlm.prompt_utils import apply_chat_template
 
     # ── Build chat and generate ────────────────────────────────
     formatted_prompt = apply_chat_template(
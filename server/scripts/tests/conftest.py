@@ -0,0 +1,7 @@
+"""Tests for the MLX Vision OCR sidecar modules. Run: python -m pytest server/scripts/tests"""
+
+import sys
+from pathlib import Path
+
+# The sidecar modules import each other as siblings (see mlx_vision_server.py).
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,235 @@
+import asyncio
+import threading
+
+import pytest
+from PIL import Image
+
+import vision_backends
+from vision_backends import GenerationRequest, StubBackend
+from vision_scheduler import BatchScheduler, QueueFullError
+
+
+class RecordingBackend(StubBackend):
+    """Stub that remembers the prompts of each batch it was handed."""
+
+    def __init__(self):
+        super().__init__("stub")
+        self.batches: list[list[str]] = []
+
+    def generate_batch(self, requests):
+        self.batches.append([r.prompt for r in requests])
+        return super().generate_batch(requests)
+
+
+@pytest.fixture(autouse=True)
+def fast_stub(monkeypatch):
+    monkeypatch.setattr(vision_backends, "STUB_S_PER_MPIXEL", 0.0)
+    monkeypatch.setattr(vision_backends, "STUB_S_PER_TOKEN", 0.0)
+
+
+def _request(tag: str) -> GenerationRequest:
+    # The prompt doubles as a tag so tests can tell requests apart in a batch.
+    return GenerationRequest(Image.new("RGB", (64, 64), "white"), tag, max_tokens=512)
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_requests_share_one_batch():
+    async def scenario():
+        backend = RecordingBackend()
+        scheduler = BatchScheduler(backend, max_batch_size=4, max_wait_ms=50)
+        scheduler.start()
+        try:
+            results = await asyncio.gather(*(scheduler.submit(_request(f"r{i}")) for i in range(3)))
+        finally:
+            await scheduler.stop()
+        return backend, scheduler, results
+
+    backend, scheduler, results = _run(scenario())
+    assert backend.batches == [["r0", "r1", "r2"]]
+    assert [sched["batch_size"] for _, sched in results] == [3, 3, 3]
+    assert all(raw["stopped_early"] and raw["text"].endswith("}") for raw, _ in results)
+    assert scheduler.stats()["batching"]["batch_size_histogram"] == {"3": 1}
+
+
+def test_batches_are_capped_at_max_batch_size():
+    async def scenario():
+        backend = RecordingBackend()
+        scheduler = BatchScheduler(backend, max_batch_size=2, max_wait_ms=50)
+        scheduler.start()
+        try:
+            await asyncio.gather(*(scheduler.submit(_request(f"r{i}")) for i in range(5)))
+        finally:
+            await scheduler.stop()
+        return backend
+
+    backend = _run(scenario())
+    assert [len(batch) for batch in backend.batches] == [2, 2, 1]
+
+
+def test_interactive_lane_is_served_before_bulk():
+    async def scenario():
+        backend = RecordingBackend()
+        scheduler = BatchScheduler(backend, max_batch_size=4, max_wait_ms=0)
+        # Queue everything before the consumer runs: bulk first, interactive last.
+        bulk = [scheduler.enqueue(_request(f"bulk{i}"), lane="bulk") for i in range(2)]
+        interactive = scheduler.enqueue(_request("interactive"))
+        scheduler.start()
+        try:
+            results = await asyncio.gather(*bulk, interactive)
+        finally:
+            await scheduler.stop()
+        return backend, results
+
+    backend, results = _run(scenario())
+    assert backend.batches == [["interactive"], ["bulk0", "bulk1"]]
+    assert [sched["lane"] for _, sched in results] == ["bulk", "bulk", "interactive"]
+
+
+def test_interactive_work_preempts_a_collecting_bulk_batch():
+    async def scenario():
+        backend = RecordingBackend()
+        scheduler = BatchScheduler(backend, max_batch_size=4, max_wait_ms=500)
+        scheduler.start()
+        try:
+            bulk = scheduler.enqueue(_request("bulk"), lane="bulk")
+            await asyncio.sleep(0.05)  # The collector now holds the bulk job, waiting for more.
+            interactive = scheduler.enqueue(_request("interactive"))
+            await asyncio.gather(bulk, interactive)
+        finally:
+            await scheduler.stop()
+        return backend, scheduler
+
+    backend, scheduler = _run(scenario())
+    assert backend.batches[0] == ["interactive"]
+    assert ["bulk"] in backend.batches[1:]
+    assert scheduler.preemptions == 1
+
+
+def test_jobs_being_collected_count_against_the_lane_bound():
+    async def scenario():
+        backend = RecordingBackend()
+        scheduler = BatchScheduler(backend, max_batch_size=4, max_wait_ms=500, bulk_queue_depth=1)
+        scheduler.start()
+        try:
+            bulk = scheduler.enqueue(_request("bulk"), lane="bulk")
+            await asyncio.sleep(0.05)  # Taken off the lane, still collecting.
+            with pytest.raises(QueueFullError):
+                scheduler.enqueue(_request("bulk-overflow"), lane="bulk")
+            interactive = scheduler.enqueue(_request("interactive"))
+            await asyncio.sleep(0)  # The collector hands the bulk job back.
+            depth_after_preemption = scheduler.stats()["lanes"]["bulk"]["depth"]
+            await asyncio.gather(bulk, interactive)
+        finally:
+            await scheduler.stop()
+        return scheduler, depth_after_preemption
+
+    scheduler, depth_after_preemption = _run(scenario())
+    assert scheduler.preemptions == 1
+    assert depth_after_preemption == 1
+
+
+def test_stop_fails_the_running_batch_without_waiting_for_it():
+    gate = threading.Event()
+
+    class BlockingBackend(RecordingBackend):
+        def generate_batch(self, requests):
+            gate.wait(5)
+            return super().generate_batch(requests)
+
+    async def scenario():
+        scheduler = BatchScheduler(BlockingBackend(), max_wait_ms=0)
+        scheduler.start()
+        running = scheduler.enqueue(_request("running"))
+        await asyncio.sleep(0.05)  # Now blocked on the inference thread.
+        stopping = asyncio.create_task(scheduler.stop())
+        await asyncio.sleep(0.05)
+        failed_before_batch_ended = running.done()
+        gate.set()
+        await stopping
+        return running, failed_before_batch_ended
+
+    running, failed_before_batch_ended = _run(scenario())
+    assert failed_before_batch_ended
+    assert isinstance(running.exception(), RuntimeError)
+
+
+def test_stop_fails_jobs_still_being_collected():
+    async def scenario():
+        scheduler = BatchScheduler(RecordingBackend(), max_wait_ms=500)
+        scheduler.start()
+        collecting = scheduler.enqueue(_request("collecting"))
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+        return collecting
+
+    assert isinstance(_run(scenario()).exception(), RuntimeError)
+
+
+def test_promote_moves_a_queued_job_up_a_lane():
+    async def scenario():
+        backend = RecordingBackend()
+        scheduler = BatchScheduler(backend, max_batch_size=4, max_wait_ms=0)
+        bulk = [scheduler.enqueue(_request(f"bulk{i}"), lane="bulk", key=f"k{i}") for i in range(3)]
+        moved = scheduler.promote("k2", "interactive")
+        scheduler.start()
+        try:
+            results = await asyncio.gather(*bulk)
+        finally:
+            await scheduler.stop()
+        return backend, results, moved
+
+    backend, results, moved = _run(scenario())
+    assert moved == 1
+    assert backend.batches == [["bulk2"], ["bulk0", "bulk1"]]
+    assert results[2][1]["lane"] == "interactive"
+
+
+def test_promote_leaves_jobs_when_the_lane_is_full():
+    async def scenario():
+        scheduler = BatchScheduler(RecordingBackend(), queue_depth=1)
+        scheduler.enqueue(_request("interactive"))
+        scheduler.enqueue(_request("bulk"), lane="bulk", key="k")
+        moved = scheduler.promote("k", "interactive")
+        depths = scheduler.depth("interactive"), scheduler.depth("bulk")
+        await scheduler.stop()
+        return moved, depths
+
+    assert _run(scenario()) == (0, (1, 1))
+
+
+def test_held_lane_waits_for_release():
+    async def scenario():
+        backend = RecordingBackend()
+        scheduler = BatchScheduler(backend, max_batch_size=4, max_wait_ms=0)
+        scheduler.hold("bulk")
+        scheduler.start()
+        try:
+            bulk = scheduler.enqueue(_request("bulk"), lane="bulk")
+            await asyncio.sleep(0.05)
+            served_while_held = list(backend.batches)
+            scheduler.release("bulk")
+            await bulk
+        finally:
+            await scheduler.stop()
+        return backend, served_while_held
+
+    backend, served_while_held = _run(scenario())
+    assert served_while_held == []
+    assert backend.batches == [["bulk"]]
+
+
+def test_full_lane_rejects_with_retry_after():
+    async def scenario():
+        scheduler = BatchScheduler(RecordingBackend(), queue_depth=1)
+        scheduler.enqueue(_request("first"))
+        with pytest.raises(QueueFullError) as excinfo:
+            scheduler.enqueue(_request("second"))
+        await scheduler.stop()
+        return scheduler, excinfo.value
+
+    scheduler, error = _run(scenario())
+    assert error.retry_after >= 1
+    assert scheduler.lane_rejected["interactive"] == 1
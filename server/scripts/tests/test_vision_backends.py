@@ -0,0 +1,28 @@
+from PIL import Image
+
+from vision_backends import GenerationRequest, StubBackend
+
+
+def _request(prompt: str) -> GenerationRequest:
+    return GenerationRequest(Image.new("RGB", (64, 64), "white"), prompt, max_tokens=64)
+
+
+def test_ttft_is_split_by_whether_the_prefix_was_cached():
+    backend = StubBackend("stub")
+    backend.pin_prompt("extract")
+    results = backend.generate_batch([_request("extract"), _request("custom")])
+
+    assert [r["prefix_cached"] for r in results] == [True, False]
+    stats = backend.ttft_stats()
+    assert stats["prefix_cached"]["samples"] == stats["prefix_built"]["samples"] == 1
+    assert stats["all"]["samples"] == 2
+
+
+def test_disabled_prefix_cache_templates_every_request():
+    backend = StubBackend("stub")
+    backend.prefix_cache_enabled = False
+    results = backend.generate_batch([_request("extract"), _request("extract")])
+
+    assert [r["prefix_cached"] for r in results] == [False, False]
+    assert backend.prefix_stats()["entries"] == 0
+    assert backend.prefix_misses == 2
@@ -0,0 +1,34 @@
+from vision_budget import TokenBudgetPredictor
+
+
+def test_prior_leaves_long_receipts_their_room():
+    predictor = TokenBudgetPredictor(floor=128)
+    assert predictor.predict(aspect=1.0, ceiling=1024).tokens >= 400
+    assert predictor.predict(aspect=2.0, ceiling=2048).tokens >= 850
+    long_strip = predictor.predict(aspect=2.5, ceiling=2048)
+    assert long_strip.source == "prior" and long_strip.tokens >= 1000
+    assert predictor.predict(aspect=3.0, ceiling=1024).source == "ceiling"
+
+
+def test_merchant_history_takes_over_from_the_prior():
+    predictor = TokenBudgetPredictor(floor=128)
+    for used in (100, 110, 120):
+        budget = predictor.predict(aspect=1.0, ceiling=1024, merchant_hint="Lidl")
+        predictor.observe(budget, aspect=1.0, tokens=used, complete=True, merchant="Lidl")
+
+    budget = predictor.predict(aspect=1.0, ceiling=1024, merchant_hint="LIDL")
+    assert budget.source == "merchant" and budget.tokens < 200
+
+
+def test_layout_match_finds_the_merchant_without_a_hint():
+    predictor = TokenBudgetPredictor(floor=128)
+    layout = 0xF0F0_F0F0_0F0F_0F0F
+    for i, used in enumerate((100, 110, 120)):
+        budget = predictor.predict(aspect=1.0, ceiling=1024, phash=layout)
+        predictor.observe(
+            budget, aspect=1.0, tokens=used, complete=True, merchant="Lidl",
+            content_hash=f"receipt-{i}", phash=layout ^ (1 << i),
+        )
+
+    budget = predictor.predict(aspect=1.0, ceiling=1024, phash=layout ^ 0b1000)
+    assert budget.source == "merchant" and budget.merchant == "lidl"
@@ -0,0 +1,93 @@
+import io
+
+from PIL import Image, ImageDraw
+
+from vision_cache import DETAIL_TOLERANCE, DiskCache, HammingIndex, detail_distance, detail_print, dhash
+
+
+def _receipt(total: str = "23.47", size: tuple[int, int] = (600, 1200)) -> Image.Image:
+    img = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(img)
+    for row in range(12):
+        draw.rectangle((40, 60 + row * 80, 40 + 30 * (row % 5 + 4), 90 + row * 80), fill=20)
+    draw.text((400, 1100), total, fill=0, font_size=48)
+    return img.convert("RGB")
+
+
+def _jpeg(img: Image.Image, quality: int) -> Image.Image:
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return Image.open(io.BytesIO(buf.getvalue())).convert("RGB")
+
+
+def test_nearest_finds_hashes_within_the_threshold():
+    index = HammingIndex(max_distance=4)
+    base = 0xF0F0_F0F0_0F0F_0F0F
+    index.add("a", base)
+    index.add("b", base ^ 0b111)          # 3 bits away
+    index.add("far", base ^ 0xFF)         # 8 bits away
+
+    assert index.nearest(base) == ("a", 0)
+    assert index.nearest(base ^ 0b110) == ("b", 1)
+    assert index.nearest(base ^ (1 << 63) ^ (1 << 40) ^ (1 << 20)) == ("a", 3)
+    assert index.nearest(base ^ 0xFFFF_0000_0000_0000) is None
+
+
+def test_candidates_lists_every_match_closest_first():
+    index = HammingIndex(max_distance=4)
+    index.add("two", 0b11)
+    index.add("zero", 0)
+    index.add("four", 0b1111)
+    index.add("five", 0b11111)
+
+    assert index.candidates(0) == [("zero", 0), ("two", 2), ("four", 4)]
+    assert index.candidates(1 << 62 | 1 << 61 | 1 << 60 | 1 << 59 | 1 << 58) == []
+
+
+def test_remove_and_replace_keep_the_tables_in_sync():
+    index = HammingIndex(max_distance=2)
+    index.add("a", 0)
+    index.add("a", (1 << 64) - 1)  # Re-adding a key replaces its hash.
+    assert len(index) == 1
+    assert index.nearest(0) is None
+
+    index.remove("a")
+    index.remove("a")  # Unknown keys are ignored.
+    assert len(index) == 0
+    assert index.nearest((1 << 64) - 1) is None
+
+
+def test_dhash_survives_reencoding():
+    img = _receipt()
+    assert (dhash(img) ^ dhash(_jpeg(img, 40))).bit_count() <= 2
+
+
+def test_detail_distance_accepts_reencodes_and_rejects_changed_digits():
+    original = detail_print(_receipt())
+
+    assert detail_distance(original, original) == 0.0
+    assert detail_distance(original, detail_print(_jpeg(_receipt(), 60))) <= DETAIL_TOLERANCE
+    assert detail_distance(original, detail_print(_receipt(total="28.47"))) > DETAIL_TOLERANCE
+
+
+def test_detail_distance_refuses_prints_of_different_shapes():
+    tall = detail_print(_receipt(size=(600, 1200)))
+    taller = detail_print(_receipt(size=(600, 1500)))
+    assert detail_distance(tall, taller) is None
+
+
+def test_disk_stats_scope_totals_to_the_file_and_splits_out_the_model(tmp_path):
+    path = tmp_path / "extractions.sqlite3"
+    old = DiskCache(path, namespace="old-model", max_bytes=1 << 20, ttl_s=3600)
+    old.put("a", {"total": 1})
+    old.put("b", {"total": 2})
+    old.close()
+
+    cache = DiskCache(path, namespace="new-model", max_bytes=1 << 20, ttl_s=3600)
+    cache.put("c", {"total": 3})
+    stats = cache.stats()
+    cache.close()
+
+    assert stats["entries"] == 3
+    assert stats["model"]["entries"] == 1
+    assert 0 < stats["model"]["bytes"] < stats["bytes"]
@@ -0,0 +1,77 @@
+from vision_json import STREAMED_ARRAY, FieldEvent, IncrementalFieldParser, JsonStopCriterion
+
+RECEIPT = (
+    '```json\n{"merchant": "Caf\\u00e9 {Central}", "total": 3.1, "currency": "EUR",\n'
+    ' "items": [{"name": "Caf\\u00e9 \\"duplo\\"", "price": 1.5}, {"name": "\\u00c1gua", "price": 1.6}],\n'
+    ' "date": null}\n```\nAnything else?'
+)
+
+
+def _feed_all(parser: IncrementalFieldParser, fragments) -> list[FieldEvent]:
+    events: list[FieldEvent] = []
+    for fragment in fragments:
+        events.extend(parser.feed(fragment))
+    return events
+
+
+def test_parser_emits_fields_and_items_across_single_char_fragments():
+    parser = IncrementalFieldParser()
+    events = _feed_all(parser, RECEIPT)
+
+    assert parser.complete
+    assert events == [
+        FieldEvent("merchant", "Café {Central}"),
+        FieldEvent("total", 3.1),
+        FieldEvent("currency", "EUR"),
+        FieldEvent(STREAMED_ARRAY, {"name": 'Café "duplo"', "price": 1.5}, 0),
+        FieldEvent(STREAMED_ARRAY, {"name": "Água", "price": 1.6}, 1),
+        FieldEvent("date", None),
+    ]
+    assert RECEIPT[:parser.consumed].endswith("null}")
+
+
+def test_parser_fragmentation_does_not_change_events():
+    whole = _feed_all(IncrementalFieldParser(), [RECEIPT])
+    for size in (2, 3, 7, 16):
+        chunks = [RECEIPT[i:i + size] for i in range(0, len(RECEIPT), size)]
+        assert _feed_all(IncrementalFieldParser(), chunks) == whole
+
+
+def test_parser_skips_malformed_values_and_keeps_going():
+    parser = IncrementalFieldParser()
+    events = _feed_all(parser, ['{"total": 12.3.4, "items": [{"name": oops}, {"name": "ok"}], ', '"currency": "EUR"}'])
+
+    assert events == [
+        FieldEvent(STREAMED_ARRAY, {"name": "ok"}, 0),
+        FieldEvent("currency", "EUR"),
+    ]
+    assert parser.complete
+
+
+def test_parser_ignores_input_after_the_object_closes():
+    parser = IncrementalFieldParser()
+    parser.feed('{"total": 1}')
+    assert parser.feed('{"total": 2}') == []
+
+
+def test_stop_criterion_fires_on_the_closing_brace_with_overshoot():
+    stop = JsonStopCriterion()
+    assert not stop.feed('```json\n{"merchant": "A}", ')
+    assert not stop.feed('"items": [{"name": "\\"}\\""}]')
+    assert stop.feed('}\n```')
+    assert stop.overshoot == len("\n```")
+
+
+def test_stop_criterion_ignores_braces_before_the_object_and_in_strings():
+    stop = JsonStopCriterion()
+    assert not stop.feed('Sure} here:\n')  # Chatter before the JSON starts.
+    assert not stop.feed('{"a": "}}}"')
+    assert stop.feed("}")
+    assert stop.overshoot == 0
+
+
+def test_stop_criterion_never_fires_on_unclosed_json():
+    stop = JsonStopCriterion()
+    for fragment in ['{"merchant": "Lidl", ', '"items": [{"name": "P', "ão"]:
+        assert not stop.feed(fragment)
+    assert not stop.done
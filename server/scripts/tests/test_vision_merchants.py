@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from vision_merchants import MerchantCatalogue, MerchantMatcher, normalize
+
+# How receipts and OCR actually print the built-in merchants.
+BUILTIN_SPELLINGS = {
+    "McDonald's": "McDonald's",
+    "McDonalds": "McDonald's",
+    "MCDONALDS PORTUGAL": "McDonald's",
+    "Mc Donalds": "McDonald's",
+    "Mc Donald’s": "McDonald's",
+    "McDonald": "McDonald's",
+    "PINGO DOCE LISBOA": "Pingo Doce",
+    "Continente Modelo": "Continente",
+    "LIDL & Cia": "Lidl",
+    "ALDI": "Aldi",
+    "Mercadona S.A.": "Mercadona",
+    "EDP Comercial": "EDP",
+    "GALP Energia": "Galp",
+    "MEO": "MEO",
+    "Vodafone Portugal": "Vodafone",
+    "NOS Comunicações": "NOS",
+    "Uber Trip": "Uber",
+    "Bolt.eu": "Bolt",
+    "Worten": "Worten",
+    "Fnac Portugal": "FNAC",
+    "ZARA": "Zara",
+    "Primark": "Primark",
+    "Burger King": "Burger King",
+    "BurgerKing": "Burger King",
+    "IKEA Alfragide": "IKEA",
+}
+
+
+def _matcher(*keys: str) -> MerchantMatcher[str]:
+    return MerchantMatcher((key, key) for key in keys)
+
+
+def test_normalize_folds_case_accents_and_punctuation():
+    assert normalize("  CAFÉ--Central!! ") == "cafe central"
+    assert normalize("McDonald’s") == normalize("McDonald's") == "mcdonalds"
+
+
+def test_keys_only_match_whole_words():
+    matcher = _matcher("nos", "meo")
+    assert matcher.match("Santos Lda") is None
+    assert matcher.match("Romeo Café") is None
+    assert matcher.match("NOS Comunicações") == "nos"
+    assert matcher.match("fatura meo.pt") == "meo"
+
+
+def test_longest_match_wins():
+    matcher = _matcher("king", "burger king", "burger")
+    assert matcher.match("BURGER KING Colombo") == "burger king"
+
+
+def test_equal_length_ties_go_to_the_leftmost():
+    matcher = _matcher("lidl", "aldi")
+    assert matcher.match("Aldi vs Lidl") == "aldi"
+
+
+def test_overlapping_keys_through_failure_links():
+    # "pingo doce" shares no prefix with "doce", which must still be found via failure links.
+    matcher = _matcher("pingo doce", "doce", "go")
+    assert matcher.match("pingo docex") is None
+    assert matcher.match("pin doce") == "doce"
+    assert matcher.match("PINGO DOCE LISBOA") == "pingo doce"
+
+
+def test_accented_text_matches_plain_key():
+    assert _matcher("cafe central").match("Café Central") == "cafe central"
+
+
+def test_spacing_and_possessive_variants_match():
+    matcher = _matcher("mcdonald")
+    for text in ("McDonalds", "Mc Donald's", "MC-DONALDS Lda", "mcdonald"):
+        assert matcher.match(text) == "mcdonald", text
+    assert matcher.match("McDonaldson") is None
+
+
+@pytest.mark.parametrize("spelling, merchant", BUILTIN_SPELLINGS.items())
+def test_builtin_table_matches_printed_spellings(spelling, merchant):
+    pytest.importorskip("fastapi")
+    from mlx_vision_server import FAST_PATH_MERCHANTS
+
+    builtin = MerchantCatalogue.from_entries(list(FAST_PATH_MERCHANTS.items()), "builtin")
+    meta = builtin.match(spelling)
+    assert meta is not None and meta["merchant"] == merchant
+
+
+def test_file_catalogue_gets_the_same_variants(tmp_path):
+    path = tmp_path / "merchants.json"
+    path.write_text(json.dumps([{"merchant": "McDonald's", "category": "Restaurante"}]))
+    catalogue = MerchantCatalogue.from_file(path)
+    for text in ("McDonalds", "Mc Donald's", "MCDONALDS PORTUGAL", "Mc Donalds"):
+        assert catalogue.match(text)["merchant"] == "McDonald's", text
@@ -0,0 +1,42 @@
+from vision_metrics import Registry
+
+
+def test_histogram_renders_cumulative_buckets_sum_and_count():
+    registry = Registry()
+    hist = registry.histogram("stage_seconds", "Per-stage time", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        hist.observe(value, stage="generation")
+
+    assert registry.render().splitlines() == [
+        "# HELP stage_seconds Per-stage time",
+        "# TYPE stage_seconds histogram",
+        'stage_seconds_bucket{stage="generation",le="0.1"} 2',
+        'stage_seconds_bucket{stage="generation",le="1"} 3',
+        'stage_seconds_bucket{stage="generation",le="+Inf"} 4',
+        'stage_seconds_sum{stage="generation"} 3.65',
+        'stage_seconds_count{stage="generation"} 4',
+    ]
+
+
+def test_series_are_sorted_and_label_values_escaped():
+    registry = Registry()
+    gauge = registry.gauge("depth", "Queue depth")
+    gauge.set(3, lane="bulk")
+    gauge.set(1, lane='inter"active\n')
+    gauge.set(None, lane="gone")
+
+    assert registry.render().splitlines()[2:] == [
+        'depth{lane="bulk"} 3',
+        'depth{lane="inter\\"active\\n"} 1',
+    ]
+
+
+def test_counter_increments_and_unlabelled_series_have_no_braces():
+    registry = Registry()
+    counter = registry.counter("tokens_total", "Tokens decoded")
+    counter.inc(5)
+    counter.inc(2.5)
+
+    text = registry.render()
+    assert "# TYPE tokens_total counter" in text
+    assert text.endswith("tokens_total 7.5\n")
@@ -0,0 +1,33 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from vision_preprocess import STAGES, _crop, parse_stages, preprocess
+
+
+@pytest.mark.parametrize("mode, colour", [("RGB", (200, 30, 30)), ("L", 255), ("L", 0)])
+def test_uniform_image_skips_the_crop(mode, colour):
+    # Solid-colour photos and blank PDF pages have a single-level histogram.
+    img = Image.new(mode, (1200, 1600), colour)
+    assert _crop(img, 1_000_000) is img
+
+
+def test_uniform_image_survives_the_full_pipeline():
+    out, report = preprocess(Image.new("RGB", (3024, 4032), "white"), STAGES, 1_254_400)
+    assert out.mode == "RGB"
+    assert report["output_pixels"] <= 1_254_400
+
+
+def test_crop_trims_to_the_paper():
+    img = Image.new("RGB", (2000, 2000), (40, 40, 40))
+    ImageDraw.Draw(img).rectangle((600, 200, 1399, 1799), fill=(245, 245, 245))
+    cropped = _crop(img, 1_000_000)
+    # The 800×1600 paper plus a small margin, not the 2000×2000 table.
+    assert 800 <= cropped.width < 1000
+    assert 1600 <= cropped.height < 1800
+
+
+def test_parse_stages_keeps_pipeline_order_and_rejects_unknowns():
+    assert parse_stages("resize, exif") == ("exif", "resize")
+    assert parse_stages("off") == ()
+    with pytest.raises(ValueError):
+        parse_stages("exif,sharpen")
@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+"""
+Inference backends for the MLX Vision OCR sidecar.
+
+The scheduler in vision_scheduler.py only talks to this interface, so the
+serving path does not care whether generation runs on mlx-vlm or
+something else. Backends are synchronous: they are always called from the
+scheduler's dedicated inference thread, never from the event loop.
+
+Backends (MLX_BACKEND):
+    mlx   — mlx-vlm on Apple Silicon (default)
+    stub  — deterministic CPU stand-in for load tests on Linux CI.
+            Sleeps MLX_STUB_S_PER_MPIXEL per megapixel (prefill) plus
+            MLX_STUB_S_PER_TOKEN per decoded token — max_tokens, or fewer
+            when the JSON stop criterion fires — and returns canned
+            receipt JSON chosen by the image hash.
+
+Prompt prefixes: the chat-template string for each distinct prompt is
+built once and kept in a small LRU on the backend; the sidecar pins
+EXTRACT_SYSTEM_PROMPT at load time (MLX_PREFIX_CACHE=0 turns this off and
+templates every request, as before the cache existed). Only the string is
+reused, not the model's KV cache. mlx-vlm prefills image and prompt in one
+pass, and Qwen-VL's multimodal rotary positions are computed over the
+whole sequence, image grid included, so a KV prefix prefilled once can't
+be continued with a new image. Time-to-first-token is recorded separately
+for requests whose prefix was cached and for those that built it, so
+/health shows what the cache is worth.
+
+Loading: heavy imports (transformers, mlx, mlx_vlm) happen inside load(),
+never at module import, and each step is timed into `load_report` for the
+sidecar's startup breakdown. `import_modules` names what load() imports,
+so the import-time profile can cover it. MlxBackend reuses a pickled
+processor (vision_startup.ProcessorSnapshot) when one is configured.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from vision_json import JsonStopCriterion
+from vision_startup import ProcessorSnapshot, StartupReport
+
+logger = logging.getLogger("mlx-sidecar")
+
+_TTFT_SAMPLES = 512
+
+
+@dataclass
+class GenerationRequest:
+    image: Any  # decoded PIL.Image.Image
+    prompt: str
+    max_tokens: int
+    # Only set for backends with requires_image_path = True.
+    image_path: str | None = None
+    # Halt decoding as soon as the top-level JSON object closes.
+    stop_on_json_close: bool = True
+
+
+@dataclass
+class PromptPrefix:
+    """A prompt's chat-template output — it doesn't depend on the image, so it is built once."""
+
+    prompt: str
+    formatted: str        # prompt after the chat template
+    build_s: float = 0.0
+    pinned: bool = False  # never evicted (the default extraction prompt)
+
+
+def _ttft_summary(samples: deque[float]) -> dict:
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float | None:
+        if not ordered:
+            return None
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 1)
+
+    return {"p50": pct(50), "p95": pct(95), "samples": len(ordered)}
+
+
+class InferenceBackend:
+    """Base class — subclasses implement load() and generate(); batching is optional."""
+
+    name = "base"
+    # True if generate() can only read images from disk. The sidecar then
+    # writes each upload to a RAM-backed temp file and sets image_path.
+    requires_image_path = False
+    # Modules load() imports — profiled by `mlx_vision_server.py --report-startup`.
+    import_modules: tuple[str, ...] = ()
+
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.load_report = StartupReport()
+        self.processor_snapshot: ProcessorSnapshot | None = None
+        self.prefix_cache_enabled = True
+        self.prefix_cache_size = 8
+        self._prefixes: OrderedDict[str, PromptPrefix] = OrderedDict()
+        self.prefix_hits = 0
+        self.prefix_misses = 0
+        # Keyed by whether the request's prefix came from the cache.
+        self._ttft: dict[bool, deque[float]] = {
+            True: deque(maxlen=_TTFT_SAMPLES),
+            False: deque(maxlen=_TTFT_SAMPLES),
+        }
+
+    def load(self) -> None:
+        raise NotImplementedError
+
+    def memory_stats(self) -> dict:
+        """{active_gb, peak_gb, cache_gb} — None where the backend can't tell."""
+        return {"active_gb": None, "peak_gb": None, "cache_gb": None}
+
+    def clear_cache(self) -> None:
+        """Release allocator caches. No-op unless the backend keeps one."""
+
+    def reset_peak_memory(self) -> None:
+        """Start a new peak_gb measurement window. No-op if the backend can't."""
+
+    # ── Prompt prefix cache ────────────────────────────────────────
+
+    def _build_prefix(self, prompt: str) -> PromptPrefix:
+        """Backend-specific: apply the chat template to a prompt."""
+        return PromptPrefix(prompt, prompt)
+
+    def pin_prompt(self, prompt: str) -> PromptPrefix:
+        """Build a prompt's prefix now (at startup) and keep it for good."""
+        t0 = time.perf_counter()
+        prefix = self._build_prefix(prompt)
+        prefix.build_s = time.perf_counter() - t0
+        prefix.pinned = True
+        self._prefixes[prompt] = prefix
+        logger.info(f"Prompt prefix pinned — built in {prefix.build_s * 1000:.1f}ms")
+        return prefix
+
+    def prefix(self, prompt: str) -> tuple[PromptPrefix, bool]:
+        """(prefix, was_cached). Called on the inference thread only."""
+        cached = self._prefixes.get(prompt) if self.prefix_cache_enabled else None
+        if cached is not None:
+            self._prefixes.move_to_end(prompt)
+            self.prefix_hits += 1
+            return cached, True
+
+        self.prefix_misses += 1
+        t0 = time.perf_counter()
+        prefix = self._build_prefix(prompt)
+        prefix.build_s = time.perf_counter() - t0
+        if self.prefix_cache_enabled:
+            self._prefixes[prompt] = prefix
+            unpinned = [k for k, v in self._prefixes.items() if not v.pinned]
+            for key in unpinned[:max(0, len(unpinned) - self.prefix_cache_size)]:
+                del self._prefixes[key]
+        return prefix, False
+
+    def _record_ttft(self, seconds: float, prefix_cached: bool) -> None:
+        self._ttft[prefix_cached].append(seconds)
+
+    def prefix_stats(self) -> dict:
+        return {
+            "enabled": self.prefix_cache_enabled,
+            "entries": len(self._prefixes),
+            "max_entries": self.prefix_cache_size,
+            "pinned": sum(1 for p in self._prefixes.values() if p.pinned),
+            "hits": self.prefix_hits,
+            "misses": self.prefix_misses,
+        }
+
+    def ttft_stats(self) -> dict:
+        return {
+            "all": _ttft_summary(deque([*self._ttft[True], *self._ttft[False]])),
+            "prefix_cached": _ttft_summary(self._ttft[True]),
+            "prefix_built": _ttft_summary(self._ttft[False]),
+        }
+
+    def generate(self, request: GenerationRequest) -> dict:
+        """
+        Returns {text, generation_tokens, generation_time_s, tokens_per_second,
+        peak_memory_gb, stopped_early, tokens_unreserved, ttft_s, prefix_cached}.
+
+        tokens_unreserved is the part of max_tokens left unused when the
+        JSON stop fired. It is an upper bound on the steps the stop saved,
+        not the saving itself: without the stop, decoding usually ends at
+        EOS a few tokens after the closing brace.
+        """
+        raise NotImplementedError
+
+    def generate_batch(self, requests: list[GenerationRequest]) -> list[dict]:
+        """One result per request, in order. Default: sequential fallback.
+
+        A backend that can't count tokens per request adds
+        generation_tokens_estimated=True to each result.
+        """
+        return [self.generate(r) for r in requests]
+
+    def stream(self, request: GenerationRequest, on_text: Callable[[str], None]) -> dict:
+        """Like generate(), calling on_text with each text segment as it is decoded."""
+        result = self.generate(request)
+        on_text(result["text"])
+        return result
+
+
+class MlxBackend(InferenceBackend):
+    """mlx-vlm on Apple Silicon (Metal)."""
+
+    name = "mlx"
+    import_modules = ("patch_transformers", "mlx_vlm")
+
+    def __init__(self, model_id: str):
+        super().__init__(model_id)
+        self.model = None
+        self.processor = None
+
+    def load(self) -> None:
+        phase = self.load_report.phase
+        with phase("import_transformers"):
+            # patch_transformers MUST be imported before mlx_vlm.
+            import patch_transformers  # noqa: F401
+        with phase("import_mlx_vlm"):
+            from mlx_vlm.utils import get_model_path, load_model
+
+        # mlx_vlm.load(), split so the processor half can come from a snapshot.
+        with phase("resolve"):
+            model_path = get_model_path(self.model_id)
+        with phase("weights"):
+            self.model = load_model(model_path)
+        with phase("processor"):
+            self.processor = self._load_processor(model_path)
+
+    def _load_processor(self, model_path):
+        from mlx_vlm.utils import load_image_processor, load_processor
+
+        snapshot = self.processor_snapshot
+        processor = snapshot.load(model_path) if snapshot else None
+        if processor is not None:
+            logger.info("Processor restored from snapshot")
+            return processor
+        image_processor = load_image_processor(model_path)
+        eos_token_id = getattr(self.model.config, "eos_token_id", None)
+        processor = load_processor(model_path, True, eos_token_ids=eos_token_id)
+        if image_processor is not None:
+            processor.image_processor = image_processor
+        if snapshot:
+            snapshot.save(model_path, processor)
+        return processor
+
+    def memory_stats(self) -> dict:
+        import mlx.core as mx
+
+        # mlx ≥ 0.26 exposes these at top level; older releases under mx.metal.
+        ns = mx if hasattr(mx, "get_active_memory") else mx.metal
+        gb = 1024 ** 3
+        return {
+            "active_gb": round(ns.get_active_memory() / gb, 2),
+            "peak_gb": round(ns.get_peak_memory() / gb, 2),
+            "cache_gb": round(ns.get_cache_memory() / gb, 2),
+        }
+
+    def clear_cache(self) -> None:
+        import mlx.core as mx
+
+        (mx if hasattr(mx, "clear_cache") else mx.metal).clear_cache()
+
+    def reset_peak_memory(self) -> None:
+        import mlx.core as mx
+
+        (mx if hasattr(mx, "reset_peak_memory") else mx.metal).reset_peak_memory()
+
+    def _build_prefix(self, prompt: str) -> PromptPrefix:
+        from mlx_vlm.prompt_utils import apply_chat_template
+
+        return PromptPrefix(prompt, apply_chat_template(self.processor, prompt, num_images=1))
+
+    def _decode(self, request: GenerationRequest, on_text: Callable[[str], None] | None) -> dict:
+        from mlx_vlm import stream_generate
+
+        stop = JsonStopCriterion() if request.stop_on_json_close else None
+        t0 = time.perf_counter()
+        prefix, prefix_cached = self.prefix(request.prompt)
+        segments: list[str] = []
+        last = None
+        ttft = None
+        stopped_early = False
+        for last in stream_generate(
+            self.model,
+            self.processor,
+            prefix.formatted,
+            [request.image_path or request.image],
+            max_tokens=request.max_tokens,
+        ):
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+                self._record_ttft(ttft, prefix_cached)
+            if last.text:
+                text = last.text
+                done = stop is not None and stop.feed(text)
+                if done:
+                    # Anything after the closing brace is fences or chatter.
+                    text = text[:len(text) - stop.overshoot]
+                segments.append(text)
+                if on_text is not None and text:
+                    on_text(text)
+                if done:
+                    stopped_early = last.generation_tokens < request.max_tokens
+                    break
+        gen_time = time.perf_counter() - t0
+
+        tokens = getattr(last, "generation_tokens", None)
+        tps = getattr(last, "generation_tps", 0)
+        peak = getattr(last, "peak_memory", 0)
+        return {
+            "text": "".join(segments),
+            "generation_tokens": tokens,
+            "generation_time_s": round(gen_time, 2),
+            "tokens_per_second": round(tps, 1) if tps else None,
+            "peak_memory_gb": round(peak, 2) if peak else None,
+            "stopped_early": stopped_early,
+            "tokens_unreserved": request.max_tokens - tokens if stopped_early and tokens else 0,
+            "ttft_s": round(ttft, 3) if ttft is not None else None,
+            "prefix_cached": prefix_cached,
+        }
+
+    def generate(self, request: GenerationRequest) -> dict:
+        return self._decode(request, None)
+
+    def stream(self, request: GenerationRequest, on_text: Callable[[str], None]) -> dict:
+        return self._decode(request, on_text)
+
+    def generate_batch(self, requests: list[GenerationRequest]) -> list[dict]:
+        if len(requests) == 1:
+            return [self.generate(requests[0])]
+        try:
+            # Only recent mlx-vlm releases ship a batched generate. It decodes
+            # the whole batch in lock-step, so per-request early stop doesn't apply.
+            from mlx_vlm import batch_generate
+        except ImportError:
+            return super().generate_batch(requests)
+
+        t0 = time.perf_counter()
+        prefixes = [self.prefix(r.prompt) for r in requests]
+        result = batch_generate(
+            self.model,
+            self.processor,
+            images=[r.image_path or r.image for r in requests],
+            prompts=[prefix.formatted for prefix, _ in prefixes],
+            max_tokens=max(r.max_tokens for r in requests),
+            verbose=False,
+        )
+        gen_time = time.perf_counter() - t0
+
+        texts = list(getattr(result, "texts", result))
+        tps = getattr(result, "generation_tps", 0)
+        peak = getattr(result, "peak_memory", 0)
+        # The batch result has no per-request counts: re-tokenize each output.
+        # Close, not exact (no EOS, merges can differ), hence the flag.
+        tokenizer = getattr(self.processor, "tokenizer", self.processor)
+        return [
+            {
+                "text": text,
+                "generation_tokens": len(tokenizer.encode(text)),
+                "generation_tokens_estimated": True,
+                "generation_time_s": round(gen_time, 2),
+                "tokens_per_second": round(tps, 1) if tps else None,
+                "peak_memory_gb": round(peak, 2) if peak else None,
+                "stopped_early": False,
+                "tokens_unreserved": 0,
+                # Lock-step batch decode: no per-request first-token time.
+                "ttft_s": None,
+                "prefix_cached": cached,
+            }
+            for text, (_, cached) in zip(texts, prefixes)
+        ]
+
+
+# ── Stub Backend (deterministic, CPU-only) ─────────────────────────
+
+STUB_S_PER_MPIXEL = float(os.getenv("MLX_STUB_S_PER_MPIXEL", "0.4"))
+STUB_S_PER_TOKEN = float(os.getenv("MLX_STUB_S_PER_TOKEN", "0.002"))
+
+_STUB_RECEIPTS: list[dict] = [
+    {
+        "merchant": "Pingo Doce",
+        "total": 23.47,
+        "currency": "EUR",
+        "date": "2025-03-14",
+        "category": "Supermercado",
+        "items": [
+            {"name": "Leite Meio Gordo 1L", "quantity": 6, "price": 4.74},
+            {"name": "Pão de Forma", "quantity": 1, "price": 1.89},
+            {"name": "Bananas", "quantity": 1, "price": 2.31},
+            {"name": "Azeite Virgem Extra", "quantity": 2, "price": 14.53},
+        ],
+    },
+    {
+        "merchant": "Galp",
+        "total": 61.20,
+        "currency": "EUR",
+        "date": "2025-02-02",
+        "category": "Transportes",
+        "items": [{"name": "Gasóleo", "quantity": 1, "price": 61.20}],
+    },
+    {
+        "merchant": "Café Central",
+        "total": 3.10,
+        "currency": "EUR",
+        "date": None,
+        "category": "Restaurante",
+        "items": [
+            {"name": "Café", "quantity": 2, "price": 1.50},
+            {"name": "Água 0.5L", "quantity": 1, "price": 1.60},
+        ],
+    },
+]
+
+
+class StubBackend(InferenceBackend):
+    """Deterministic stand-in for load-testing the serving path off Apple Silicon."""
+
+    name = "stub"
+
+    def __init__(self, model_id: str):
+        super().__init__(model_id)
+        self._peak_gb = 0.0
+
+    def load(self) -> None:
+        logger.info("Stub backend — no model weights loaded")
+
+    def memory_stats(self) -> dict:
+        return {"active_gb": 0.0, "peak_gb": round(self._peak_gb, 2), "cache_gb": 0.0}
+
+    def reset_peak_memory(self) -> None:
+        self._peak_gb = 0.0
+
+    def _canned_text(self, image) -> str:
+        # Thumbnail fingerprint: deterministic per image, cheap for 12 MP photos.
+        digest = hashlib.sha256(image.resize((8, 8)).tobytes()).digest()
+        receipt = _STUB_RECEIPTS[digest[0] % len(_STUB_RECEIPTS)]
+        # Fenced + trailing chatter, like the real model's output.
+        return f"```json\n{json.dumps(receipt, ensure_ascii=False, indent=2)}\n```\nLet me know if you need anything else."
+
+    def _plan(self, request: GenerationRequest) -> tuple[list[str], int]:
+        """Visible token pieces (~4 chars each) and the number of decode steps."""
+        text = self._canned_text(request.image)
+        pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+        # Like a model that never emits EOS, the stub decodes up to max_tokens
+        # unless the JSON stop criterion fires first.
+        steps = request.max_tokens
+        if request.stop_on_json_close:
+            stop = JsonStopCriterion()
+            for i, piece in enumerate(pieces[:steps]):
+                if stop.feed(piece):
+                    steps = i + 1
+                    pieces[i] = piece[:len(piece) - stop.overshoot]
+                    break
+        return pieces[:steps], steps
+
+    def _result(
+        self,
+        request: GenerationRequest,
+        pieces: list[str],
+        steps: int,
+        gen_time: float,
+        ttft: float,
+        prefix_cached: bool,
+    ) -> dict:
+        decode_s = steps * STUB_S_PER_TOKEN
+        stopped_early = steps < request.max_tokens
+        return {
+            "text": "".join(pieces),
+            "generation_tokens": steps,
+            "generation_time_s": round(gen_time, 2),
+            "tokens_per_second": round(steps / decode_s, 1) if decode_s else None,
+            "peak_memory_gb": round(self._peak_gb, 2),
+            "stopped_early": stopped_early,
+            "tokens_unreserved": request.max_tokens - steps if stopped_early else 0,
+            "ttft_s": round(ttft, 3),
+            "prefix_cached": prefix_cached,
+        }
+
+    def _megapixels(self, request: GenerationRequest) -> float:
+        return request.image.width * request.image.height / 1_000_000
+
+    def generate(self, request: GenerationRequest) -> dict:
+        return self.generate_batch([request])[0]
+
+    def generate_batch(self, requests: list[GenerationRequest]) -> list[dict]:
+        t0 = time.perf_counter()
+        cached = [self.prefix(r.prompt)[1] for r in requests]
+        plans = [self._plan(r) for r in requests]
+        megapixels = [self._megapixels(r) for r in requests]
+        # Prefill is per image; decode steps are shared across the batch.
+        prefill_s = sum(megapixels) * STUB_S_PER_MPIXEL
+        decode_s = max(steps for _, steps in plans) * STUB_S_PER_TOKEN
+        time.sleep(prefill_s + decode_s)
+
+        ttft = time.perf_counter() - t0 - decode_s + STUB_S_PER_TOKEN
+        for prefix_cached in cached:
+            self._record_ttft(ttft, prefix_cached)
+        self._peak_gb = max(self._peak_gb, 0.5 + 0.25 * sum(megapixels))
+        return [
+            self._result(r, pieces, steps, prefill_s + decode_s, ttft, prefix_cached)
+            for r, (pieces, steps), prefix_cached in zip(requests, plans, cached)
+        ]
+
+    def stream(self, request: GenerationRequest, on_text: Callable[[str], None]) -> dict:
+        t0 = time.perf_counter()
+        _, prefix_cached = self.prefix(request.prompt)
+        pieces, steps = self._plan(request)
+        megapixels = self._megapixels(request)
+        time.sleep(megapixels * STUB_S_PER_MPIXEL)
+        ttft = 0.0
+        for step in range(steps):
+            time.sleep(STUB_S_PER_TOKEN)
+            if step == 0:
+                ttft = time.perf_counter() - t0
+                self._record_ttft(ttft, prefix_cached)
+            if step < len(pieces):
+                on_text(pieces[step])
+
+        self._peak_gb = max(self._peak_gb, 0.5 + 0.25 * megapixels)
+        return self._result(request, pieces, steps, time.perf_counter() - t0, ttft, prefix_cached)
+
+
+BACKENDS: dict[str, type[InferenceBackend]] = {
+    "mlx": MlxBackend,
+    "stub": StubBackend,
+}
+
+
+def create_backend(name: str, model_id: str) -> InferenceBackend:
+    try:
+        return BACKENDS[name](model_id)
+    except KeyError:
+        raise ValueError(f"Unknown MLX_BACKEND '{name}' (expected one of: {', '.join(BACKENDS)})") from None
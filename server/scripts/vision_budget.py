@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Per-request max_tokens budgets for the MLX Vision OCR sidecar.
+
+Callers send one ceiling for every receipt (the TS server sends 1024).
+A coffee receipt needs ~120 tokens of JSON, while a 60-line hypermarket
+receipt needs 900+. The JSON stop criterion already ends a single decode
+when the object closes, so there a budget can only truncate and force a
+retry. What it bounds is the step count of a batched decode, which runs
+as long as its longest member allows. The sidecar therefore only uses it
+when MLX_ADAPTIVE_TOKENS is set and the scheduler batches.
+
+TokenBudgetPredictor picks a budget in this order of preference:
+
+    merchant  — the recent output lengths of that merchant. The merchant
+                comes from the caller's hint, or from an earlier receipt
+                with a similar layout (dHash within a loose radius, much
+                wider than the near-duplicate cache's). The sidecar hashes
+                every upload while adaptive budgets are on, whether or not
+                the near-duplicate tier is.
+    image     — a least-squares line tokens ≈ a + b·aspect, fitted online
+                on the preprocessed (cropped) image: receipts grow in
+                length, not width. Until enough samples arrive, a prior
+                stands in.
+
+Both add headroom, and the result is clamped to [floor, ceiling]. A
+budget that still truncates the JSON gets one retry at the ceiling, done
+by the sidecar. Only complete outputs are learned from. Predictions,
+the tokens actually used and retries are all counted in stats().
+
+State is in memory and relearns after a restart.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any
+
+from vision_cache import HammingIndex
+from vision_merchants import normalize
+
+# Deliberately generous prior for tokens ≈ a + b·aspect until the fit has
+# data: a square café slip gets ~510, a 1:2 receipt ~880, and anything
+# from about 1:2.5 up (where 900+ token hypermarket receipts live) 1000+,
+# which is the ceiling for the TS server's 1024.
+PRIOR_INTERCEPT = 80.0
+PRIOR_SLOPE = 300.0
+PRIOR_MARGIN = 1.25
+
+MIN_FIT_SAMPLES = 20
+MERCHANT_SAMPLES = 3         # history needed before a merchant estimate is trusted
+MERCHANT_HISTORY = 32
+MERCHANT_MARGIN = 1.15
+SLACK_TOKENS = 32            # closing braces, fences, a stray extra line
+LAYOUT_DISTANCE = 10         # dHash bits; same store, different receipt
+MAX_LAYOUTS = 4096
+
+
+@dataclass
+class Budget:
+    tokens: int
+    source: str              # merchant | image | prior | ceiling
+    ceiling: int
+    merchant: str | None = None
+    retried: bool = False
+
+    def report(self, used: int | None) -> dict[str, Any]:
+        return {
+            "predicted": self.tokens,
+            "source": self.source,
+            "merchant": self.merchant,
+            "ceiling": self.ceiling,
+            "used": used,
+            "retried": self.retried,
+        }
+
+
+class _LineFit:
+    """Running least squares of y on x, with the residual spread."""
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.sxy = self.syy = 0.0
+
+    def add(self, x: float, y: float) -> None:
+        self.n += 1
+        self.sx += x
+        self.sy += y
+        self.sxx += x * x
+        self.sxy += x * y
+        self.syy += y * y
+
+    def coefficients(self) -> tuple[float, float, float] | None:
+        """(intercept, slope, residual std), or None while underdetermined."""
+        denom = self.n * self.sxx - self.sx ** 2
+        if self.n < 3 or denom <= 1e-9:
+            return None
+        slope = (self.n * self.sxy - self.sx * self.sy) / denom
+        intercept = (self.sy - slope * self.sx) / self.n
+        sse = self.syy - intercept * self.sy - slope * self.sxy
+        return intercept, slope, math.sqrt(max(0.0, sse) / (self.n - 2))
+
+
+class TokenBudgetPredictor:
+    def __init__(self, *, floor: int = 128, min_fit_samples: int = MIN_FIT_SAMPLES):
+        self.floor = floor
+        self.min_fit_samples = min_fit_samples
+        self._fit = _LineFit()
+        self._merchants: dict[str, deque[int]] = {}
+        self._layouts = HammingIndex(LAYOUT_DISTANCE)
+        self._layout_merchant: OrderedDict[str, str] = OrderedDict()  # content hash → merchant
+        self._lock = threading.Lock()
+        self.predictions: dict[str, int] = {}
+        self.retries = 0
+        self.truncations = 0
+        self.observed = 0
+        self.predicted_tokens = 0
+        self.used_tokens = 0
+        self.ceiling_tokens = 0
+
+    # ── Prediction ─────────────────────────────────────────────────
+
+    def _merchant_for(self, hint: str | None, phash: int | None) -> str | None:
+        if hint and normalize(hint) in self._merchants:
+            return normalize(hint)
+        if phash is not None:
+            match = self._layouts.nearest(phash)
+            if match is not None:
+                return self._layout_merchant.get(match[0])
+        return normalize(hint) if hint else None
+
+    def predict(self, *, aspect: float, ceiling: int, merchant_hint: str | None = None, phash: int | None = None) -> Budget:
+        with self._lock:
+            merchant = self._merchant_for(merchant_hint, phash)
+            history = self._merchants.get(merchant) if merchant else None
+            if history is not None and len(history) >= MERCHANT_SAMPLES:
+                # Near the top of what this merchant has needed, not the mean:
+                # a long shop visit must not be truncated.
+                ordered = sorted(history)
+                p90 = ordered[min(len(ordered) - 1, math.ceil(0.9 * len(ordered)) - 1)]
+                estimate, source = p90 * MERCHANT_MARGIN + SLACK_TOKENS, "merchant"
+            else:
+                fit = self._fit.coefficients() if self._fit.n >= self.min_fit_samples else None
+                if fit is not None:
+                    intercept, slope, spread = fit
+                    estimate, source = intercept + slope * aspect + 2 * spread + SLACK_TOKENS, "image"
+                else:
+                    estimate = (PRIOR_INTERCEPT + PRIOR_SLOPE * aspect) * PRIOR_MARGIN + SLACK_TOKENS
+                    source = "prior"
+            tokens = int(min(ceiling, max(self.floor, math.ceil(estimate))))
+            if tokens == ceiling:
+                source = "ceiling"
+            self.predictions[source] = self.predictions.get(source, 0) + 1
+            return Budget(tokens, source, ceiling, merchant)
+
+    # ── Learning ───────────────────────────────────────────────────
+
+    def observe(
+        self,
+        budget: Budget,
+        *,
+        aspect: float,
+        tokens: int | None,
+        complete: bool,
+        merchant: str | None,
+        content_hash: str | None = None,
+        phash: int | None = None,
+    ) -> None:
+        """Record one finished extraction. Only complete outputs teach the model."""
+        with self._lock:
+            self.observed += 1
+            self.predicted_tokens += budget.tokens
+            self.ceiling_tokens += budget.ceiling
+            self.used_tokens += tokens or 0
+            if budget.retried:
+                self.retries += 1
+            if not complete or not tokens:
+                return
+            self._fit.add(aspect, tokens)
+            key = normalize(merchant) if merchant else None
+            if key:
+                self._merchants.setdefault(key, deque(maxlen=MERCHANT_HISTORY)).append(tokens)
+                if phash is not None and content_hash:
+                    self._layouts.add(content_hash, phash)
+                    self._layout_merchant[content_hash] = key
+                    self._layout_merchant.move_to_end(content_hash)
+                    while len(self._layout_merchant) > MAX_LAYOUTS:
+                        old, _ = self._layout_merchant.popitem(last=False)
+                        self._layouts.remove(old)
+
+    def truncated(self) -> None:
+        with self._lock:
+            self.truncations += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            fit = self._fit.coefficients()
+            return {
+                "predictions": dict(self.predictions),
+                "observed": self.observed,
+                "truncations": self.truncations,
+                "retries": self.retries,
+                "mean_predicted": round(self.predicted_tokens / max(1, self.observed), 1),
+                "mean_used": round(self.used_tokens / max(1, self.observed), 1),
+                # Decode steps no longer reserved compared with always asking for the ceiling.
+                "budget_saved_tokens": self.ceiling_tokens - self.predicted_tokens,
+                "image_fit": {
+                    "samples": self._fit.n,
+                    "active": fit is not None and self._fit.n >= self.min_fit_samples,
+                    "intercept": round(fit[0], 1) if fit else None,
+                    "slope": round(fit[1], 1) if fit else None,
+                    "spread": round(fit[2], 1) if fit else None,
+                },
+                "merchants": len(self._merchants),
+                "layouts": len(self._layout_merchant),
+            }
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Persistent extraction cache for the MLX Vision OCR sidecar.
+
+Second tier behind the in-memory LRU in mlx_vision_server.py: one SQLite
+table keyed by the image SHA-256, scoped to the model that produced the
+result (so switching MLX_MODEL never serves another model's output).
+Survives restarts and model reloads; bounded by TTL and a byte budget
+with LRU eviction on last access.
+
+Methods are synchronous and thread-safe — the sidecar calls them through
+asyncio.to_thread so SQLite I/O never runs on the event loop.
+
+Also home to the near-duplicate machinery: a 64-bit dHash per entry and a
+multi-index Hamming index over them, so a re-encoded copy of a receipt
+can reuse an earlier extraction. A 9×8 dHash only sees layout — two
+receipts from one till differ in digits it cannot see — so a dHash match
+is just a candidate. Candidates are tried closest first; one is served
+only if detail_distance() on the two detail prints (grayscale,
+DETAIL_WIDTH px wide, where printed characters still differ) stays under
+DETAIL_TOLERANCE in every tile.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger("mlx-sidecar")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extractions (
+    key         TEXT NOT NULL,
+    model       TEXT NOT NULL,
+    value       TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    created_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    hits        INTEGER NOT NULL DEFAULT 0,
+    phash       INTEGER,
+    detail      BLOB,
+    PRIMARY KEY (key, model)
+);
+CREATE INDEX IF NOT EXISTS idx_extractions_accessed ON extractions (accessed_at);
+"""
+
+# Rows deleted per eviction round when over budget.
+_EVICT_BATCH = 32
+
+_HASH_BITS = 64
+
+# Detail print of the decoded photo, compared in DETAIL_TILE-pixel tiles.
+# On synthetic receipts, re-encoding down to JPEG quality 15 peaked at
+# ~21 and a single changed digit at ~80. A rescaled copy resamples the
+# text and lands in between, so it is refused: a miss is cheap, a wrong
+# total is not.
+DETAIL_WIDTH = 384
+DETAIL_MAX_HEIGHT = 1536
+DETAIL_TILE = 6
+DETAIL_TOLERANCE = 24.0
+
+
+def _to_sqlite_int(value: int) -> int:
+    # SQLite INTEGER is signed 64-bit; dHash values use the full unsigned range.
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _from_sqlite_int(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class DiskCache:
+    """SQLite-backed, byte-budgeted LRU with TTL."""
+
+    def __init__(self, path: str | Path, *, namespace: str, max_bytes: int, ttl_s: float):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(extractions)")}
+        if "phash" not in columns:
+            # Databases created before near-duplicate support.
+            self._conn.execute("ALTER TABLE extractions ADD COLUMN phash INTEGER")
+        if "detail" not in columns:
+            # Rows from before detail prints stay exact-match only (see phashes()).
+            self._conn.execute("ALTER TABLE extractions ADD COLUMN detail BLOB")
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self._bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM extractions"
+        ).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ── Reads ──────────────────────────────────────────────────────
+
+    def get(self, key: str) -> dict | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, size, created_at FROM extractions WHERE key = ? AND model = ?",
+                (key, self.namespace),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, size, created_at = row
+            if now - created_at > self.ttl_s:
+                self._delete(key, size)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE extractions SET accessed_at = ?, hits = hits + 1 WHERE key = ? AND model = ?",
+                (now, key, self.namespace),
+            )
+            self.hits += 1
+        return json.loads(value)
+
+    def detail(self, key: str) -> bytes | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT detail FROM extractions WHERE key = ? AND model = ?", (key, self.namespace)
+            ).fetchone()
+        return row[0] if row else None
+
+    def phashes(self) -> list[tuple[str, int]]:
+        """(key, dHash) of every verifiable unexpired entry — used to rebuild the Hamming index."""
+        cutoff = time.time() - self.ttl_s
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, phash FROM extractions WHERE model = ? AND created_at >= ? "
+                "AND phash IS NOT NULL AND detail IS NOT NULL",
+                (self.namespace, cutoff),
+            ).fetchall()
+        return [(key, _from_sqlite_int(phash)) for key, phash in rows]
+
+    def hottest(self, limit: int) -> list[tuple[str, dict]]:
+        """Most-hit, most-recent unexpired entries — used to warm the memory tier."""
+        cutoff = time.time() - self.ttl_s
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM extractions WHERE model = ? AND created_at >= ? "
+                "ORDER BY hits DESC, accessed_at DESC LIMIT ?",
+                (self.namespace, cutoff, limit),
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    # ── Writes ─────────────────────────────────────────────────────
+
+    def put(self, key: str, value: dict, phash: int | None = None, detail: bytes | None = None) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8")) + len(detail or b"")
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM extractions WHERE key = ? AND model = ?",
+                (key, self.namespace),
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions "
+                "(key, model, value, size, created_at, accessed_at, hits, phash, detail) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)",
+                (key, self.namespace, payload, size, now, now,
+                 _to_sqlite_int(phash) if phash is not None else None, detail),
+            )
+            self._bytes += size - (old[0] if old else 0)
+            self._evict_over_budget()
+
+    def purge_expired(self) -> int:
+        cutoff = time.time() - self.ttl_s
+        with self._lock:
+            freed = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions WHERE created_at < ?",
+                (cutoff,),
+            ).fetchone()
+            self._conn.execute("DELETE FROM extractions WHERE created_at < ?", (cutoff,))
+            self._bytes -= freed[1]
+            self.expired += freed[0]
+        return freed[0]
+
+    def _delete(self, key: str, size: int) -> None:
+        self._conn.execute(
+            "DELETE FROM extractions WHERE key = ? AND model = ?", (key, self.namespace)
+        )
+        self._bytes -= size
+
+    def _evict_over_budget(self) -> None:
+        # Caller holds the lock. Budget is shared by every model in the file.
+        while self._bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, model, size FROM extractions ORDER BY accessed_at LIMIT ?",
+                (_EVICT_BATCH,),
+            ).fetchall()
+            if not rows:
+                break
+            for key, model, size in rows:
+                self._conn.execute(
+                    "DELETE FROM extractions WHERE key = ? AND model = ?", (key, model)
+                )
+                self._bytes -= size
+                self.evictions += 1
+                if self._bytes <= self.max_bytes:
+                    break
+
+    # ── Stats ──────────────────────────────────────────────────────
+
+    def stats(self) -> dict[str, Any]:
+        # entries/bytes cover the whole file, like the byte budget and its
+        # eviction; "model" is the share of the model being served.
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+            model_entries, model_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions WHERE model = ?",
+                (self.namespace,),
+            ).fetchone()
+        return {
+            "path": str(self.path),
+            "entries": entries,
+            "bytes": self._bytes,
+            "model": {"namespace": self.namespace, "entries": model_entries, "bytes": model_bytes},
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / max(1, self.hits + self.misses), 3),
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
+
+
+# ── Perceptual Hash (near-duplicate detection) ─────────────────────
+
+def dhash(image, hash_size: int = 8) -> int:
+    """64-bit difference hash: robust to re-encoding, scaling and mild exposure shifts."""
+    from PIL import Image
+
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    pixels = small.tobytes()  # mode "L": one byte per pixel, row-major
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def detail_print(image) -> bytes:
+    """Grayscale thumbnail at DETAIL_WIDTH, contrast-normalised, zlib-packed with its size."""
+    from PIL import Image, ImageOps
+
+    gray = ImageOps.autocontrast(image.convert("L"), cutoff=1)
+    height = max(1, min(DETAIL_MAX_HEIGHT, round(gray.height * DETAIL_WIDTH / max(1, gray.width))))
+    small = gray.resize((DETAIL_WIDTH, height), Image.Resampling.BOX)
+    return struct.pack(">HH", DETAIL_WIDTH, height) + zlib.compress(small.tobytes(), 6)
+
+
+def _unpack_detail(data: bytes):
+    from PIL import Image
+
+    width, height = struct.unpack(">HH", data[:4])
+    return Image.frombytes("L", (width, height), zlib.decompress(data[4:]))
+
+
+def detail_distance(a: bytes, b: bytes) -> float | None:
+    """Worst per-tile mean absolute difference (0–255); None if the shapes don't line up."""
+    from PIL import Image, ImageChops
+
+    first, second = _unpack_detail(a), _unpack_detail(b)
+    if first.size[0] != second.size[0] or abs(first.size[1] - second.size[1]) > max(2, first.size[1] // 50):
+        return None
+    if second.size != first.size:
+        second = second.resize(first.size, Image.Resampling.BOX)
+    diff = ImageChops.difference(first, second)
+    tiles = diff.resize(
+        (max(1, diff.width // DETAIL_TILE), max(1, diff.height // DETAIL_TILE)), Image.Resampling.BOX
+    )
+    return float(tiles.getextrema()[1])
+
+
+class HammingIndex:
+    """
+    Multi-index hashing over 64-bit hashes.
+
+    Each hash is split into `max_distance + 1` disjoint bit ranges, and
+    every range has its own exact-match table. By pigeonhole, any hash
+    within `max_distance` bits of the query matches it exactly on at
+    least one range. A lookup therefore checks only a few candidates,
+    not the whole cache. Removal is O(chunks), so it stays in sync with
+    cache eviction.
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        chunks = max(1, min(_HASH_BITS, max_distance + 1))
+        step, extra = divmod(_HASH_BITS, chunks)
+        self._ranges: list[tuple[int, int]] = []
+        start = 0
+        for i in range(chunks):
+            width = step + (1 if i < extra else 0)
+            self._ranges.append((start, (1 << width) - 1))
+            start += width
+        self._tables: list[dict[int, set[str]]] = [{} for _ in self._ranges]
+        self._hashes: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, key: str, value: int) -> None:
+        if key in self._hashes:
+            self.remove(key)
+        self._hashes[key] = value
+        for table, (shift, mask) in zip(self._tables, self._ranges):
+            table.setdefault((value >> shift) & mask, set()).add(key)
+
+    def remove(self, key: str) -> None:
+        value = self._hashes.pop(key, None)
+        if value is None:
+            return
+        for table, (shift, mask) in zip(self._tables, self._ranges):
+            bucket = table.get((value >> shift) & mask)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del table[(value >> shift) & mask]
+
+    def candidates(self, value: int) -> list[tuple[str, int]]:
+        """Every indexed key within max_distance bits, as (key, distance), closest first."""
+        seen: set[str] = set()
+        found: list[tuple[str, int]] = []
+        for table, (shift, mask) in zip(self._tables, self._ranges):
+            for key in table.get((value >> shift) & mask, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                distance = (self._hashes[key] ^ value).bit_count()
+                if distance <= self.max_distance:
+                    found.append((key, distance))
+        found.sort(key=lambda match: match[1])
+        return found
+
+    def nearest(self, value: int) -> tuple[str, int] | None:
+        """Closest indexed key within max_distance bits, as (key, distance)."""
+        found = self.candidates(value)
+        return found[0] if found else None
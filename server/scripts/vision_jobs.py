@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Asynchronous extraction jobs for the MLX Vision OCR sidecar.
+
+POST /jobs returns an id at once. The extraction runs in the background
+through the normal pipeline, in the requested scheduler lane, and
+GET /jobs/{id} reports its state. If a callback URL was given, the
+finished job is POSTed there as JSON.
+
+Jobs live in memory only: this sidecar is stateless, and callers that
+need durability (the TS server's BullMQ queues) already have it.
+Finished jobs are kept for a bounded time and count so that pollers can
+collect them.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Any
+
+logger = logging.getLogger("mlx-sidecar")
+
+_CALLBACK_TIMEOUT_S = 10.0
+_CALLBACK_ATTEMPTS = 3
+
+
+@dataclass
+class Job:
+    id: str
+    lane: str
+    content_hash: str
+    callback_url: str | None = None
+    status: str = "queued"  # queued → done | failed
+    created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    result: dict | None = None
+    error: dict | None = None
+    callback: dict | None = None
+    task: asyncio.Task | None = field(default=None, repr=False)
+
+    def view(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "lane": self.lane,
+            "content_hash": self.content_hash[:16],
+            "created_at": round(self.created_at, 3),
+            "finished_at": round(self.finished_at, 3) if self.finished_at else None,
+            "duration_s": round(self.finished_at - self.created_at, 3) if self.finished_at else None,
+            "result": self.result,
+            "error": self.error,
+            "callback": self.callback,
+        }
+
+
+class JobStore:
+    """In-memory job table: pending jobs are capped, finished ones expire by age and count."""
+
+    def __init__(self, *, max_pending: int, retain: int, ttl_s: float):
+        self.max_pending = max_pending
+        self.retain = retain
+        self.ttl_s = ttl_s
+        self._jobs: dict[str, Job] = {}
+        self._finished: OrderedDict[str, float] = OrderedDict()  # id → finished_at
+        self.created: Counter[str] = Counter()
+        self.outcomes: Counter[str] = Counter()
+
+    def pending(self) -> list[Job]:
+        return [job for job in self._jobs.values() if job.status == "queued"]
+
+    def create(self, lane: str, content_hash: str, callback_url: str | None) -> Job | None:
+        """New queued job, or None when too many are already pending."""
+        self._prune()
+        if len(self._jobs) - len(self._finished) >= self.max_pending:
+            return None
+        job = Job(uuid.uuid4().hex, lane, content_hash, callback_url)
+        self._jobs[job.id] = job
+        self.created[lane] += 1
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        self._prune()
+        return self._jobs.get(job_id)
+
+    def finish(self, job: Job, result: dict) -> None:
+        job.status = "done"
+        job.result = result
+        self._settle(job)
+
+    def fail(self, job: Job, status_code: int, detail: Any) -> None:
+        job.status = "failed"
+        job.error = {"status_code": status_code, "detail": detail}
+        self._settle(job)
+
+    def _settle(self, job: Job) -> None:
+        job.finished_at = time.time()
+        job.task = None
+        self._finished[job.id] = job.finished_at
+        self.outcomes[job.status] += 1
+        self._prune()
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.ttl_s
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            if finished_at >= cutoff and len(self._finished) <= self.retain:
+                break
+            self._finished.popitem(last=False)
+            self._jobs.pop(job_id, None)
+
+    def stats(self) -> dict[str, Any]:
+        pending = Counter(job.lane for job in self.pending())
+        return {
+            "pending": dict(pending),
+            "max_pending": self.max_pending,
+            "retained": len(self._finished),
+            "created": dict(self.created),
+            "outcomes": dict(self.outcomes),
+        }
+
+
+def deliver_callback(url: str, payload: dict) -> dict:
+    """POST the finished job as JSON, with a short retry. Blocking — run it in a thread."""
+    # Imported here: urllib.request drags in http.client and email, and
+    # most boots never deliver a callback.
+    import urllib.error
+    import urllib.request
+
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    error = None
+    for attempt in range(1, _CALLBACK_ATTEMPTS + 1):
+        request = urllib.request.Request(
+            url, data=body, method="POST", headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=_CALLBACK_TIMEOUT_S) as response:
+                return {"delivered": True, "status_code": response.status, "attempts": attempt}
+        except urllib.error.HTTPError as e:
+            error = f"HTTP {e.code}"
+            if e.code < 500:
+                break  # The receiver rejected it; retrying won't help.
+        except (urllib.error.URLError, OSError) as e:
+            error = str(getattr(e, "reason", e))
+        if attempt < _CALLBACK_ATTEMPTS:
+            time.sleep(attempt)
+    logger.warning(f"Job callback to {url} failed: {error}")
+    return {"delivered": False, "error": error, "attempts": attempt}
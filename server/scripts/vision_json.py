@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Incremental JSON field parser for streamed receipt extractions.
+
+The model writes one JSON object, token by token, often wrapped in a
+```json fence. IncrementalFieldParser consumes those fragments and
+reports each top-level field the moment its value is complete
+(merchant, total, currency, date, …), and each element of `items` as
+soon as that element closes, long before the whole object is done.
+
+Pure string scanning: no MLX, no FastAPI.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from typing import Any
+
+# Top-level array whose elements are emitted one by one.
+STREAMED_ARRAY = "items"
+
+
+@dataclass
+class FieldEvent:
+    field: str          # top-level key, or STREAMED_ARRAY for an item
+    value: Any
+    index: int | None = None  # position within STREAMED_ARRAY
+
+
+class IncrementalFieldParser:
+    """Feed text fragments; get FieldEvents as values complete."""
+
+    def __init__(self) -> None:
+        self._pos = 0             # absolute offset of the next char to scan
+        self._started = False     # seen the top-level '{'
+        self.complete = False     # top-level object closed
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key: str | None = None
+        self._key_start: int | None = None
+        self._value_start: int | None = None
+        self._awaiting_value = False
+        self._item_start: int | None = None
+        self._item_index = 0
+        self._text = ""
+
+    def feed(self, fragment: str) -> list[FieldEvent]:
+        if self.complete or not fragment:
+            return []
+        self._text += fragment
+        events: list[FieldEvent] = []
+        text = self._text
+        while self._pos < len(text) and not self.complete:
+            self._step(text, self._pos, events)
+            self._pos += 1
+        return events
+
+    @property
+    def consumed(self) -> int:
+        """Characters scanned so far (up to and including the closing brace)."""
+        return self._pos
+
+    def _step(self, text: str, i: int, events: list[FieldEvent]) -> None:
+        ch = text[i]
+
+        if not self._started:
+            if ch == "{":
+                self._started = True
+                self._depth = 1
+                self._expect_key = True
+            return
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if self._key_start is not None:
+                    self._key = json.loads(text[self._key_start:i + 1])
+                    self._key_start = None
+            return
+
+        if self._awaiting_value and not ch.isspace():
+            self._awaiting_value = False
+            self._value_start = i
+
+        if ch == '"':
+            self._in_string = True
+            if self._depth == 1 and self._expect_key:
+                self._key_start = i
+                self._expect_key = False
+        elif ch in "{[":
+            self._depth += 1
+            if ch == "{" and self._depth == 3 and self._key == STREAMED_ARRAY:
+                self._item_start = i
+        elif ch in "}]":
+            self._depth -= 1
+            if ch == "}" and self._depth == 2 and self._item_start is not None:
+                self._emit_item(text[self._item_start:i + 1], events)
+                self._item_start = None
+            elif self._depth == 0:
+                self._emit_value(text, i, events)
+                self.complete = True
+        elif self._depth == 1:
+            if ch == ":":
+                self._awaiting_value = True
+            elif ch == ",":
+                self._emit_value(text, i, events)
+                self._expect_key = True
+
+    def _emit_value(self, text: str, end: int, events: list[FieldEvent]) -> None:
+        key, start = self._key, self._value_start
+        self._key = None
+        self._value_start = None
+        if key is None or start is None or key == STREAMED_ARRAY:
+            return
+        try:
+            value = json.loads(text[start:end])
+        except json.JSONDecodeError:
+            return
+        events.append(FieldEvent(key, value))
+
+    def _emit_item(self, raw: str, events: list[FieldEvent]) -> None:
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        events.append(FieldEvent(STREAMED_ARRAY, value, self._item_index))
+        self._item_index += 1
+
+
+class JsonStopCriterion:
+    """
+    Decoding stop condition: true once the first top-level JSON object closes.
+
+    Tracks only brace depth and string/escape state, so it is cheap enough
+    to run on every decoded token. Braces inside strings don't count.
+    `overshoot` is how many characters of the final fragment came after
+    the closing brace (a token like "}\n`" straddles the boundary).
+    """
+
+    def __init__(self) -> None:
+        self.overshoot = 0
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self.done = False
+
+    def feed(self, fragment: str) -> bool:
+        for i, ch in enumerate(fragment):
+            if self.done:
+                break
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"' and self._started:
+                self._in_string = True
+            elif ch == "{":
+                self._started = True
+                self._depth += 1
+            elif ch == "}" and self._started:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.done = True
+                    self.overshoot = len(fragment) - i - 1
+        return self.done
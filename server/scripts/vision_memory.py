@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Memory-pressure governor for the MLX Vision OCR sidecar.
+
+On a 24 GB machine the model weights, a burst of 12 MP images and the
+MLX buffer cache can push the box into swap. Every generation then
+stalls on paging. The sidecar samples memory every MLX_MEMORY_POLL_S
+seconds, and MemoryGovernor turns each sample into a pressure level:
+
+    normal    — below the high watermark
+    high      — at or above MLX_MEMORY_HIGH_GB
+    critical  — at or above MLX_MEMORY_CRITICAL_GB
+
+Pressure is the larger of two numbers. The first is the process RSS.
+The second is the backend's own figure: active plus cached buffers, or
+its peak since the previous sample, whichever is higher. The peak
+catches a burst that has already finished when the sample is taken.
+On Apple silicon, Metal buffers do not always show up in RSS.
+
+Levels rise at once. They fall only once pressure drops below
+RECOVER_RATIO of the watermark, so one sample near the line cannot
+flap the sidecar between settings. What each level does is the
+sidecar's policy (shrink caches, clear the MLX cache, smaller batches,
+hold the bulk lane). It records each step with record(), and stats()
+exports the counts.
+
+RSS comes from psutil when it is installed, otherwise from
+/proc/self/statm. macOS has no /proc, so without psutil the fallback
+is getrusage's ru_maxrss. That is a lifetime peak, which never falls.
+It is reported but not used as pressure.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any
+
+LEVELS = ("normal", "high", "critical")
+RECOVER_RATIO = 0.9
+
+_GB = 1024 ** 3
+
+
+def physical_memory_gb() -> float | None:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / _GB
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def process_rss() -> tuple[int | None, str]:
+    """(resident bytes, source). source "maxrss" means a lifetime peak."""
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        return psutil.Process().memory_info().rss, "psutil"
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"), "proc"
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None, "unavailable"
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB on Linux.
+    return (maxrss if sys.platform == "darwin" else maxrss * 1024), "maxrss"
+
+
+@dataclass
+class MemoryReading:
+    rss_gb: float | None
+    rss_source: str
+    active_gb: float | None = None
+    cache_gb: float | None = None
+    peak_gb: float | None = None      # backend peak since the previous reading
+
+    @property
+    def backend_gb(self) -> float | None:
+        if self.active_gb is None and self.peak_gb is None:
+            return None
+        resident = (self.active_gb or 0.0) + (self.cache_gb or 0.0)
+        return max(resident, self.peak_gb or 0.0)
+
+    @property
+    def pressure_gb(self) -> float:
+        rss = self.rss_gb if self.rss_source != "maxrss" else None
+        return max((v for v in (rss, self.backend_gb) if v is not None), default=0.0)
+
+    def as_dict(self) -> dict[str, Any]:
+        def gb(value: float | None) -> float | None:
+            return round(value, 2) if value is not None else None
+
+        return {
+            "pressure_gb": gb(self.pressure_gb),
+            "rss_gb": gb(self.rss_gb),
+            "rss_source": self.rss_source,
+            "backend_gb": gb(self.backend_gb),
+            "active_gb": gb(self.active_gb),
+            "cache_gb": gb(self.cache_gb),
+            "peak_gb": gb(self.peak_gb),
+        }
+
+
+def read_memory(backend_stats: dict | None = None) -> MemoryReading:
+    """Process RSS plus a backend memory_stats() dict (peak_gb as the interval peak)."""
+    rss, source = process_rss()
+    stats = backend_stats or {}
+    return MemoryReading(
+        rss_gb=rss / _GB if rss is not None else None,
+        rss_source=source,
+        active_gb=stats.get("active_gb"),
+        cache_gb=stats.get("cache_gb"),
+        peak_gb=stats.get("peak_gb"),
+    )
+
+
+class MemoryGovernor:
+    """Watermark levels with hysteresis, plus counts of what was done about them."""
+
+    def __init__(self, *, high_gb: float, critical_gb: float, recover_ratio: float = RECOVER_RATIO):
+        if not 0 < high_gb < critical_gb:
+            raise ValueError(f"Memory watermarks must satisfy 0 < high ({high_gb}) < critical ({critical_gb})")
+        self.watermarks = {"high": high_gb, "critical": critical_gb}
+        self.recover_ratio = recover_ratio
+        self.level = LEVELS[0]
+        self.last: MemoryReading | None = None
+        self.max_pressure_gb = 0.0
+        self.samples = 0
+        self.entered: Counter[str] = Counter()
+        self.actions: Counter[tuple[str, str]] = Counter()   # (action, level)
+        self._lock = threading.Lock()
+
+    def _target(self, pressure: float) -> str:
+        current = LEVELS.index(self.level)
+        for level in reversed(LEVELS[1:]):
+            if pressure >= self.watermarks[level]:
+                return level
+            # Already at (or above) this level: hold it until well below the line.
+            if current >= LEVELS.index(level) and pressure >= self.watermarks[level] * self.recover_ratio:
+                return level
+        return LEVELS[0]
+
+    def assess(self, reading: MemoryReading) -> tuple[str, str]:
+        """Fold in one sample; returns (previous level, current level)."""
+        with self._lock:
+            previous = self.level
+            self.level = self._target(reading.pressure_gb)
+            self.last = reading
+            self.samples += 1
+            self.max_pressure_gb = max(self.max_pressure_gb, reading.pressure_gb)
+            if self.level != previous:
+                self.entered[self.level] += 1
+            return previous, self.level
+
+    def record(self, action: str, level: str | None = None) -> None:
+        with self._lock:
+            self.actions[(action, level or self.level)] += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            actions: dict[str, dict[str, int]] = {}
+            for (action, level), count in sorted(self.actions.items()):
+                actions.setdefault(action, {})[level] = count
+            return {
+                "level": self.level,
+                "watermarks_gb": {k: round(v, 2) for k, v in self.watermarks.items()},
+                "recover_ratio": self.recover_ratio,
+                "last": self.last.as_dict() if self.last else None,
+                "max_pressure_gb": round(self.max_pressure_gb, 2),
+                "samples": self.samples,
+                "entered": dict(self.entered),
+                "actions": actions,
+            }
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Known-merchant matching for the MLX Vision OCR sidecar fast-path.
+
+MerchantMatcher compiles every merchant key into one Aho-Corasick
+automaton, so a lookup is a single pass over the text no matter how
+large the catalogue is. The old per-key substring scan cost
+O(merchants × text) and had no notion of words: "nos" hit "Santos" and
+"meo" hit "Romeo".
+
+Both keys and text are normalised the same way: case-folded, accents
+stripped (so "cafe" matches "Café"), apostrophes dropped ("McDonald's" →
+"mcdonalds"), and each run of other non-alphanumerics collapsed to one
+space. Matching then ignores the spaces themselves, only where words
+start and end: a match must start on a word boundary and end on one, or
+one "s" short of one. So "mcdonald" matches "McDonalds", "Mc Donald's"
+and "MCDONALDS PORTUGAL" from any catalogue, while "nos" still misses
+"Santos". When several keys match, the longest one wins ("burger king"
+beats "king"), and ties go to the leftmost.
+
+MerchantCatalogue is a compiled matcher plus version metadata. It is
+loaded from a CSV, JSON or SQLite file (MLX_MERCHANTS_PATH), or from the
+built-in FAST_PATH_MERCHANTS table. CatalogueReloader swaps in a freshly
+compiled catalogue when the file changes or on SIGHUP. The swap is a
+single reference assignment, so an in-flight lookup finishes against
+the catalogue it started with. A broken file keeps the previous one.
+
+Pure Python, no dependencies.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import unicodedata
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Generic, Iterable, TypeVar
+
+logger = logging.getLogger("mlx-sidecar")
+
+T = TypeVar("T")
+
+
+# Dropped outright, not treated as a word break: "McDonald's" == "McDonalds".
+_APOSTROPHES = frozenset("'’‘ʼ`")
+
+
+def normalize(text: str) -> str:
+    """Case-fold, strip accents and apostrophes, collapse other punctuation/whitespace runs to one space."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    out: list[str] = []
+    gap = False
+    for ch in decomposed:
+        if unicodedata.combining(ch) or ch in _APOSTROPHES:
+            continue
+        if ch.isalnum():
+            if gap and out:
+                out.append(" ")
+            out.append(ch)
+            gap = False
+        else:
+            gap = True
+    return "".join(out)
+
+
+class MerchantMatcher(Generic[T]):
+    """Aho-Corasick automaton over normalised keys; match() → longest whole-word hit."""
+
+    def __init__(self, entries: Iterable[tuple[str, T]]):
+        # Trie as parallel arrays: node → {char: child}, failure link, and
+        # the pattern ending here (index into self._patterns, or -1).
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[int] = [-1]
+        # Nearest node on the failure chain that ends a pattern.
+        self._dict_link: list[int] = [0]
+        self._patterns: list[tuple[int, T]] = []  # (length, value)
+
+        for key, value in entries:
+            self._insert(_compact(normalize(key))[0], value)
+        self._link()
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def _insert(self, key: str, value: T) -> None:
+        if not key:
+            return
+        node = 0
+        for ch in key:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(-1)
+                self._dict_link.append(0)
+            node = nxt
+        if self._out[node] == -1:
+            self._out[node] = len(self._patterns)
+            self._patterns.append((len(key), value))
+        else:
+            # Duplicate after normalisation — last entry wins.
+            self._patterns[self._out[node]] = (len(key), value)
+
+    def _link(self) -> None:
+        # Breadth-first so every failure target is final before it's used.
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                f = self._fail[child]
+                self._dict_link[child] = f if self._out[f] != -1 else self._dict_link[f]
+
+    def match(self, text: str) -> T | None:
+        """Value of the longest key found as whole words in `text`, else None."""
+        haystack, bounds = _compact(normalize(text))
+        n = len(haystack)
+        best_len = 0
+        best_start = n
+        best: T | None = None
+        node = 0
+        for i, ch in enumerate(haystack):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            end = i + 1
+            # At the end of a word, or one plural/possessive "s" before it.
+            if end not in bounds and not (haystack[end:end + 1] == "s" and end + 1 in bounds):
+                continue
+            hit = node if self._out[node] != -1 else self._dict_link[node]
+            while hit:
+                length, value = self._patterns[self._out[hit]]
+                start = end - length
+                if start in bounds and (length > best_len or (length == best_len and start < best_start)):
+                    best_len, best_start, best = length, start, value
+                hit = self._dict_link[hit]
+        return best
+
+
+def _compact(normalized: str) -> tuple[str, set[int]]:
+    """Drop the spaces of a normalised string; also return where its words start and end."""
+    words = normalized.split(" ")
+    bounds = {0}
+    offset = 0
+    for word in words:
+        offset += len(word)
+        bounds.add(offset)
+    return "".join(words), bounds
+
+
+# ── Catalogue (file-backed, hot-reloadable) ────────────────────────
+# Every format yields rows of key, merchant, category, currency. key is
+# the text to look for and defaults to the merchant name. Extra keys for
+# the same merchant are given as more rows, or as "aliases" ("|"-separated
+# in CSV/SQLite, a list in JSON).
+#
+#   CSV    header: key,merchant,category,currency[,aliases]
+#   JSON   {"pingo doce": {"merchant": …, "category": …, "currency": …}, …}
+#          or [{"merchant": …, "category": …, "aliases": [...]}, …]
+#   SQLite table `merchants` with the CSV columns
+
+_DEFAULT_CURRENCY = "EUR"
+
+
+def _rows_csv(path: Path) -> list[dict]:
+    with path.open(newline="", encoding="utf-8-sig") as f:
+        return list(csv.DictReader(f))
+
+
+def _rows_json(path: Path) -> list[dict]:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if isinstance(data, dict):
+        bad = next((key for key, meta in data.items() if not isinstance(meta, dict)), None)
+        if bad is not None:
+            raise ValueError(f"JSON catalogue entry '{bad}' must be an object")
+        return [{"key": key, **meta} for key, meta in data.items()]
+    if isinstance(data, list):
+        return data
+    raise ValueError("JSON catalogue must be an object or a list")
+
+
+def _rows_sqlite(path: Path) -> list[dict]:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        conn.row_factory = sqlite3.Row
+        return [dict(row) for row in conn.execute("SELECT * FROM merchants")]
+    finally:
+        conn.close()
+
+
+_READERS = {
+    ".csv": _rows_csv,
+    ".json": _rows_json,
+    ".sqlite": _rows_sqlite,
+    ".sqlite3": _rows_sqlite,
+    ".db": _rows_sqlite,
+}
+
+
+def _text(value: Any, row: int, name: str) -> str:
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        raise ValueError(f"Catalogue row {row}: '{name}' must be text, not {type(value).__name__}")
+    return value.strip()
+
+
+def _entries(rows: Iterable[dict]) -> list[tuple[str, dict]]:
+    """Rows → (key, meta) pairs. A malformed row rejects the whole file (ValueError)."""
+    entries: list[tuple[str, dict]] = []
+    for n, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            raise ValueError(f"Catalogue row {n} must be an object, not {type(row).__name__}")
+        merchant = _text(row.get("merchant"), n, "merchant")
+        if not merchant:
+            continue
+        meta = {
+            "merchant": merchant,
+            "category": _text(row.get("category"), n, "category") or "Outros",
+            "currency": _text(row.get("currency"), n, "currency") or _DEFAULT_CURRENCY,
+        }
+        aliases = row.get("aliases") or []
+        if isinstance(aliases, str):
+            aliases = aliases.split("|")
+        if not isinstance(aliases, list):
+            raise ValueError(f"Catalogue row {n}: 'aliases' must be a list or a '|'-separated string")
+        for key in [_text(row.get("key"), n, "key") or merchant, *(_text(a, n, "aliases") for a in aliases)]:
+            if key:
+                entries.append((key, meta))
+    return entries
+
+
+@dataclass
+class MerchantCatalogue:
+    matcher: MerchantMatcher[dict]
+    source: str
+    version: str            # content digest — identical files share a version
+    size: int
+    compile_ms: float
+    loaded_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def from_entries(cls, entries: list[tuple[str, dict]], source: str) -> MerchantCatalogue:
+        digest = hashlib.sha256(
+            json.dumps(entries, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:12]
+        t0 = time.perf_counter()
+        matcher = MerchantMatcher(entries)
+        compile_ms = (time.perf_counter() - t0) * 1000
+        return cls(matcher, source, digest, len(matcher), round(compile_ms, 2))
+
+    @classmethod
+    def from_file(cls, path: str | Path) -> MerchantCatalogue:
+        path = Path(path).expanduser()
+        reader = _READERS.get(path.suffix.lower())
+        if reader is None:
+            raise ValueError(f"Unsupported catalogue format '{path.suffix}' (use {', '.join(_READERS)})")
+        entries = _entries(reader(path))
+        if not entries:
+            raise ValueError(f"Catalogue {path} has no merchants")
+        return cls.from_entries(entries, str(path))
+
+    def match(self, text: str) -> dict | None:
+        return self.matcher.match(text)
+
+
+class CatalogueReloader:
+    """Holds the live catalogue; polls the file's mtime and reloads on change or request."""
+
+    def __init__(self, path: str, builtin: dict[str, dict], poll_s: float):
+        self.path = Path(path).expanduser() if path else None
+        self.poll_s = poll_s
+        self.reloads = 0
+        self.failures = 0
+        self.last_error: str | None = None
+        self._stamp: tuple[int, int] | None = None
+        self._lock = asyncio.Lock()
+        self.current = MerchantCatalogue.from_entries(list(builtin.items()), "builtin")
+        if self.path is not None:
+            # Startup: a bad file is a warning, not a crash — fall back to built-ins.
+            self._load_sync()
+
+    def _file_stamp(self) -> tuple[int, int] | None:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _load_sync(self) -> bool:
+        stamp = self._file_stamp()
+        try:
+            catalogue = MerchantCatalogue.from_file(self.path)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, csv.Error, sqlite3.Error) as e:
+            self.failures += 1
+            self.last_error = str(e)
+            self._stamp = stamp  # Don't retry the same broken file every poll.
+            logger.warning(f"Merchant catalogue {self.path} not loaded: {e}")
+            return False
+        self._stamp = stamp
+        self.last_error = None
+        previous, self.current = self.current, catalogue
+        logger.info(
+            f"Merchant catalogue {catalogue.version} — {catalogue.size} keys from "
+            f"{catalogue.source} in {catalogue.compile_ms:.1f}ms (was {previous.version})"
+        )
+        return True
+
+    async def reload(self, reason: str) -> bool:
+        """Compile off the event loop, then swap. Concurrent triggers collapse."""
+        if self.path is None:
+            return False
+        async with self._lock:
+            logger.info(f"Reloading merchant catalogue ({reason})")
+            ok = await asyncio.to_thread(self._load_sync)
+            if ok:
+                self.reloads += 1
+            return ok
+
+    async def watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_s)
+            try:
+                stamp = await asyncio.to_thread(self._file_stamp)
+                if stamp is not None and stamp != self._stamp:
+                    await self.reload("file changed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # One bad poll must not end polling.
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.warning(f"Merchant catalogue poll failed: {self.last_error}")
+
+    def stats(self) -> dict[str, Any]:
+        catalogue = self.current
+        return {
+            "source": catalogue.source,
+            "version": catalogue.version,
+            "size": catalogue.size,
+            "compile_ms": catalogue.compile_ms,
+            "loaded_at": round(catalogue.loaded_at, 3),
+            "reloads": self.reloads,
+            "reload_failures": self.failures,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+PDF invoices for the MLX Vision OCR sidecar.
+
+Utility bills (EDP, MEO, Vodafone) arrive as PDFs. PdfDocument opens one
+with pypdfium2 and rasterises pages only when asked, so a 12-page bill
+whose total sits on page 1 renders one page, not twelve. The DPI is
+chosen per page from its size: just enough pixels for the preprocessing
+budget (MLX_MAX_PIXELS), clamped to a legible range. Anything sharper
+would be resized away before generation anyway.
+
+Rendered pages are kept in PageCache, keyed by (document hash, page,
+dpi), so a retried upload doesn't re-render.
+
+pypdfium2 is optional (`pip install pypdfium2`); without it, PDFs are
+rejected with a clear error and images work as before. PDFium is not
+thread-safe, so every call into it holds one module-level lock.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from collections import OrderedDict
+from typing import Any
+
+PDF_MAGIC = b"%PDF-"
+
+# Legible floor (small print on invoices) and a cap on render cost.
+MIN_DPI = 100
+MAX_DPI = 300
+
+_PDFIUM_LOCK = threading.Lock()
+
+
+class PdfUnavailableError(RuntimeError):
+    pass
+
+
+def is_pdf(data: bytes) -> bool:
+    # The header may follow a few bytes of junk; PDFium tolerates up to 1 KB.
+    return PDF_MAGIC in data[:1024]
+
+
+def choose_dpi(width_pt: float, height_pt: float, max_pixels: int) -> int:
+    """DPI whose render fits max_pixels — 72 pt per inch — clamped to [MIN_DPI, MAX_DPI]."""
+    area_in2 = max(1e-6, (width_pt / 72) * (height_pt / 72))
+    dpi = math.sqrt(max_pixels / area_in2)
+    return int(min(MAX_DPI, max(MIN_DPI, dpi)))
+
+
+class PdfDocument:
+    """Lazily rendered PDF. Use as a context manager; page images are RGB PIL images."""
+
+    def __init__(self, data: bytes, password: str | None = None):
+        try:
+            import pypdfium2 as pdfium
+        except ImportError:
+            raise PdfUnavailableError("PDF support needs pypdfium2 (pip install pypdfium2)") from None
+        with _PDFIUM_LOCK:
+            self._pdf = pdfium.PdfDocument(data, password=password)
+            self.page_count = len(self._pdf)
+
+    def __enter__(self) -> PdfDocument:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with _PDFIUM_LOCK:
+            self._pdf.close()
+
+    def page_size(self, index: int) -> tuple[float, float]:
+        """(width, height) in PDF points."""
+        with _PDFIUM_LOCK:
+            page = self._pdf[index]
+            try:
+                return page.get_size()
+            finally:
+                page.close()
+
+    def render(self, index: int, dpi: int) -> Any:
+        with _PDFIUM_LOCK:
+            page = self._pdf[index]
+            try:
+                bitmap = page.render(scale=dpi / 72, may_draw_forms=True)
+                image = bitmap.to_pil()
+            finally:
+                page.close()
+        return image if image.mode == "RGB" else image.convert("RGB")
+
+
+class PageCache:
+    """LRU of rendered pages keyed by (document hash, page, dpi), bounded by pixel bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._pages: OrderedDict[tuple[str, int, int], Any] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(image) -> int:
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, key: tuple[str, int, int]) -> Any | None:
+        with self._lock:
+            image = self._pages.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key: tuple[str, int, int], image) -> None:
+        size = self._size(image)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self._bytes -= self._size(old)
+            self._pages[key] = image
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self._bytes -= self._size(evicted)
+
+    def clear(self) -> int:
+        """Drop every page; returns the bytes released."""
+        with self._lock:
+            released = self._bytes
+            self._pages.clear()
+            self._bytes = 0
+            return released
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pages": len(self._pages),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
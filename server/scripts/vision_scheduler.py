@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Dynamic micro-batching scheduler for the MLX Vision OCR sidecar.
+
+Concurrent /extract calls land in bounded priority lanes. A single
+consumer collects them into batches — up to `max_batch_size` requests,
+waiting at most `max_wait_ms` after the first arrival — and runs each
+batch as one backend.generate_batch() call on a dedicated inference
+thread, so the event loop never blocks on the model. Streaming requests
+(on_text set) share the lanes and thread but are decoded individually
+through backend.stream().
+
+Lanes (LANES, highest priority first):
+    interactive — a user waiting on a photo (/extract, /extract/stream)
+    bulk        — backfills and batch imports (/extract/batch, /jobs)
+A batch only ever holds one lane's jobs, and a lower lane is served only
+when every higher lane is empty. If interactive work arrives while a
+bulk batch is still being collected, the collected bulk jobs go back to
+the front of their lane (preempted) and the interactive job goes first.
+Jobs being collected still count against their lane's bound, so a
+preempted batch always fits back. Work already running on the inference
+thread is never interrupted.
+
+A queued job can be promoted to a higher lane by the key it was
+submitted with (promote), e.g. when an interactive caller starts waiting
+on the same generation as a bulk one. It moves only if that lane has
+room.
+
+A lane can be held (hold/release): its jobs stay queued but are not
+served until it is released. The sidecar holds the bulk lane under
+memory pressure (vision_memory.py).
+
+No MLX imports here: the scheduler runs unchanged against any
+InferenceBackend, including stubs on Linux.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from vision_backends import GenerationRequest, InferenceBackend
+
+LANES = ("interactive", "bulk")
+
+# Sliding window used for throughput and latency percentiles.
+_WINDOW_S = 60.0
+_LATENCY_SAMPLES = 1024
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("Inference queue full")
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Job:
+    request: GenerationRequest
+    future: asyncio.Future
+    enqueued_at: float
+    on_text: Callable[[str], None] | None = None
+    lane: str = LANES[0]
+    key: str | None = None
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float | None:
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+
+class BatchScheduler:
+    """Bounded queue → batch collector → single inference thread."""
+
+    def __init__(
+        self,
+        backend: InferenceBackend,
+        *,
+        max_batch_size: int = 4,
+        max_wait_ms: float = 15.0,
+        queue_depth: int = 8,
+        bulk_queue_depth: int = 64,
+    ):
+        self.backend = backend
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000
+        self.lane_depths = {"interactive": queue_depth, "bulk": bulk_queue_depth}
+        self.queue_depth = sum(self.lane_depths.values())
+        self._lanes: dict[str, deque[_Job]] = {lane: deque() for lane in LANES}
+        self._collecting: list[_Job] = []  # Taken from a lane, batch not yet dispatched.
+        self._running: list[_Job] = []     # Batch on the inference thread.
+        self._stopped = False
+        self.held: set[str] = set()
+        self._arrival = asyncio.Event()
+        self._space = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mlx-inference")
+        self._task: asyncio.Task | None = None
+        self._busy = False
+        self._avg_batch_s = 0.0
+        self._started_at = time.monotonic()
+
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.preemptions = 0
+        self.promotions = 0
+        self.lane_completed: Counter[str] = Counter()
+        self.lane_rejected: Counter[str] = Counter()
+        self._lane_latencies: dict[str, deque[float]] = {
+            lane: deque(maxlen=_LATENCY_SAMPLES) for lane in LANES
+        }
+        self.batches = 0
+        self.batch_sizes: Counter[int] = Counter()
+        self._latencies: deque[float] = deque(maxlen=_LATENCY_SAMPLES)
+        self._finished_at: deque[float] = deque()
+
+    # ── Lifecycle ──────────────────────────────────────────────────
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="mlx-batch-scheduler")
+
+    async def stop(self) -> None:
+        """Fail every queued, collecting and running job, then wait for the inference thread."""
+        self._stopped = True
+        self._space.set()  # submit(wait=True) callers fail instead of waiting forever.
+        pending = [*self._collecting, *self._running]
+        self._collecting = []
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for lane in self._lanes.values():
+            pending.extend(lane)
+            lane.clear()
+        for job in pending:
+            if not job.future.done():
+                job.future.set_exception(RuntimeError("Sidecar shutting down"))
+        # A running batch can't be interrupted; wait for it off the event
+        # loop so the failed callers above are answered meanwhile.
+        await asyncio.to_thread(self._executor.shutdown)
+
+    # ── Submission ─────────────────────────────────────────────────
+
+    def _check_lane(self, lane: str) -> None:
+        if lane not in self._lanes:
+            raise ValueError(f"Unknown lane '{lane}' (expected one of: {', '.join(LANES)})")
+
+    def _full(self, lane: str) -> bool:
+        return self.depth(lane) >= self.lane_depths[lane]
+
+    def _push(self, job: _Job) -> None:
+        if self._stopped:
+            raise RuntimeError("Sidecar shutting down")
+        self._lanes[job.lane].append(job)
+        self._arrival.set()
+
+    def enqueue(
+        self,
+        request: GenerationRequest,
+        on_text: Callable[[str], None] | None = None,
+        lane: str = LANES[0],
+        key: str | None = None,
+    ) -> asyncio.Future:
+        """
+        Queue a request without waiting; raises QueueFullError immediately.
+
+        The future resolves to (backend result, scheduling info). on_text,
+        if given, is called from the inference thread with each decoded
+        text segment — wrap it with loop.call_soon_threadsafe. key names
+        the job for promote().
+        """
+        self._check_lane(lane)
+        if self._full(lane):
+            self.rejected += 1
+            self.lane_rejected[lane] += 1
+            raise QueueFullError(self.retry_after(lane))
+        job = _Job(request, asyncio.get_running_loop().create_future(), time.perf_counter(), on_text, lane, key)
+        self._push(job)
+        return job.future
+
+    async def submit(
+        self,
+        request: GenerationRequest,
+        *,
+        wait: bool = False,
+        lane: str = LANES[0],
+        key: str | None = None,
+    ) -> tuple[dict, dict]:
+        """
+        Queue a request; returns (backend result, scheduling info).
+
+        wait=True (bulk callers) waits for a free slot in the lane instead
+        of raising QueueFullError.
+        """
+        if not wait:
+            return await self.enqueue(request, lane=lane, key=key)
+        self._check_lane(lane)
+        while self._full(lane) and not self._stopped:
+            self._space.clear()
+            await self._space.wait()
+        job = _Job(request, asyncio.get_running_loop().create_future(), time.perf_counter(), lane=lane, key=key)
+        self._push(job)
+        return await job.future
+
+    def retry_after(self, lane: str = LANES[0]) -> int:
+        """Seconds until the backlog ahead of a new job in `lane` should have drained."""
+        ahead = 0
+        for name in LANES:
+            ahead += self.depth(name)
+            if name == lane:
+                break
+        pending_batches = math.ceil(ahead / self.max_batch_size) + (1 if self._busy else 0)
+        return max(1, math.ceil(pending_batches * (self._avg_batch_s or 1.0)))
+
+    def promote(self, key: str, lane: str) -> int:
+        """Move jobs submitted with `key` from lower lanes up to `lane`; returns how many moved.
+
+        Queued and collecting jobs move; a running batch can't. Jobs stay
+        put when `lane` is full.
+        """
+        self._check_lane(lane)
+        moved = 0
+        for lower in LANES[LANES.index(lane) + 1:]:
+            for source in (self._lanes[lower], self._collecting):
+                for job in [j for j in source if j.key == key and j.lane == lower]:
+                    if self._full(lane):
+                        break
+                    # By identity: _Job equality would compare the images.
+                    del source[next(i for i, j in enumerate(source) if j is job)]
+                    job.lane = lane
+                    self._push(job)
+                    moved += 1
+        if moved:
+            self.promotions += moved
+            self._space.set()
+        return moved
+
+    def hold(self, lane: str) -> None:
+        """Stop serving `lane`; its queued jobs wait until release()."""
+        self._check_lane(lane)
+        self.held.add(lane)
+
+    def release(self, lane: str) -> None:
+        self.held.discard(lane)
+        self._arrival.set()  # Wake the collector for jobs that queued meanwhile.
+
+    def call(self, fn: Callable[[], Any]) -> asyncio.Future:
+        """Run fn on the inference thread, between batches (e.g. backend.clear_cache)."""
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn)
+
+    def depth(self, lane: str | None = None) -> int:
+        """Queued jobs, counting those being collected into the next batch."""
+        if lane is not None:
+            return len(self._lanes[lane]) + sum(1 for job in self._collecting if job.lane == lane)
+        return sum(len(jobs) for jobs in self._lanes.values()) + len(self._collecting)
+
+    # ── Consumer ───────────────────────────────────────────────────
+
+    def _top_lane(self) -> str | None:
+        return next((lane for lane in LANES if self._lanes[lane] and lane not in self.held), None)
+
+    def _outranked(self, lane: str) -> bool:
+        """True if any lane above `lane` has work waiting."""
+        return any(self._lanes[higher] for higher in LANES[:LANES.index(lane)])
+
+    def _take(self, lane: str) -> None:
+        # The slot stays taken until the batch is dispatched (see _dispatch).
+        self._collecting.append(self._lanes[lane].popleft())
+
+    def _requeue(self, lane: str) -> None:
+        """Hand the batch being collected back to the front of its lane."""
+        self._lanes[lane].extendleft(reversed(self._collecting))
+        self.preemptions += len(self._collecting)
+        self._collecting = []
+
+    def _dispatch(self) -> list[_Job]:
+        batch, self._collecting = self._collecting, []
+        self._space.set()
+        return batch
+
+    async def _collect(self) -> list[_Job]:
+        """Block for the first job, then gather same-lane jobs until full or the window closes."""
+        while True:
+            while (lane := self._top_lane()) is None:
+                self._arrival.clear()
+                await self._arrival.wait()
+
+            self._take(lane)
+            deadline = time.perf_counter() + self.max_wait_s
+            preempted = False
+            while len(self._collecting) < self.max_batch_size:
+                if self._outranked(lane):
+                    # Higher-priority work arrived mid-collection: hand these back.
+                    self._requeue(lane)
+                    preempted = True
+                    break
+                if self._lanes[lane]:
+                    self._take(lane)
+                    continue
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._arrival.clear()
+                try:
+                    await asyncio.wait_for(self._arrival.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if preempted:
+                continue
+            if self._outranked(lane):
+                # Window closed just as interactive work landed — it still goes first.
+                self._requeue(lane)
+                continue
+            # Requests whose client went away while queued don't get GPU time.
+            return [job for job in self._dispatch() if not job.future.cancelled()]
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            self._busy = True
+            self._running = batch
+            try:
+                results = await loop.run_in_executor(self._executor, self._execute, batch)
+            except Exception as e:
+                self.failed += len(batch)
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+            else:
+                finished = time.perf_counter()
+                for job, result in zip(batch, results):
+                    self._record(finished - job.enqueued_at, job.lane)
+                    if not job.future.done():
+                        job.future.set_result((result, {
+                            "queue_wait_s": round(started - job.enqueued_at, 3),
+                            "batch_size": len(batch),
+                            "lane": job.lane,
+                        }))
+            finally:
+                elapsed = time.perf_counter() - started
+                self._avg_batch_s = (
+                    elapsed if not self._avg_batch_s
+                    else 0.8 * self._avg_batch_s + 0.2 * elapsed
+                )
+                self.batches += 1
+                self.batch_sizes[len(batch)] += 1
+                self._busy = False
+                self._running = []
+
+    def _execute(self, batch: list[_Job]) -> list[dict]:
+        """Runs on the inference thread: one batched call, then any streams."""
+        plain = [job for job in batch if job.on_text is None]
+        results: dict[int, dict] = {}
+        if plain:
+            batch_results = self.backend.generate_batch([job.request for job in plain])
+            if len(batch_results) != len(plain):
+                raise RuntimeError(
+                    f"Backend returned {len(batch_results)} results for a batch of {len(plain)}"
+                )
+            results.update((id(job), r) for job, r in zip(plain, batch_results))
+        for job in batch:
+            if job.on_text is not None:
+                results[id(job)] = self.backend.stream(job.request, job.on_text)
+        return [results[id(job)] for job in batch]
+
+    # ── Metrics ────────────────────────────────────────────────────
+
+    def _record(self, latency_s: float, lane: str) -> None:
+        now = time.monotonic()
+        self.completed += 1
+        self.lane_completed[lane] += 1
+        self._latencies.append(latency_s)
+        self._lane_latencies[lane].append(latency_s)
+        self._finished_at.append(now)
+        while self._finished_at and now - self._finished_at[0] > _WINDOW_S:
+            self._finished_at.popleft()
+
+    def stats(self) -> dict[str, Any]:
+        now = time.monotonic()
+        while self._finished_at and now - self._finished_at[0] > _WINDOW_S:
+            self._finished_at.popleft()
+        window = min(_WINDOW_S, max(1e-6, now - self._started_at))
+        latencies = sorted(self._latencies)
+
+        def ms(value: float | None) -> float | None:
+            return round(value * 1000, 1) if value is not None else None
+
+        lanes = {}
+        for lane in LANES:
+            lane_latencies = sorted(self._lane_latencies[lane])
+            lanes[lane] = {
+                "depth": self.depth(lane),
+                "max_depth": self.lane_depths[lane],
+                "completed": self.lane_completed[lane],
+                "rejected": self.lane_rejected[lane],
+                "latency_ms": {
+                    "p50": ms(_percentile(lane_latencies, 50)),
+                    "p95": ms(_percentile(lane_latencies, 95)),
+                },
+            }
+
+        return {
+            "depth": self.depth(),
+            "max_depth": self.queue_depth,
+            "busy": self._busy,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "preemptions": self.preemptions,
+            "promotions": self.promotions,
+            "held": sorted(self.held),
+            "lanes": lanes,
+            "batching": {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": round(self.max_wait_s * 1000, 1),
+                "batches": self.batches,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+                "avg_batch_s": round(self._avg_batch_s, 3),
+            },
+            "latency_ms": {
+                "p50": ms(_percentile(latencies, 50)),
+                "p95": ms(_percentile(latencies, 95)),
+                "p99": ms(_percentile(latencies, 99)),
+                "samples": len(latencies),
+            },
+            "throughput_rps": round(len(self._finished_at) / window, 3),
+        }
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Cold-start accounting for the MLX Vision OCR sidecar.
+
+A restart costs the sidecar its model, so boot time is downtime. Three
+things here keep it visible and short:
+
+    StartupReport      — wall time per boot phase (imports, weights,
+                         processor, caches…), shown in /health and by
+                         `mlx_vision_server.py --report-startup`
+    importtime_profile — `python -X importtime` for the modules a boot
+                         imports, summarised to the slowest packages
+    ProcessorSnapshot  — the loaded tokenizer + image processor pickled
+                         to disk. Building them goes through
+                         ProcessorMixin._get_arguments_from_pretrained,
+                         which re-resolves every file from the HF cache
+                         on each boot; unpickling skips that.
+
+Snapshots are keyed by model directory (the HF snapshot path carries the
+revision) and by the transformers, tokenizers and mlx-vlm versions, so
+an upgrade or a new revision simply misses and writes a fresh one. Any
+failure to read or write one falls back to the normal load.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import pickle
+import re
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Iterator
+
+logger = logging.getLogger("mlx-sidecar")
+
+# Packages whose versions change what a pickled processor looks like.
+_SNAPSHOT_PACKAGES = ("transformers", "tokenizers", "mlx-vlm")
+
+
+# ── Phase timing ───────────────────────────────────────────────────
+
+class StartupReport:
+    """Ordered (phase, seconds) pairs. Nested phases use dotted names."""
+
+    def __init__(self) -> None:
+        self.phases: list[tuple[str, float]] = []
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def total(self) -> float:
+        # Sub-phases ("load.weights") are already inside their parent.
+        return sum(s for name, s in self.phases if "." not in name)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "total_s": round(self.total(), 3),
+            "phases": {name: round(s, 3) for name, s in self.phases},
+        }
+
+    def format(self) -> str:
+        total = self.total() or 1e-9
+        width = max((len(name) for name, _ in self.phases), default=5) + 2
+        lines = [f"{'phase':<{width}}{'seconds':>10}{'share':>8}"]
+        for name, s in self.phases:
+            indent = "  " * name.count(".")
+            label = indent + name.rsplit(".", 1)[-1]
+            lines.append(f"{label:<{width}}{s:>10.3f}{s / total:>8.1%}")
+        lines.append(f"{'total':<{width}}{self.total():>10.3f}")
+        return "\n".join(lines)
+
+
+# ── -X importtime ──────────────────────────────────────────────────
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def importtime_profile(modules: list[str], *, cwd: str | None = None, top: int = 15) -> dict[str, Any]:
+    """Import `modules` in a fresh interpreter under -X importtime and summarise.
+
+    Returns the total, the slowest imports by cumulative time (their
+    children included) and the heaviest top-level packages by self time.
+    """
+    statement = "; ".join(f"import {m}" for m in modules)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    rows: list[tuple[str, int, int, int]] = []  # (module, self µs, cumulative µs, depth)
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME_LINE.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2))
+
+    by_package: dict[str, int] = {}
+    for module, self_us, _, _ in rows:
+        root = module.split(".", 1)[0]
+        by_package[root] = by_package.get(root, 0) + self_us
+
+    slowest = sorted(rows, key=lambda r: r[2], reverse=True)[:top]
+    packages = sorted(by_package.items(), key=lambda kv: kv[1], reverse=True)[:top]
+    return {
+        "statement": statement,
+        "ok": proc.returncode == 0,
+        "error": proc.stderr.strip().splitlines()[-1] if proc.returncode else None,
+        "modules": len(rows),
+        # Depth-0 rows are exactly what the statement imported, so their sum is the total.
+        "total_s": round(sum(r[2] for r in rows if r[3] == 0) / 1e6, 3),
+        "slowest": [{"module": m, "cumulative_s": round(c / 1e6, 4)} for m, _, c, _ in slowest],
+        "packages": [{"package": p, "self_s": round(us / 1e6, 4)} for p, us in packages],
+    }
+
+
+def format_importtime(profile: dict[str, Any]) -> str:
+    lines = [f"python -X importtime -c '{profile['statement']}'"]
+    if not profile["ok"]:
+        lines.append(f"  failed: {profile['error']}")
+    lines.append(f"  {profile['modules']} modules, {profile['total_s']:.3f}s")
+    lines.append("  slowest imports (cumulative):")
+    lines += [f"    {r['cumulative_s']:>8.3f}s  {r['module']}" for r in profile["slowest"]]
+    lines.append("  heaviest packages (self):")
+    lines += [f"    {r['self_s']:>8.3f}s  {r['package']}" for r in profile["packages"]]
+    return "\n".join(lines)
+
+
+# ── Processor snapshot ─────────────────────────────────────────────
+
+def _version(package: str) -> str:
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return "-"
+
+
+class ProcessorSnapshot:
+    """Pickled processor under `directory`, one file per (model path, package versions)."""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory).expanduser()
+        self.hits = 0
+        self.misses = 0
+        self.last_error: str | None = None
+
+    def path_for(self, model_path: str) -> Path:
+        versions = ",".join(f"{p}={_version(p)}" for p in _SNAPSHOT_PACKAGES)
+        key = hashlib.sha256(f"{Path(model_path).resolve()}|{versions}".encode()).hexdigest()[:16]
+        return self.directory / f"processor-{key}.pkl"
+
+    def load(self, model_path: str) -> Any | None:
+        path = self.path_for(model_path)
+        try:
+            with path.open("rb") as f:
+                processor = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:  # Stale or truncated snapshot — rebuild it.
+            self.misses += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.warning(f"Processor snapshot {path} unreadable, rebuilding: {self.last_error}")
+            return None
+        self.hits += 1
+        return processor
+
+    def save(self, model_path: str, processor: Any) -> None:
+        path = self.path_for(model_path)
+        tmp = path.with_suffix(f".tmp{os.getpid()}")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with tmp.open("wb") as f:
+                pickle.dump(processor, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)  # Readers never see a half-written file.
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.warning(f"Processor snapshot not saved: {self.last_error}")
+            tmp.unlink(missing_ok=True)
+            return
+        logger.info(f"Processor snapshot saved to {path}")
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "directory": str(self.directory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "last_error": self.last_error,
+        }